@@ -924,8 +924,11 @@ class FindPathOptions(Options):
 class ExecutorOptions(Options):
     def __init__(self):
         self.local_executor = True
+        self.popen_supervisor = False
         self.executor_address = None
         self.eager_execution = False
+        self.critical_path_priority = False
+        self.critical_path_durations = None
         self.use_clonefile = True
         self.runner_dir_outputs = True
         self.dir_outputs_test_mode = False
@@ -951,6 +954,34 @@ class ExecutorOptions(Options):
             EnvConsumer('YA_EAGER_EXECUTION', hook=SetValueHook('eager_execution', return_true_if_enabled)),
             ConfigConsumer('local_executor'),
             ConfigConsumer('eager_execution'),
+            ArgConsumer(
+                ['--popen-supervisor'],
+                help='Watch output and exits of all Popen processes by a single thread',
+                hook=SetConstValueHook('popen_supervisor', True),
+                group=FEATURES_GROUP,
+                visible=HelpLevel.EXPERT,
+            ),
+            EnvConsumer('YA_POPEN_SUPERVISOR', hook=SetValueHook('popen_supervisor', return_true_if_enabled)),
+            ConfigConsumer('popen_supervisor'),
+            ArgConsumer(
+                ['--critical-path-priority'],
+                help='Start tasks with the longest remaining chain of dependants first',
+                hook=SetConstValueHook('critical_path_priority', True),
+                group=FEATURES_GROUP,
+                visible=HelpLevel.EXPERT,
+            ),
+            EnvConsumer(
+                'YA_CRITICAL_PATH_PRIORITY', hook=SetValueHook('critical_path_priority', return_true_if_enabled)
+            ),
+            ConfigConsumer('critical_path_priority'),
+            ArgConsumer(
+                ['--critical-path-durations'],
+                help='Execution log or statistics json with node durations to weight critical path priority',
+                hook=SetValueHook('critical_path_durations'),
+                group=FEATURES_GROUP,
+                visible=HelpLevel.EXPERT,
+            ),
+            ConfigConsumer('critical_path_durations'),
             ArgConsumer(
                 ['--executor-address'],
                 help="Don't start local executor, but use provided",
@@ -253,20 +253,24 @@ def _iter_cmds(args):
             yield c
 
 
-def _merge_nodes(x, y):
+def _merge_nodes(chain):
+    """Merges a chain of nodes, each the only dependency of the previous one, into the first node"""
+    head, tail = chain[0], chain[-1]
     ret = {
-        'uid': x['uid'],
-        'deps': y['deps'],
-        'inputs': y['inputs'],
-        'outputs': x['outputs'] + y['outputs'],
-        'cmds': list(_iter_cmds(y)) + list(_iter_cmds(x)),
+        'uid': head['uid'],
+        'deps': tail['deps'],
+        'inputs': tail['inputs'],
+        'outputs': [out for x in chain for out in x['outputs']],
+        'cmds': [cmd for x in reversed(chain) for cmd in _iter_cmds(x)],
     }
 
     for k in ('cache', 'broadcast', 'target_properties', 'platform', 'priority', 'kv'):
-        if k in x:
-            ret[k] = x[k]
+        if k in head:
+            ret[k] = head[k]
 
-    ret['tags'] = [y.get('kv', {}).get('p', 'unknown').lower()] + x.get('tags', []) + y.get('tags', [])
+    ret['tags'] = [x.get('kv', {}).get('p', 'unknown').lower() for x in reversed(chain[1:])]
+    for x in chain:
+        ret['tags'].extend(x.get('tags', []))
 
     return ret
 
@@ -277,33 +281,33 @@ def _optimize_graph(graph):
     for x in graph['graph']:
         by_uid[x['uid']] = x
 
-    r_deps = collections.defaultdict(list)
+    r_degree = collections.Counter()
 
-    for uid, node in by_uid.items():
-        for d in node['deps']:
-            r_deps[d].append(uid)
+    for node in by_uid.values():
+        r_degree.update(node['deps'])
+
+    def collapse(x):
+        chain = [x]
+        while len(x['deps']) == 1 and r_degree[x['deps'][0]] == 1:
+            x = by_uid[x['deps'][0]]
+            chain.append(x)
+        return _merge_nodes(chain) if len(chain) > 1 else x
 
     def iter_nodes():
+        # Preorder of depth-first traversal from results without recursion: graphs may be deeper than the stack
         visited = set()
-
-        def visit(x):
-            uid = x['uid']
-
-            if uid not in visited:
-                visited.add(uid)
-
-                while len(x['deps']) == 1 and len(r_deps[x['deps'][0]]) == 1:
-                    x = _merge_nodes(x, by_uid[x['deps'][0]])
-
-                yield x
-
-                for dep in x['deps']:
-                    for xx in visit(by_uid[dep]):
-                        yield xx
-
-        for n in graph['result']:
-            for x in visit(by_uid[n]):
-                yield x
+        stack = [iter(graph['result'])]
+
+        while stack:
+            for uid in stack[-1]:
+                if uid not in visited:
+                    visited.add(uid)
+                    x = collapse(by_uid[uid])
+                    yield x
+                    stack.append(iter(x['deps']))
+                    break
+            else:
+                stack.pop()
 
     return {
         'inputs': graph.get('inputs', {}),
@@ -2197,7 +2201,25 @@ def _should_run_tests(opts, target_tc):
     )
 
 
+def _enable_imprint_server(opts):
+    if not getattr(opts, 'imprint_server', False):
+        return False
+    imprint_enable_server_stage = stager.start('imprint_enable_server')
+    try:
+        if imprint.enable_server():
+            logger.debug("imprint server is enabled")
+            return True
+    except Exception:
+        logger.exception("Something goes wrong while enabling imprint server")
+    finally:
+        imprint_enable_server_stage.finish()
+    return False
+
+
 def _enable_imprint_fs_cache(opts):
+    # Server keeps content hashes on its own
+    if _enable_imprint_server(opts):
+        return
     if opts.cache_fs_read or opts.cache_fs_write:
         imprint_enable_fs_cache_stage = stager.start('imprint_enable_fs_cache')
         try:
@@ -0,0 +1,178 @@
+"""
+Graph json reading and writing node by node.
+
+Json graph is read without its whole text in memory, strings repeated among nodes (uids of dependencies,
+inputs, command arguments) are stored once. Graph is written without its whole json text in memory.
+"""
+
+import codecs
+import gc
+import json
+import logging
+
+import six
+
+import exts.yjson as yjson
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 4 * 1024 * 1024
+GRAPH_KEY = 'graph'
+
+
+class GraphStreamError(ValueError):
+    pass
+
+
+def _interning_hook():
+    memo = {}
+    get = memo.setdefault
+    # Strings of other types are just not interned
+    text_type = six.text_type
+
+    def hook(pairs):
+        # Nested objects are already processed, lists of strings are common (deps, inputs, cmd_args)
+        return {
+            get(k, k): (
+                get(v, v)
+                if type(v) is text_type
+                else [get(x, x) if type(x) is text_type else x for x in v] if type(v) is list else v
+            )
+            for k, v in pairs
+        }
+
+    return hook
+
+
+class _Reader(object):
+    def __init__(self, fp, decoder):
+        self._fp = fp
+        self._text_decoder = None
+        self._decoder = decoder
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=READ_SIZE):
+        data = self._fp.read(size)
+        if isinstance(data, six.binary_type):
+            if self._text_decoder is None:
+                self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+            data = self._text_decoder.decode(data, final=not data)
+        if not data:
+            self._eof = True
+            return
+        self._buf = self._buf[self._pos :] + data
+        self._pos = 0
+
+    def peek(self):
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if self._eof:
+                raise GraphStreamError('Unexpected end of graph json')
+            self._fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise GraphStreamError('Expected one of {!r} at graph json, found {!r}'.format(chars, char))
+        self._pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+                value, end = None, None
+            # A number or a literal may continue in the data not read yet
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            # Values larger than the buffer are parsed again from their start, so the buffer grows exponentially
+            self._fill(max(READ_SIZE, len(self._buf) - self._pos))
+
+
+def iter_graph(fp):
+    """
+    Reads graph json object from fp, yields (key, value) of its items.
+
+    Value of the 'graph' item is an iterator over nodes, which must be consumed before the next item.
+    """
+    reader = _Reader(fp, json.JSONDecoder(object_pairs_hook=_interning_hook()))
+
+    def iter_nodes():
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.expect(']')
+            return
+        while True:
+            yield reader.value()
+            if reader.expect(',]') == ']':
+                return
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == GRAPH_KEY and reader.peek() == '[':
+            yield key, iter_nodes()
+        else:
+            yield key, reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+def load_graph(fp):
+    graph = {}
+    # Graph has no reference cycles, collections while loading it only take time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for key, value in iter_graph(fp):
+            graph[key] = list(value) if key == GRAPH_KEY and not isinstance(value, list) else value
+    finally:
+        if gc_enabled:
+            gc.enable()
+    logger.debug('Loaded graph of %d nodes', len(graph.get(GRAPH_KEY, [])))
+    return graph
+
+
+def dump_graph(graph, fp, indent=None, sort_keys=False, **kwargs):
+    """Writes graph as json.dump does, json text of every node is written separately"""
+    if indent:
+        kwargs['indent'] = indent
+    kwargs['sort_keys'] = sort_keys
+    item_sep = ',' if indent else ', '
+
+    def newline(level):
+        return '\n' + ' ' * indent * level if indent else ''
+
+    def dumps(obj, level):
+        s = yjson.dumps(obj, **kwargs)
+        return s.replace('\n', newline(level)) if indent else s
+
+    keys = sorted(graph) if sort_keys else list(graph)
+    fp.write('{')
+    for i, key in enumerate(keys):
+        fp.write((item_sep if i else '') + newline(1) + yjson.dumps(key) + ': ')
+        value = graph[key]
+        if key != GRAPH_KEY or not value:
+            fp.write(dumps(value, 1))
+            continue
+
+        fp.write('[')
+        for j, node in enumerate(value):
+            fp.write((item_sep if j else '') + newline(2) + dumps(node, 2))
+        fp.write(newline(1) + ']')
+    fp.write((newline(0) if keys else '') + '}')
@@ -20,6 +20,7 @@ import build.build_plan as bp
 import build.build_result as br
 import build.gen_plan as gp
 import build.graph as lg
+import build.graph_stream as graph_stream
 import build.makefile as mk
 import build.owners as ow
 import build.reports.autocheck_report as ar
@@ -880,7 +881,7 @@ class Context(object):
             self.make_files = make_files or []
         elif opts.custom_json is not None and opts.custom_json:
             with udopen(opts.custom_json) as custom_json_file:
-                self.graph = json.load(custom_json_file)
+                self.graph = graph_stream.load_graph(custom_json_file)
                 lg.finalize_graph(self.graph, opts)
             self.tests = []
             self.stripped_tests = []
@@ -1214,10 +1215,10 @@ class Context(object):
 
         if self.opts.dump_graph_file:
             with open(self.opts.dump_graph_file, 'w') as gf:
-                json.dump(graph_to_dump, gf, sort_keys=True, indent=4, default=str)
+                graph_stream.dump_graph(graph_to_dump, gf, sort_keys=True, indent=4, default=str)
         else:
             stdout = self.opts.stdout or sys.stdout
-            json.dump(graph_to_dump, stdout, sort_keys=True, indent=4, default=str)
+            graph_stream.dump_graph(graph_to_dump, stdout, sort_keys=True, indent=4, default=str)
             stdout.flush()
 
         self._timer.show_step("dump_graph finished")
@@ -1871,7 +1872,7 @@ class YaMake(object):
 
                 if self.opts.dump_distbuild_graph:
                     with open(self.opts.dump_distbuild_graph, 'w') as graph_file:
-                        json.dump(graph, graph_file)
+                        graph_stream.dump_graph(graph, graph_file)
 
                 def activate_callback(res=None, build_stage=None):
                     try:
@@ -447,6 +447,7 @@ class EventLogFileOptions(Options):
         self.dump_failed_node_info_to_evlog = False
         self.evlog_dump_node_stat = False
         self.compress_evlog = True
+        self.async_evlog = False
 
     @staticmethod
     def consumer():
@@ -511,6 +512,15 @@ class EventLogFileOptions(Options):
             ),
             EnvConsumer(name='YA_NO_COMPRESS_EVLOG', hook=SetConstValueHook('compress_evlog', False)),
             ConfigConsumer('compress_evlog'),
+            ArgConsumer(
+                ['--async-evlog'],
+                help='Serialize and compress evlog events in a background thread',
+                hook=SetConstValueHook('async_evlog', True),
+                group=PRINT_CONTROL_GROUP,
+                visible=HelpLevel.INTERNAL,
+            ),
+            EnvConsumer(name='YA_ASYNC_EVLOG', hook=SetValueHook('async_evlog', return_true_if_enabled)),
+            ConfigConsumer('async_evlog'),
         ]
 
     def postprocess2(self, params):
@@ -1,6 +1,7 @@
 import logging
 import os
 import tempfile
+import threading
 
 from six import iteritems
 
@@ -37,24 +38,28 @@ class ThreadPoolMapper(SimpleMapper):
         def map(*args, **kwargs):
             return list(map(*args, **kwargs))
 
+    # Pool is shared by all mappers and created on the first large batch
     pool = None
+    _pool_lock = threading.Lock()
+    # Smaller batches are mapped in the calling thread
+    MIN_POOL_ITEMS = 64
 
     @classmethod
     def _init_pool(cls):
-        try:
-            if cls.pool is None:
-                cls.pool = ThreadPool(cpu_count())
-        except RuntimeError:
-            logging.exception("Can't create thread pool for ThreadPoolMapper; Using FakePool")
-            cls.pool = cls._FakePool()
-
-    def __init__(self, f):
-        super(ThreadPoolMapper, self).__init__(f)
-        self.pool = ThreadPool(cpu_count())
+        with cls._pool_lock:
+            try:
+                if cls.pool is None:
+                    cls.pool = ThreadPool(cpu_count())
+            except RuntimeError:
+                logging.exception("Can't create thread pool for ThreadPoolMapper; Using FakePool")
+                cls.pool = cls._FakePool()
+        return cls.pool
 
     def __call__(self, *items):
+        if len(items) < self.MIN_POOL_ITEMS:
+            return super(ThreadPoolMapper, self).__call__(*items)
         # TODO: yieldable map?
-        return dict(zip(items, self.pool.map(self.f, items)))
+        return dict(zip(items, self._init_pool().map(self.f, items)))
 
 
 class Stats:
@@ -104,6 +109,13 @@ class BaseCache(object):
     def __contains__(self, item):
         return item in self._cache
 
+    def __iter__(self):
+        return iter(list(self._cache))
+
+    def discard(self, *items):
+        for item in items:
+            self._cache.pop(item, None)
+
     def __getitem__(self, item):
         # TODO: Wait for ready?
         if item in self._cache:
@@ -0,0 +1,185 @@
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import six
+
+import core.resource
+import exts.yjson as json
+from exts import hashing
+from core.config import misc_root, find_root
+
+from .base import BaseMapper
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+SERVER_MODULE = 'core.imprint.server'
+# Server start includes loading of stored content hashes
+START_TIMEOUT = 30
+# Cold imprint of a large tree hashes all its files
+REQUEST_TIMEOUT = 30 * 60
+
+
+class ImprintServerError(Exception):
+    pass
+
+
+def get_socket_path(root=None):
+    root = root or find_root()
+    return os.path.join(misc_root(), 'imprint', 'v{}-{}.sock'.format(PROTOCOL_VERSION, hashing.fast_hash(root)))
+
+
+def request(socket_path, command, timeout=REQUEST_TIMEOUT, **kwargs):
+    message = dict(kwargs, command=command, version=PROTOCOL_VERSION)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(six.ensure_binary(json.dumps(message)) + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    finally:
+        sock.close()
+
+    if not line:
+        raise ImprintServerError('Connection is closed by imprint server')
+    response = json.loads(line)
+    if 'error' in response:
+        raise ImprintServerError(response['error'])
+    return response
+
+
+def spawn_server(socket_path, extra_args=()):
+    env = dict(os.environ)
+    env['YA_SOURCE_ROOT'] = find_root()
+    args = ['--socket', socket_path] + list(extra_args)
+    if core.resource.am_i_binary():
+        env['Y_PYTHON_ENTRY_POINT'] = SERVER_MODULE + ':main'
+        cmd = [sys.executable] + args
+    else:
+        cmd = [sys.executable, '-m', SERVER_MODULE] + args
+
+    logger.debug("Starting imprint server: %s", cmd)
+    with open(os.devnull, 'r+b') as devnull:
+        # Server outlives this process, so it is detached from its session
+        subprocess.Popen(
+            cmd, env=env, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid
+        )
+
+
+class ServerMapper(BaseMapper):
+    """Maps paths to imprints with the imprint server, f calculates them locally if the server is unavailable"""
+
+    def __init__(self, f, socket_path=None, spawn=True):
+        super(ServerMapper, self).__init__(f)
+        self.socket_path = socket_path or get_socket_path()
+        self._spawn = spawn
+        self._available = False
+
+    def _ping(self):
+        try:
+            request(self.socket_path, 'ping', timeout=START_TIMEOUT)
+            return True
+        except (EnvironmentError, ImprintServerError) as e:
+            logger.debug("Imprint server is not available at %s: %s", self.socket_path, e)
+            return False
+
+    def connect(self):
+        self._available = self._ping()
+        if self._available or not self._spawn or os.name != 'posix':
+            return self._available
+
+        spawn_server(self.socket_path)
+        deadline = time.time() + START_TIMEOUT
+        while not self._available and time.time() < deadline:
+            time.sleep(0.05)
+            self._available = os.path.exists(self.socket_path) and self._ping()
+
+        if not self._available:
+            logger.warning("Imprint server is not started in %s seconds", START_TIMEOUT)
+        return self._available
+
+    def __call__(self, *items):
+        if self._available:
+            try:
+                return request(self.socket_path, 'imprint', paths=items)['imprints']
+            except (EnvironmentError, ImprintServerError) as e:
+                logger.warning("Imprint server failed, imprints are calculated locally: %s", e)
+                self._available = False
+        return self.f(*items)
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    files_per_dir = 100
+    dirs_per_dir = 10
+
+    tmp = tempfile.mkdtemp()
+    root = os.path.join(tmp, 'arcadia')
+    os.environ['YA_SOURCE_ROOT'] = root
+
+    from core.imprint.base import BaseCache, SimpleMapper
+    from core.imprint.imprint import Imprint
+
+    def make_tree(path, count):
+        os.makedirs(path)
+        files = min(count, files_per_dir)
+        for i in six.moves.xrange(files):
+            with open(os.path.join(path, 'f{}.cpp'.format(i)), 'w') as f:
+                f.write('int f{}() {{ return {}; }}\n'.format(i, i) * 20)
+        count -= files
+        if count:
+            share = (count + dirs_per_dir - 1) // dirs_per_dir
+            for i in six.moves.xrange(dirs_per_dir):
+                part = min(share, count)
+                if part:
+                    make_tree(os.path.join(path, 'd{}'.format(i)), part)
+                    count -= part
+
+    def timed(name, f):
+        start = time.time()
+        result = f()
+        print('{}: {:.2f}s'.format(name, time.time() - start))
+        return result
+
+    try:
+        timed('create tree of {} files'.format(qty), lambda: make_tree(root, qty))
+        targets = [os.path.join(root, name) for name in sorted(os.listdir(root)) if name.startswith('d')]
+        changed = os.path.join(root, 'd0', 'f0.cpp')
+
+        serial = Imprint()
+        serial._content_hash = BaseCache("content_hash", SimpleMapper(hashing.fast_filehash))
+        expected = timed('local, serial hashing', lambda: serial(*targets))
+        timed('local, thread pool hashing', lambda: Imprint()(*targets))
+
+        for mode, args in ('inotify', []), ('signature checks', ['--no-inotify']):
+            name = mode.replace(' ', '_')
+            path = os.path.join(tmp, name + '.sock')
+            # Servers do not share stored content hashes
+            os.environ['YA_CACHE_DIR'] = os.path.join(tmp, name)
+            spawn_server(path, args)
+            while not os.path.exists(path):
+                time.sleep(0.05)
+
+            def query():
+                return request(path, 'imprint', paths=targets)['imprints']
+
+            assert timed('server ({}), cold'.format(mode), query) == expected
+            timed('server ({}), warm'.format(mode), query)
+            with open(changed, 'a') as f:
+                f.write('// {}\n'.format(mode))
+            imprints = timed('server ({}), 1 file changed'.format(mode), query)
+            assert imprints != expected
+            expected = imprints
+            request(path, 'stop')
+            while os.path.exists(path):
+                time.sleep(0.05)
+    finally:
+        shutil.rmtree(tmp)
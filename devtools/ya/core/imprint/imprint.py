@@ -8,7 +8,8 @@ from core.config import misc_root, find_root
 
 # from yalibrary.monitoring import YaMonEvent
 
-from .base import SimpleMapper, BaseCache, BaseFileCache
+from .base import SimpleMapper, ThreadPoolMapper, BaseCache, BaseFileCache
+from .client import ServerMapper
 from .change_list import ChangeList
 
 
@@ -52,16 +53,24 @@ class ArcPath:
         return path
 
 
+def file_signature(abs_path):
+    """mtime alone misses changes within its granularity and files replaced by older ones"""
+    st = os.stat(abs_path)
+    # Integer nanoseconds survive json round trip, float seconds lose precision there
+    mtime_ns = getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+    return [mtime_ns, st.st_size, st.st_ino]
+
+
 class YaStoredCache(BaseFileCache):
     CACHE_PATH_DEFAULT = "{misc_root}/conf/cache/"
     CACHE_FILE_DEFAULT = "fs.cache.{version}"
-    CACHE_VERSION = 1
+    CACHE_VERSION = 2
 
     def __init__(self, name, f, read=True, write=True, cache_source_path=None, process_arcadia_clash=True):
         self.cache_source_path = cache_source_path
         self.process_arcadia_clash = process_arcadia_clash
 
-        super(YaStoredCache, self).__init__(name, f, check=self._mtime_files_check, read=read, write=write)
+        super(YaStoredCache, self).__init__(name, f, check=self._signature_check, read=read, write=write)
 
     def _generate_cache_path_parts(self):
         if self.cache_source_path:
@@ -89,12 +98,15 @@ class YaStoredCache(BaseFileCache):
         return os.path.join(path_name, file_name)
 
     @staticmethod
-    def _mtime_files_check(abs_path, result):
-        return os.stat(abs_path).st_mtime != result['check']
+    def _signature_check(abs_path, result):
+        try:
+            return file_signature(abs_path) != result['check']
+        except OSError:
+            return True
 
     def _update_cache(self, abs_path, result):
         return super(YaStoredCache, self)._update_cache(
-            abs_path, {'value': result, 'check': os.stat(abs_path).st_mtime}
+            abs_path, {'value': result, 'check': file_signature(abs_path)}
         )
 
     def _do_calcs(self, abs_paths):
@@ -187,7 +199,7 @@ class Imprint:
 
     @staticmethod
     def _new_content_hash():
-        return BaseCache("content_hash", SimpleMapper(hashing.fast_filehash))
+        return BaseCache("content_hash", ThreadPoolMapper(hashing.fast_filehash))
 
     def enable_fs(self, read=True, write=True, cache_source_path=None, process_arcadia_clash=True, quiet=False):
         # TODO: Check -xx
@@ -216,6 +228,20 @@ class Imprint:
             del self._content_hash
             self._content_hash = self._new_content_hash()
 
+    def enable_server(self, socket_path=None, spawn=True):
+        """Takes imprints from the long-lived imprint server, see core.imprint.server"""
+        if isinstance(self._dir_cache.f, ServerMapper):
+            self.logger.warning("Imprint server already enabled")
+            return True
+
+        mapper = ServerMapper(self._dir_cache.f, socket_path=socket_path, spawn=spawn)
+        if not mapper.connect():
+            return False
+
+        self.logger.debug("Enabling imprint server (%s)", mapper.socket_path)
+        self._dir_cache = BaseCache("dir_cache", mapper)
+        return True
+
     def __call__(self, *abs_paths):
         self._check_args(abs_paths)
         return self._dir_cache(*abs_paths)
@@ -0,0 +1,168 @@
+import ctypes
+import errno
+import logging
+import os
+import struct
+import sys
+
+import six
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# wd, mask, cookie, name length
+EVENT = struct.Struct('iIII')
+READ_SIZE = 1024 * 1024
+
+
+class WatchLimitExceeded(Exception):
+    pass
+
+
+class QueueOverflow(Exception):
+    pass
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def is_supported():
+    return _libc is not None
+
+
+def _encode(path):
+    return six.ensure_binary(path, errors='surrogateescape')
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Watcher(object):
+    """
+    Non-blocking inotify watcher of directories.
+
+    Events are read by the owner with pending_events(), so changes done before a query are always seen by it.
+    """
+
+    def __init__(self):
+        self._fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self._wds = {}
+        self._paths = {}
+
+    def __len__(self):
+        return len(self._wds)
+
+    def __contains__(self, path):
+        return path in self._wds
+
+    def add(self, path):
+        if path in self._wds:
+            return
+        try:
+            wd = _check(_libc.inotify_add_watch(self._fd, _encode(path), WATCH_MASK))
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise WatchLimitExceeded("Watch limit is exceeded after {} directories".format(len(self._wds)))
+            # Directory is removed or replaced already, the caller sees it on its own
+            logger.debug("Cannot watch %s: %s", path, e)
+            return
+        # Kernel returns the same wd for a directory renamed and then walked again
+        old_path = self._paths.get(wd)
+        if old_path is not None:
+            self._wds.pop(old_path, None)
+        self._wds[path] = wd
+        self._paths[wd] = path
+
+    def remove_tree(self, path):
+        """Stops watching path and its subdirectories, their paths are not valid anymore"""
+        prefix = os.path.join(path, '')
+        for p in [p for p in self._wds if p == path or p.startswith(prefix)]:
+            wd = self._wds.pop(p)
+            del self._paths[wd]
+            _libc.inotify_rm_watch(self._fd, wd)
+
+    def pending_events(self):
+        """Returns list of (path, mask) for all queued events, raises QueueOverflow if some events are lost"""
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, name_len = EVENT.unpack_from(data, pos)
+                pos += EVENT.size
+                name = data[pos : pos + name_len].rstrip(b'\0')
+                pos += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    raise QueueOverflow()
+                if mask & IN_IGNORED:
+                    path = self._paths.pop(wd, None)
+                    if path is not None:
+                        self._wds.pop(path, None)
+                    continue
+                path = self._paths.get(wd)
+                if path is None:
+                    continue
+                if name:
+                    path = os.path.join(path, six.ensure_str(name, errors='surrogateescape'))
+                events.append((path, mask))
+
+    def close(self):
+        os.close(self._fd)
+        self._wds.clear()
+        self._paths.clear()
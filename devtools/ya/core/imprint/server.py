@@ -0,0 +1,294 @@
+"""
+Long-lived imprint server.
+
+Keeps content hashes, directory listings and imprints of a source root in memory between ya invocations
+and answers imprint queries over a unix socket, see client.ServerMapper.
+Cached data is invalidated by inotify events, without inotify every query checks file signatures
+(mtime, size and inode) of all files and relists directories.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+
+import six
+from six.moves import socketserver
+
+import exts.yjson as json
+from exts import filelock, fs, hashing
+
+from . import client, inotify
+from .base import ThreadPoolMapper
+from .imprint import Imprint, YaStoredCache
+
+logger = logging.getLogger(__name__)
+
+# Server exits after this period without queries
+IDLE_TIMEOUT = 3 * 60 * 60
+# Changed content hashes are stored after this period without queries
+STORE_DELAY = 60
+CACHE_PATH = "{misc_root}/imprint/"
+
+# Events after which nothing cached under the path is valid
+_SELF_EVENTS = inotify.IN_MOVE_SELF | inotify.IN_DELETE_SELF
+_DIR_EVENTS = inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_CREATE | inotify.IN_DELETE
+# Events after which watches under the path are not valid
+_UNWATCH_EVENTS = _SELF_EVENTS | inotify.IN_MOVED_FROM | inotify.IN_DELETE
+
+
+class WatchedStoredCache(YaStoredCache):
+    """Stored content hashes, while watched an entry is checked once and then trusted until discarded"""
+
+    def __init__(self, *args, **kwargs):
+        self._trusted = set()
+        self.watched = False
+        super(WatchedStoredCache, self).__init__(*args, **kwargs)
+
+    def _need_calc(self, item):
+        if item in self._trusted:
+            return False
+        need_calc = super(WatchedStoredCache, self)._need_calc(item)
+        if self.watched and not need_calc:
+            self._trusted.add(item)
+        return need_calc
+
+    def _update_cache(self, item, result):
+        item, result = super(WatchedStoredCache, self)._update_cache(item, result)
+        if self.watched:
+            self._trusted.add(item)
+        return item, result
+
+    def discard(self, *items):
+        super(WatchedStoredCache, self).discard(*items)
+        self._trusted.difference_update(items)
+
+    def distrust(self):
+        self._trusted.clear()
+
+
+class ServedImprint(Imprint):
+    def __init__(self, watch=True):
+        super(ServedImprint, self).__init__()
+        # Raw mapper: an inner cache would return old hashes for changed files
+        self._content_hash = WatchedStoredCache(
+            'content_hash_fs', ThreadPoolMapper(hashing.fast_filehash), cache_source_path=CACHE_PATH
+        )
+        self._listings = {}
+        self._file_imprints = {}
+        self._watcher = None
+        if watch and inotify.is_supported():
+            self._watcher = inotify.Watcher()
+            self._content_hash.watched = True
+
+    def _stop_watching(self):
+        self._watcher.close()
+        self._watcher = None
+        self._content_hash.watched = False
+        self._content_hash.distrust()
+        self._listings.clear()
+        self._file_imprints.clear()
+
+    def _watch(self, abs_path):
+        if self._watcher is not None:
+            try:
+                self._watcher.add(abs_path)
+            except inotify.WatchLimitExceeded as e:
+                logger.warning("%s, falling back to signature checks", e)
+                self._stop_watching()
+
+    # Base class memoizes these for the whole process, here the tree changes between queries
+    @staticmethod
+    def _is_build_file(abs_p):
+        return os.path.isfile(abs_p) and not os.path.islink(abs_p) and not abs_p.endswith('.pyc')
+
+    def _is_build_dir(self, abs_p):
+        return os.path.isdir(abs_p) and not os.path.islink(abs_p) and os.path.basename(abs_p) not in self._excluded_dirs
+
+    def _listing(self, abs_path):
+        listing = self._listings.get(abs_path)
+        if listing is None:
+            # Watch before listing, so changes made in between are not lost
+            self._watch(abs_path)
+            dirs, files = [], []
+            for name in os.listdir(abs_path):
+                path = os.path.join(abs_path, name)
+                if self._is_build_dir(path):
+                    dirs.append(path)
+                elif self._is_build_file(path):
+                    files.append(path)
+            listing = dirs, files
+            if self._watcher is not None:
+                self._listings[abs_path] = listing
+        return listing
+
+    def _do_iter_files(self, abs_path, yield_dirs=False, do_recursively=True):
+        if yield_dirs or not do_recursively or not self._is_build_dir(abs_path):
+            for path in super(ServedImprint, self)._do_iter_files(abs_path, yield_dirs, do_recursively):
+                yield path
+            return
+
+        stack = [abs_path]
+        while stack:
+            dirs, files = self._listing(stack.pop())
+            for path in files:
+                yield path
+            stack.extend(dirs)
+
+    def _do_file_bc(self, abs_path):
+        self._watch(os.path.dirname(abs_path))
+        return super(ServedImprint, self)._do_file_bc(abs_path)
+
+    def _do_file(self, abs_path):
+        imprint = self._file_imprints.get(abs_path)
+        if imprint is None:
+            imprint = super(ServedImprint, self)._do_file(abs_path)
+            if self._watcher is not None:
+                self._file_imprints[abs_path] = imprint
+        return imprint
+
+    def _discard(self, paths, subtrees):
+        if subtrees:
+            prefixes = tuple(os.path.join(path, '') for path in subtrees)
+            paths = set(paths)
+            for cache in self._content_hash, self._dir_cache:
+                paths.update(item for item in cache if item.startswith(prefixes))
+            paths.update(item for item in self._listings if item.startswith(prefixes))
+
+        # Imprints and listings of all directories above a path depend on it
+        dirs = set()
+        for path in paths:
+            while path not in dirs:
+                dirs.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+        self._content_hash.discard(*paths)
+        self._dir_cache.discard(*dirs)
+        for path in paths:
+            self._file_imprints.pop(path, None)
+        for path in dirs:
+            self._listings.pop(path, None)
+
+    def _apply_events(self):
+        try:
+            events = self._watcher.pending_events()
+        except inotify.QueueOverflow:
+            logger.info("Inotify queue overflow, all directories are watched and checked again")
+            self._stop_watching()
+            self._watcher = inotify.Watcher()
+            self._content_hash.watched = True
+            self._dir_cache.clear()
+            return
+
+        paths, subtrees = set(), set()
+        for path, mask in events:
+            paths.add(path)
+            if mask & _SELF_EVENTS or mask & inotify.IN_ISDIR and mask & _DIR_EVENTS:
+                subtrees.add(path)
+            if mask & _UNWATCH_EVENTS and (mask & inotify.IN_ISDIR or path in self._watcher):
+                self._watcher.remove_tree(path)
+        if paths:
+            logger.debug("%d paths are changed", len(paths))
+            self._discard(paths, subtrees)
+
+    def query(self, abs_paths):
+        if self._watcher is not None:
+            self._apply_events()
+        if self._watcher is None:
+            self._dir_cache.clear()
+        return self(*abs_paths)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            response = self.server.handle_message(json.loads(self.rfile.readline()))
+        except Exception as e:
+            logger.exception("Cannot handle request")
+            response = {'error': str(e)}
+        self.wfile.write(six.ensure_binary(json.dumps(response)) + b'\n')
+
+
+class ImprintServer(socketserver.UnixStreamServer):
+    timeout = STORE_DELAY
+
+    def __init__(self, socket_path, imprint, idle_timeout=IDLE_TIMEOUT):
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        self._imprint = imprint
+        self._idle_timeout = idle_timeout
+        self._last_request = time.time()
+        self._dirty = False
+        self._stopped = False
+
+    def handle_message(self, message):
+        self._last_request = time.time()
+        if message.get('version') != client.PROTOCOL_VERSION:
+            return {'error': "Unsupported protocol version {}".format(message.get('version'))}
+
+        command = message.get('command')
+        if command == 'ping':
+            return {}
+        if command == 'imprint':
+            self._dirty = True
+            return {'imprints': self._imprint.query(message['paths'])}
+        if command == 'stop':
+            self._stopped = True
+            return {}
+        return {'error': "Unknown command {}".format(command)}
+
+    def handle_timeout(self):
+        if self._dirty:
+            self._imprint.store()
+            self._dirty = False
+        if time.time() - self._last_request > self._idle_timeout:
+            logger.info("No requests for %s seconds, exiting", self._idle_timeout)
+            self._stopped = True
+
+    def serve(self):
+        while not self._stopped:
+            self.handle_request()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--socket', help='Socket path, default is derived from the source root')
+    parser.add_argument('--idle-timeout', type=int, default=IDLE_TIMEOUT, help='Exit after this many idle seconds')
+    parser.add_argument('--no-inotify', action='store_true', help='Check file signatures on every query')
+    args = parser.parse_args(argv)
+
+    socket_path = args.socket or client.get_socket_path()
+    fs.create_dirs(os.path.dirname(socket_path))
+    logging.basicConfig(
+        filename=socket_path + '.log', filemode='w', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s'
+    )
+
+    lock = filelock.FileLock(socket_path + '.lock')
+    if not lock.acquire(blocking=False):
+        logger.info("Another imprint server is serving %s", socket_path)
+        return
+    # Stored hashes are saved in the finally block below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    imprint = ServedImprint(watch=not args.no_inotify)
+    os.umask(0o077)
+    server = ImprintServer(socket_path, imprint, args.idle_timeout)
+    logger.info("Serving imprints at %s", socket_path)
+    try:
+        server.serve()
+    finally:
+        server.server_close()
+        imprint.store()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        lock.release()
+
+
+if __name__ == '__main__':
+    main()
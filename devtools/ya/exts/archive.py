@@ -18,10 +18,17 @@ from library.python.archive import (  # noqa
 )  # noqa
 
 
-def extract_from_tar(tar_file_path, output_dir, strip_components=None, apply_mtime=False, entry_filter=None):
+def extract_from_tar(
+    tar_file_path, output_dir, strip_components=None, apply_mtime=False, entry_filter=None, threads=None
+):
     exts.fs.create_dirs(output_dir)
     archive.extract_tar(
-        tar_file_path, output_dir, strip_components=strip_components, apply_mtime=apply_mtime, entry_filter=entry_filter
+        tar_file_path,
+        output_dir,
+        strip_components=strip_components,
+        apply_mtime=apply_mtime,
+        entry_filter=entry_filter,
+        threads=threads,
     )
 
 
@@ -63,6 +70,16 @@ def create_tar(
         shutil.move(temp_tar_path, tar_file_path)
 
 
+def write_tar(paths, fd, fixed_mtime=0, onerror=None, postprocess=None, dereference=False):
+    '''
+    Writes uncompressed tar to a file descriptor (e.g. of a pipe), see create_tar
+    '''
+    if isinstance(paths, six.string_types):
+        # (path, arcname)
+        paths = [(paths, ".")]
+    archive.tar(paths, fd, None, None, fixed_mtime, onerror, postprocess, dereference)
+
+
 def check_archive(tar_file_path):
     return archive.check_tar(tar_file_path)
 
@@ -1,10 +1,14 @@
+import contextlib
 import os
 import hashlib
+import mmap
 from hashlib import md5  # hashlib.md5 deprecated
 import six
 
 import exts.os2
 
+MMAP_HASH_THRESHOLD = 2**20
+
 
 def git_like_hash_with_size(filepath, follow_links=False):
     """
@@ -19,14 +23,20 @@ def git_like_hash_with_size(filepath, follow_links=False):
     file_size = 0
 
     with open(filepath, 'rb') as f:
-        while True:
-            block = f.read(2**16)
-
-            if not block:
-                break
-
-            file_size += len(block)
-            sha.update(block)
+        if os.fstat(f.fileno()).st_size >= MMAP_HASH_THRESHOLD:
+            # Single update over the mapping: no per-block copies and GIL is released for the whole file
+            with contextlib.closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as m:
+                file_size = len(m)
+                sha.update(m)
+        else:
+            while True:
+                block = f.read(2**16)
+
+                if not block:
+                    break
+
+                file_size += len(block)
+                sha.update(block)
 
     sha.update(six.ensure_binary('\0'))
     sha.update(six.ensure_binary(str(file_size)))
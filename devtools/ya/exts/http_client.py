@@ -2,9 +2,11 @@ import base64
 import hashlib
 import logging
 import os
+import re
 import six
 import socket
 import stat
+import threading
 import time
 
 from six.moves import urllib
@@ -21,6 +23,15 @@ import typing as tp  # noqa
 
 logger = logging.getLogger(__name__)
 
+# Smaller resources are downloaded over a single connection
+PARALLEL_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024
+PARALLEL_DOWNLOAD_MIN_SEGMENT = 16 * 1024 * 1024
+PARALLEL_DOWNLOAD_STREAMS = 4
+# Attempts to continue downloading of a range from its last received byte
+RESUME_ATTEMPTS = 5
+DOWNLOAD_READ_SIZE = 1024 * 1024
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
 hasher_map = {
     'md5': hashlib.md5,
     'sha1': hashlib.sha1,
@@ -56,6 +67,10 @@ class DownloadTimeoutException(Exception):
     temporary = True
 
 
+class RangeNotSupportedException(Exception):
+    temporary = True
+
+
 def make_user_agent():
     return 'ya: {host}'.format(host=socket.gethostname())
 
@@ -95,51 +110,273 @@ def download_file_with_integrity(url, path, integrity, integrity_encoding='base6
     exts.fs.create_dirs(os.path.dirname(path))
 
     checksum = hasher_map.get(alg)()
-    chunks_sizes = []
 
     logger.debug('Downloading %s to %s, expect %s', url, path, integrity)
     start_time = time.time()
+    res = _open_resource(url, headers)
+    size = _get_full_size(res)
+    if res.getcode() == 206 and size is not None and size >= PARALLEL_DOWNLOAD_MIN_SIZE:
+        segments = _download_segments(url, path, headers, res, size, checksum)
+    else:
+        segment = _Segment(0, size, resumable=res.getcode() == 206)
+        with open(path, 'wb') as dest_file:
+
+            def write(data):
+                dest_file.write(data)
+                checksum.update(data)
+
+            _fetch_segment(url, headers, segment, write, res)
+        segments = [segment]
+
+    checksum_str = _check_integrity(checksum, alg, expected_integrity, integrity_encoding)
+
+    os.chmod(path, stat.S_IREAD | stat.S_IWRITE | stat.S_IRGRP | stat.S_IROTH | mode)
+
+    _log_finished(url, path, alg, checksum_str, segments, start_time)
+
+
+def download_stream_with_integrity(url, write, integrity, integrity_encoding='base64', headers=None):
+    # type: (str, tp.Callable[[bytes], tp.Any], str, str, dict[str, str] | None) -> int
+    """
+    Passes resource content to write in order, checks integrity after the last byte.
+
+    Interrupted download is continued from the last passed byte if the server supports ranges,
+    otherwise the error is raised, as the content passed so far cannot be taken back. Returns the content size.
+    """
+    alg, expected_integrity = integrity.split("-")
+
+    if alg not in hasher_map:
+        raise BadIntegrityAlgorithmException(alg)
+
+    checksum = hasher_map.get(alg)()
+
+    logger.debug('Downloading %s to stream, expect %s', url, integrity)
+    start_time = time.time()
+    res = _open_resource(url, headers)
+    segment = _Segment(0, _get_full_size(res), resumable=res.getcode() == 206)
+
+    def hashed_write(data):
+        checksum.update(data)
+        write(data)
+
+    _fetch_segment(url, headers, segment, hashed_write, res)
+
+    checksum_str = _check_integrity(checksum, alg, expected_integrity, integrity_encoding)
+    _log_finished(url, 'stream', alg, checksum_str, [segment], start_time)
+    return segment.pos
+
+
+def _open_resource(url, headers):
     try:
-        request = urllib.request.Request(url)
-        for k, v in six.iteritems(make_headers(headers=headers)):
-            request.add_header(k, v)
-        if library.python.windows.on_win():
-            # windows firewall hack
-            timeout = socket._GLOBAL_DEFAULT_TIMEOUT
-        else:
-            timeout = 30
-        res = urllib.request.urlopen(request, timeout=timeout)
-    except urllib.error.URLError as e:
-        if isinstance(e.reason, socket.timeout):
-            raise DownloadTimeoutException(e)
-        else:
-            raise e
-    except socket.timeout as e:
-        raise DownloadTimeoutException(e)
+        # Range request tells whether the download can be resumed and split
+        res = _open(url, headers, 'bytes=0-')
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # Empty resource has no satisfiable range
+        res = _open(url, headers)
 
     logger.debug('Request to %s has headers %s', url, res.info())
+    return res
 
-    with open(path, 'wb') as dest_file:
-        exts.io2.copy_stream(res.read, dest_file.write, checksum.update, lambda d: chunks_sizes.append(len(d)))
 
+def _check_integrity(checksum, alg, expected_integrity, integrity_encoding):
     checksum_str = integrity_encodings.get(integrity_encoding)(checksum)
 
     if expected_integrity and expected_integrity != checksum_str:
         raise BadMD5Exception('{} sum expected {}, but was {}'.format(alg, expected_integrity, checksum_str))
+    return checksum_str
 
-    os.chmod(path, stat.S_IREAD | stat.S_IWRITE | stat.S_IRGRP | stat.S_IROTH | mode)
 
+def _log_finished(url, path, alg, checksum_str, segments, start_time):
+    elapsed = time.time() - start_time
+    downloaded = sum(segment.pos - segment.start for segment in segments)
     logger.debug(
-        'Downloading finished %s to %s, %s=%s, size=%s, elapsed=%f',
+        'Downloading finished %s to %s, %s=%s, size=%s, elapsed=%f, speed=%.1fMiB/s, streams=%d, resumes=%d',
         url,
         path,
         alg,
         checksum_str,
-        str(sum(chunks_sizes)),
-        time.time() - start_time,
+        str(downloaded),
+        elapsed,
+        downloaded / (1024.0 * 1024) / max(elapsed, 1e-6),
+        len(segments),
+        sum(segment.resumes for segment in segments),
     )
 
 
+class _Segment(object):
+    def __init__(self, start, end, resumable=True):
+        # end is exclusive, None if the size is unknown
+        self.start = start
+        self.pos = start
+        self.end = end
+        self.resumable = resumable
+        self.resumes = 0
+        self.done = False
+        self.error = None
+
+
+def _open(url, headers, byte_range=None):
+    # type: (str, dict[str, str] | None, str | None) -> tp.Any
+    request = urllib.request.Request(url)
+    for k, v in six.iteritems(make_headers(headers=headers)):
+        request.add_header(k, v)
+    if byte_range:
+        request.add_header('Range', byte_range)
+    if library.python.windows.on_win():
+        # windows firewall hack
+        timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+    else:
+        timeout = 30
+    try:
+        return urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, socket.timeout):
+            raise DownloadTimeoutException(e)
+        else:
+            raise e
+    except socket.timeout as e:
+        raise DownloadTimeoutException(e)
+
+
+def _open_range(url, headers, start, end):
+    # type: (str, dict[str, str] | None, int, int | None) -> tp.Any
+    res = _open(url, headers, 'bytes={}-{}'.format(start, '' if end is None else end - 1))
+    # Server may ignore the range and send the whole content
+    if res.getcode() != 206 or _get_range_start(res) != start:
+        res.close()
+        raise RangeNotSupportedException('Cannot continue downloading {} from byte {}'.format(url, start))
+    return res
+
+
+def _get_range_start(res):
+    match = CONTENT_RANGE_RE.match(res.info().get('Content-Range') or '')
+    return int(match.group(1)) if match else None
+
+
+def _get_full_size(res):
+    if res.getcode() == 206:
+        match = CONTENT_RANGE_RE.match(res.info().get('Content-Range') or '')
+        return int(match.group(3)) if match and match.group(3) != '*' else None
+    length = res.info().get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def _is_resumable_error(e):
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code >= 500
+    return isinstance(e, (DownloadTimeoutException, EnvironmentError, six.moves.http_client.HTTPException))
+
+
+def _fetch_segment(url, headers, segment, write, res=None, on_progress=None, cancelled=None):
+    """Passes segment content to write in order, continues from the last written byte after network errors"""
+    try:
+        while segment.pos != segment.end:
+            if cancelled is not None and cancelled.is_set():
+                return
+            try:
+                if res is None:
+                    res = _open_range(url, headers, segment.pos, segment.end)
+                size = DOWNLOAD_READ_SIZE if segment.end is None else min(DOWNLOAD_READ_SIZE, segment.end - segment.pos)
+                data = res.read(size)
+                if not data and segment.end is not None:
+                    raise six.moves.http_client.IncompleteRead(b'', segment.end - segment.pos)
+            except Exception as e:
+                if res is not None:
+                    res.close()
+                    res = None
+                if not segment.resumable or segment.resumes >= RESUME_ATTEMPTS or not _is_resumable_error(e):
+                    raise
+                segment.resumes += 1
+                logger.debug('Downloading %s is interrupted at byte %d (%s), continuing', url, segment.pos, repr(e))
+                time.sleep(segment.resumes)
+                continue
+
+            if not data:
+                return
+            # Errors of the consumer are not retried
+            write(data)
+            segment.pos += len(data)
+            if on_progress is not None:
+                on_progress()
+    finally:
+        if res is not None:
+            res.close()
+
+
+def _download_segments(url, path, headers, res, size, checksum):
+    """
+    Downloads ranges of the resource concurrently to their offsets in the file.
+
+    Content is hashed in order by the calling thread as soon as the beginning of the file is downloaded,
+    the first range is read from the already opened response.
+    """
+    count = min(PARALLEL_DOWNLOAD_STREAMS, size // PARALLEL_DOWNLOAD_MIN_SEGMENT or 1)
+    bounds = [size * i // count for i in range(count + 1)]
+    segments = [_Segment(start, end) for start, end in zip(bounds, bounds[1:])]
+    progress = threading.Condition()
+    cancelled = threading.Event()
+
+    with open(path, 'wb') as dest_file:
+        dest_file.truncate(size)
+
+    def notify():
+        with progress:
+            progress.notify()
+
+    def fetch(segment, res):
+        try:
+            with open(path, 'r+b') as dest_file:
+                dest_file.seek(segment.start)
+
+                def write(data):
+                    dest_file.write(data)
+                    # Hashing thread reads the file by another file object
+                    dest_file.flush()
+
+                _fetch_segment(url, headers, segment, write, res, notify, cancelled)
+        except Exception as e:
+            segment.error = e
+        finally:
+            with progress:
+                segment.done = True
+                progress.notify()
+
+    threads = []
+    for segment in segments:
+        thread = threading.Thread(target=fetch, args=(segment, res), name='Download {}'.format(segment.start))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+        res = None
+
+    try:
+        # Unbuffered, a read-ahead buffer would keep bytes read before they were downloaded
+        with open(path, 'rb', buffering=0) as src_file:
+            for segment in segments:
+                hashed = segment.start
+                while hashed != segment.end:
+                    with progress:
+                        while segment.pos == hashed and not segment.done:
+                            progress.wait()
+                    if segment.error is not None:
+                        raise segment.error
+                    available = segment.pos
+                    if available == hashed and segment.done:
+                        raise six.moves.http_client.IncompleteRead(b'', segment.end - hashed)
+                    src_file.seek(hashed)
+                    exts.io2.copy_stream(
+                        lambda n: src_file.read(min(n, available - src_file.tell())), checksum.update
+                    )
+                    hashed = available
+    finally:
+        cancelled.set()
+        for thread in threads:
+            thread.join()
+    return segments
+
+
 def _http_call(url, method, data=None, headers=None, timeout=30):
     # type: (str, str, tp.Any, dict[str, str] | None, int) -> bytes
     logger.debug('%s request using urllib2 %s%s', method, url, ', {} bytes'.format(len(data)) if data else '')
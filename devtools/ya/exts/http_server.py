@@ -1,23 +1,77 @@
 from six.moves import SimpleHTTPServer
 from six.moves import socketserver as SocketServer
 import logging
+import os
+import re
 import threading
 
 logger = logging.getLogger(__name__)
 
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class _RangeReader(object):
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._f.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
 
 class SilentHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     def log_message(self, _, *__):
         return
 
+    def send_head(self):
+        # Single byte range requests are served like download servers do, so downloads can be resumed
+        match = RANGE_RE.match(self.headers.get('Range') or '')
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+
+        f = open(path, 'rb')
+        size = os.fstat(f.fileno()).st_size
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        if start > end:
+            f.close()
+            self.send_error(416)
+            return None
+
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        f.seek(start)
+        return _RangeReader(f, end - start + 1)
+
+
+class _SilentThreadingServer(SocketServer.ThreadingTCPServer):
+    # Ranges of a file may be requested concurrently
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close connections of partially read ranges
+        logger.debug('Request from %s failed', client_address, exc_info=True)
+
 
 class SilentHTTPServer(object):
-    def __init__(self, host='localhost', port=0):
+    def __init__(self, host='localhost', port=0, handler=SilentHandler):
         self.host = host
         self.port = port
+        self.handler = handler
 
     def __enter__(self):
-        self._httpd = SocketServer.TCPServer((self.host, 0), SilentHandler)
+        self._httpd = _SilentThreadingServer((self.host, 0), self.handler)
         self.port = self._httpd.socket.getsockname()[1]
         self._thread = threading.Thread(target=self._httpd.serve_forever)
         self._thread.start()
@@ -26,5 +80,6 @@ class SilentHTTPServer(object):
 
     def __exit__(self, type, value, traceback):
         self._httpd.shutdown()
+        self._httpd.server_close()
         self._thread.join()
         logger.info('Server stopped')
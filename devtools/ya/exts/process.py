@@ -85,6 +85,79 @@ def set_close_on_exec(stream):
         fcntl.fcntl(stream, fcntl.F_SETFD, flags)
 
 
+def can_fork():
+    return hasattr(os, 'fork')
+
+
+def make_pipe(buffer_size=None):
+    """Returns (read_fd, write_fd) of a new pipe, its buffer is enlarged to buffer_size where it is supported"""
+    read_fd, write_fd = os.pipe()
+    if buffer_size:
+        try:
+            import fcntl
+
+            if hasattr(fcntl, 'F_SETPIPE_SZ'):
+                fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, buffer_size)
+        except (ImportError, EnvironmentError) as e:
+            logger.debug("Pipe buffer size is not changed: %s", e)
+    return read_fd, write_fd
+
+
+def close_fds(keep_fds):
+    """Closes all descriptors except stdio and keep_fds"""
+    try:
+        max_fd = os.sysconf('SC_OPEN_MAX')
+    except (AttributeError, ValueError):
+        max_fd = 256
+    start = 3
+    for fd in sorted(keep_fds):
+        if fd >= start:
+            os.closerange(start, fd)
+            start = fd + 1
+    os.closerange(start, max_fd)
+
+
+class ForkedCall(object):
+    """
+    Calls func(*args) in a forked process.
+
+    The process keeps only stdio and keep_fds open, so it does not hold pipes of the parent
+    or of other forked calls. Exception of the call is passed to the parent through a pipe.
+    """
+
+    def __init__(self, func, args=(), keep_fds=()):
+        error_read_fd, error_write_fd = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            self._run(func, args, tuple(keep_fds) + (error_write_fd,), error_write_fd)
+        os.close(error_write_fd)
+        self._error_fd = error_read_fd
+
+    @staticmethod
+    def _run(func, args, keep_fds, error_fd):
+        code = 1
+        try:
+            close_fds(keep_fds)
+            func(*args)
+            code = 0
+        except BaseException as e:
+            try:
+                os.write(error_fd, six.ensure_binary(repr(e)))
+            except BaseException:
+                pass
+        finally:
+            os._exit(code)
+
+    def wait(self):
+        """Waits for the process, returns None if the call succeeded or its error otherwise"""
+        with os.fdopen(self._error_fd, 'rb') as f:
+            error = f.read()
+        _, status = os.waitpid(self.pid, 0)
+        if not status:
+            return None
+        return six.ensure_str(error, errors='replace') or 'exit status {}'.format(status)
+
+
 def wait_for_proc(proc, timeout=None):
     if timeout is None:
         return proc.communicate()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+import library.python.retry
+from exts import http_client
+from exts import http_server
+
+
+SIZE = 1024 * 1024
+
+
+class NoRangeHandler(http_server.SilentHandler):
+    def send_head(self):
+        return http_server.SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+
+
+class ResetHandler(http_server.SilentHandler):
+    """
+    Breaks responses of ranges starting at a segment boundary after an eighth of the range.
+    Resumed ranges start elsewhere, so every range is resumed once.
+    """
+
+    lock = threading.Lock()
+    ranges = []
+
+    def send_head(self):
+        f = http_server.SilentHandler.send_head(self)
+        if not isinstance(f, http_server._RangeReader):
+            return f
+        with self.lock:
+            self.ranges.append(self.headers['Range'])
+        if int(http_server.RANGE_RE.match(self.headers['Range']).group(1)) % (SIZE // 4) == 0:
+            return http_server._RangeReader(f, f._left // 8 + 1)
+        return f
+
+
+@pytest.fixture
+def server_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'server'
+    path.mkdir()
+    monkeypatch.chdir(path)
+    # Retries and resumes must not wait in tests
+    monkeypatch.setattr(library.python.retry, 'DEFAULT_SLEEP_FUNC', lambda x: None)
+    monkeypatch.setattr(http_client.time, 'sleep', lambda x: None)
+    return path
+
+
+@pytest.fixture
+def segments(monkeypatch):
+    monkeypatch.setattr(http_client, 'PARALLEL_DOWNLOAD_MIN_SIZE', SIZE // 4)
+    monkeypatch.setattr(http_client, 'PARALLEL_DOWNLOAD_MIN_SEGMENT', SIZE // 4)
+    result = []
+    download_segments = http_client._download_segments
+
+    def spy(*args):
+        result.extend(download_segments(*args))
+        return result
+
+    monkeypatch.setattr(http_client, '_download_segments', spy)
+    return result
+
+
+def make_resource(server_dir, size=SIZE):
+    data = os.urandom(size)
+    (server_dir / 'resource').write_bytes(data)
+    return data
+
+
+def download(port, path, data):
+    http_client.download_file(
+        'http://localhost:{}/resource'.format(port), str(path), expected_md5=hashlib.md5(data).hexdigest()
+    )
+    return path.read_bytes()
+
+
+def test_download_in_segments(server_dir, segments, tmp_path):
+    data = make_resource(server_dir)
+    with http_server.SilentHTTPServer() as server:
+        assert download(server.port, tmp_path / 'result', data) == data
+
+    assert len(segments) == http_client.PARALLEL_DOWNLOAD_STREAMS
+    assert [(s.start, s.pos) for s in segments] == [(i * SIZE // 4, (i + 1) * SIZE // 4) for i in range(4)]
+
+
+def test_download_resumes_after_reset(server_dir, segments, tmp_path):
+    data = make_resource(server_dir)
+    del ResetHandler.ranges[:]
+    with http_server.SilentHTTPServer(handler=ResetHandler) as server:
+        assert download(server.port, tmp_path / 'result', data) == data
+
+    assert [s.resumes for s in segments] == [1] * len(segments)
+
+
+def test_download_single_resource_resumes_after_reset(server_dir, tmp_path):
+    data = make_resource(server_dir)
+    del ResetHandler.ranges[:]
+    with http_server.SilentHTTPServer(handler=ResetHandler) as server:
+        assert download(server.port, tmp_path / 'result', data) == data
+
+    assert ResetHandler.ranges == ['bytes=0-', 'bytes={}-{}'.format(SIZE // 8 + 1, SIZE - 1)]
+
+
+def test_download_without_range_support(server_dir, segments, tmp_path):
+    data = make_resource(server_dir)
+    with http_server.SilentHTTPServer(handler=NoRangeHandler) as server:
+        assert download(server.port, tmp_path / 'result', data) == data
+
+    # Server answers 200 with the whole content, it is read over the first connection
+    assert segments == []
+
+
+def test_download_empty_resource(server_dir, tmp_path):
+    data = make_resource(server_dir, size=0)
+    with http_server.SilentHTTPServer() as server:
+        assert download(server.port, tmp_path / 'result', data) == b''
+
+
+def test_download_md5_mismatch(server_dir, segments, tmp_path):
+    make_resource(server_dir)
+    with http_server.SilentHTTPServer() as server:
+        with pytest.raises(http_client.BadMD5Exception):
+            download(server.port, tmp_path / 'result', b'other content')
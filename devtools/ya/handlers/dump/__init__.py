@@ -38,6 +38,7 @@ from core.yarg import (
     OptsHandler,
     ArgConsumer,
     FreeArgConsumer,
+    SingleFreeArgConsumer,
     SetValueHook,
     Options,
     SetConstValueHook,
@@ -369,6 +370,12 @@ class DumpYaHandler(CompositeHandler):
             description='All recipes used in tests',
             opts=self.common_opts + self.common_build_facade_opts() + [DumpTestListOptions(), DumpRecipesOptions()],
         )
+        self['critical-path'] = OptsHandler(
+            action=app.execute(action=do_critical_path),
+            description='Predicted wall time of a build graph for static, max_dist and critical path task orderings',
+            opts=self.common_opts + [CriticalPathReplayOptions()],
+            visible=False,
+        )
         self['debug'] = debug_handler
         if app_config.in_house:
             import devtools.ya.handlers.dump.arcadia_specific as arcadia_specific
@@ -956,6 +963,48 @@ class DumpRecipesOptions(Options):
         return res
 
 
+class CriticalPathReplayOptions(Options):
+    def __init__(self):
+        self.replay_graph = None
+        self.replay_durations = None
+        self.replay_threads = 8
+
+    def consumer(self):
+        return [
+            SingleFreeArgConsumer(
+                help='build graph json',
+                hook=SetValueHook('replay_graph'),
+            ),
+            ArgConsumer(
+                ['--durations'],
+                help='Execution log or build statistics with node durations, unit durations are used without it',
+                hook=SetValueHook('replay_durations'),
+                group=DUMP_OPTS_GROUP,
+            ),
+            ArgConsumer(
+                ['-j', '--threads'],
+                help='Number of simulated build threads',
+                hook=SetValueHook('replay_threads', int),
+                group=DUMP_OPTS_GROUP,
+            ),
+        ]
+
+    def postprocess(self):
+        if self.replay_threads < 1:
+            raise ArgsValidatingException('Error: number of threads must be positive')
+
+
+def do_critical_path(params):
+    from yalibrary.runner import critical_path
+
+    with open(params.replay_graph) as f:
+        graph = json.load(f)
+    durations = critical_path.load_durations(params.replay_durations) if params.replay_durations else None
+    times = critical_path.compare_orderings(graph, durations, params.replay_threads)
+    for name in 'static_priority', 'max_dist', 'critical_path', 'lower_bound':
+        print('{:<16} {:>12.3f}s'.format(name, times[name] / 1000.0))
+
+
 def do_dump_srcdeps(params):
     debug_options = []
     if params.with_yamake:
@@ -1,11 +1,23 @@
+import logging
 import os
 import shutil
+import time
+import zlib
 
 import library.python.compress
+import library.python.par_apply
 
 import multiprocessing
 import exts.tmp
 import exts.archive
+import exts.process
+
+import package
+
+logger = logging.getLogger(__name__)
+
+# Uncompressed size of an independently compressed block (gzip member or zstd frame)
+BLOCK_SIZE = 4 * 1024 * 1024
 
 
 def create_tarball_package(
@@ -40,13 +52,29 @@ def create_tarball_package(
                 )
         else:
             compression_filter, compression_level = None, None
-        exts.archive.create_tar(package_dir, tar_archive, compression_filter, compression_level, fixed_mtime=None)
 
-        if codec:
+        if codec and can_stream_tar():
+            # Tar is compressed as it is written, without an intermediate file
+            archive_file = os.path.join(temp_dir, archive_file + ".uc." + codec)
+            _stream_tar(
+                package_dir,
+                lambda stream: library.python.compress.compress_stream(stream, archive_file, codec, threads=threads),
+            )
+        elif codec:
+            exts.archive.create_tar(package_dir, tar_archive, fixed_mtime=None)
             uc_archive_path = archive_file + ".uc." + codec
             library.python.compress.compress(tar_archive, uc_archive_path, codec, threads=threads)
             archive_file = uc_archive_path
+        elif compression_filter and min(threads or 1, available_cpu_count()) > 1 and can_stream_tar():
+            # libarchive compresses in a single thread, blocks pay off only with spare cores
+            block_threads = min(threads, available_cpu_count())
+            _stream_tar(
+                package_dir,
+                lambda stream: compress_blocks(stream, tar_archive, compression_filter, compression_level, block_threads),
+            )
+            archive_file = tar_archive
         else:
+            exts.archive.create_tar(package_dir, tar_archive, compression_filter, compression_level, fixed_mtime=None)
             archive_file = tar_archive
 
         result_path = os.path.join(result_dir, os.path.basename(archive_file))
@@ -56,3 +84,104 @@ def create_tarball_package(
 
 def get_codecs_list():
     return library.python.compress.list_all_codecs()
+
+
+def available_cpu_count():
+    """Number of CPUs the process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def can_stream_tar():
+    return exts.process.can_fork()
+
+
+def _stream_tar(package_dir, consume):
+    """
+    Passes tar of package_dir as a binary stream to consume.
+
+    Tar is written by a forked process to a pipe: libarchive holds the GIL while it writes,
+    so the pipe cannot be read by a thread of the same process.
+    """
+    read_fd, write_fd = exts.process.make_pipe()
+    try:
+        writer = exts.process.ForkedCall(_write_tar, (package_dir, write_fd), keep_fds=(write_fd,))
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+
+    try:
+        with os.fdopen(read_fd, 'rb') as stream:
+            consume(stream)
+    finally:
+        # Tar writer stops with broken pipe if the stream is not read to the end
+        error = writer.wait()
+    if error is not None:
+        raise Exception("Creating tar of {} failed: {}".format(package_dir, error))
+
+
+def _write_tar(package_dir, write_fd):
+    exts.archive.write_tar(package_dir, write_fd, fixed_mtime=None)
+    os.close(write_fd)
+
+
+def _get_block_compressor(compression_filter, compression_level):
+    compression_level = exts.archive.get_compression_level(
+        compression_filter, exts.archive.Compression.Default if compression_level is None else compression_level
+    )
+    if compression_filter == exts.archive.GZIP:
+
+        def compress_gzip(data):
+            # Concatenated gzip members are a valid gzip stream
+            compressor = zlib.compressobj(compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+
+        return compress_gzip
+
+    if compression_filter == exts.archive.ZSTD:
+        import zstandard
+
+        def compress_zstd(data):
+            # Compressor objects are not thread safe, concatenated frames are a valid zstd stream
+            return zstandard.ZstdCompressor(level=compression_level).compress(data)
+
+        return compress_zstd
+
+    raise Exception("Unsupported compression filter {}".format(compression_filter))
+
+
+def compress_blocks(stream, output, compression_filter, compression_level, threads):
+    """Compresses blocks of stream in threads to the output file, returns (uncompressed, compressed) sizes"""
+    compress_block = _get_block_compressor(compression_filter, compression_level)
+    size = compressed_size = 0
+    start = time.time()
+
+    def iter_blocks():
+        while True:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+    with open(output, 'wb') as afile:
+        for block, compressed in library.python.par_apply.par_apply(
+            iter_blocks(), lambda block: (len(block), compress_block(block)), threads
+        ):
+            size += block
+            compressed_size += len(compressed)
+            afile.write(compressed)
+
+    elapsed = time.time() - start
+    package.display.emit_message(
+        'Compressed [[imp]]{:.1f}MiB[[rst]] to [[imp]]{:.1f}MiB[[rst]] with {} in {} threads: [[imp]]{:.1f}MiB/s'.format(
+            size / (1024.0 * 1024),
+            compressed_size / (1024.0 * 1024),
+            compression_filter,
+            threads,
+            size / (1024.0 * 1024) / max(elapsed, 1e-6),
+        )
+    )
+    return size, compressed_size
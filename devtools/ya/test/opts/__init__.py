@@ -1894,6 +1894,7 @@ class InterimOptions(core.yarg.Options):
     def __init__(self):
         self.cache_fs_read = False
         self.cache_fs_write = False
+        self.imprint_server = False
         self.merge_split_tests = True
         self.remove_result_node = False
         self.remove_tos = False
@@ -1956,6 +1957,17 @@ class InterimOptions(core.yarg.Options):
                 visible=self.Visible,
             ),
             core.yarg.ConfigConsumer('cache_fs_write'),
+            TestArgConsumer(
+                ['--imprint-server'],
+                help='Take imprints from the long-lived imprint server',
+                hook=core.yarg.SetConstValueHook('imprint_server', True),
+                visible=self.Visible,
+            ),
+            core.yarg.EnvConsumer(
+                'YA_IMPRINT_SERVER',
+                hook=core.yarg.SetValueHook('imprint_server', core.yarg.return_true_if_enabled),
+            ),
+            core.yarg.ConfigConsumer('imprint_server'),
             TestArgConsumer(
                 ['--test-failure-code'],
                 help='Exit code when tests fail',
@@ -1,6 +1,12 @@
 from __future__ import print_function
+import binascii
+import collections
+import mmap
+import os
 import struct
 
+import six
+
 # File format version, will be incremented for each incompatible change
 FORMAT_VERSION = 0x1007
 # Magic number in header for file format identification
@@ -12,12 +18,10 @@ BLOCK_SESSIONINFO = 0x10
 # Block identifier for execution data of a single class
 BLOCK_EXECUTIONDATA = 0x11
 
-_FMT_SIZE_MAP = {
-    1: ">B",
-    2: ">H",
-    4: ">L",
-    8: ">Q",
-}
+_UI8 = struct.Struct(">B")
+_UI16 = struct.Struct(">H")
+_UI64 = struct.Struct(">Q")
+_HEADER = struct.Struct(">BHH")
 
 
 class SessionInfo(object):
@@ -29,112 +33,204 @@ class SessionInfo(object):
 
 
 class ExecutionData(object):
-    def __init__(self, record_id, name, probes):
+    """Probes are kept packed as in exec file: bit i of byte i // 8 is probe i"""
+
+    def __init__(self, record_id, name, probes_count, probes_data):
         self.record_id = record_id
         self.name = name
-        self.probes = probes
-
-
-def load_report(filename):
-    arr = []
-    with open(filename, 'rb') as afile:
-        while True:
-            try:
-                block_type = read_ui8(afile)
-            except EOFError:
-                break
-
-            read_block(block_type, afile, arr)
-    return arr
-
-
-def read_block(btype, stream, sessions):
-    # fmt: off
-    return {
-        BLOCK_HEADER: read_header,
-        BLOCK_SESSIONINFO: read_session_info,
-        BLOCK_EXECUTIONDATA: read_execution_data,
-    }[btype](stream, sessions)
-    # fmt: on
-
-
-def read_header(stream, _sessions):
-    if read_ui16(stream) != MAGIC_NUMBER:
-        raise Exception("Invalid execution data file")
-    version = read_ui16(stream)
-    if version != FORMAT_VERSION:
-        raise Exception("Incompatible exec data version - expected ({}), got ({})".format(FORMAT_VERSION, version))
-
-
-def read_session_info(stream, sessions):
-    sid = read_utf(stream)
-    start = read_ui64(stream)
-    dump = read_ui64(stream)
-    sessions.append(SessionInfo(sid, start, dump))
-
+        self.probes_count = probes_count
+        self.probes_data = probes_data
 
-def read_execution_data(stream, sessions):
-    record_id = read_ui64(stream)
-    name = read_utf(stream)
-    probes = read_boolean_array(stream)
-    last = sessions[-1]
-    last.execution_data.append(ExecutionData(record_id, name, probes))
+    @property
+    def probes(self):
+        return unpack_probes(self.probes_count, self.probes_data)
 
 
-def read_boolean_array(stream):
-    size = read_var_int(stream)
-    arr = [0] * size
-    buf = 0
-    for i in range(0, size):
-        if (i % 8) == 0:
-            buf = read_ui8(stream)
-        arr[i] = (buf & 0x01) != 0
-        buf >>= 1
-    return arr
+def unpack_probes(count, data):
+    data = bytearray(data)
+    return [(data[i >> 3] >> (i & 7)) & 1 != 0 for i in six.moves.xrange(count)]
 
 
-def read_var_int(stream):
-    # Reads a variable length representation of an integer value
-    val = read_ui8(stream)
-    if (val & 0x80) == 0:
-        return val
-    return (val & 0x7F) | (read_var_int(stream) << 7)
-
-
-def read_bytes(stream, size):
-    data = stream.read(size)
-    dsize = len(data)
-    if dsize != size:
-        raise EOFError(
-            "Failed to read {} bytes (read data [{}] '{}' at pos: {})".format(
-                size,
-                len(data),
-                data,
-                stream.tell(),
-            )
-        )
-    return struct.unpack(_FMT_SIZE_MAP[size], data)[0]
-
-
-def read_ui8(stream):
-    return read_bytes(stream, 1)
-
-
-def read_ui16(stream):
-    return read_bytes(stream, 2)
-
-
-def read_ui64(stream):
-    return read_bytes(stream, 8)
-
-
-def read_utf(stream):
-    size = read_ui16(stream)
-    return stream.read(size).decode("utf8")
+def load_report(filename):
+    sessions = []
+    for btype, value in iter_blocks(map_file(filename)):
+        if btype == BLOCK_SESSIONINFO:
+            sid, start, dump = value
+            sessions.append(SessionInfo(sid.decode("utf8"), start, dump))
+        elif btype == BLOCK_EXECUTIONDATA:
+            record_id, name, count, data = value
+            # Copy detaches probes from the mapped file
+            sessions[-1].execution_data.append(ExecutionData(record_id, name.decode("utf8"), count, data.tobytes()))
+    return sessions
+
+
+def map_file(filename):
+    """Returns memoryview of the file content, mapped file is unmapped when all its views are released"""
+    with open(filename, 'rb') as afile:
+        if six.PY2 or not os.fstat(afile.fileno()).st_size:
+            return memoryview(afile.read())
+        return memoryview(mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def iter_blocks(data):
+    """
+    Yields (block type, value) for blocks of exec file content.
+
+    Value is format version for header, (sid, start, dump) for session info and
+    (class id, class name, probes count, packed probes) for execution data.
+    Strings are raw bytes of java modified utf-8, probes are a view of data.
+    """
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            (btype,) = _UI8.unpack_from(data, pos)
+            if btype == BLOCK_HEADER:
+                _, magic, version = _HEADER.unpack_from(data, pos)
+                pos += _HEADER.size
+                if magic != MAGIC_NUMBER:
+                    raise Exception("Invalid execution data file")
+                if version != FORMAT_VERSION:
+                    raise Exception(
+                        "Incompatible exec data version - expected ({}), got ({})".format(FORMAT_VERSION, version)
+                    )
+                yield btype, version
+            elif btype == BLOCK_SESSIONINFO:
+                sid, pos = _read_utf(data, pos + 1)
+                (start,) = _UI64.unpack_from(data, pos)
+                (dump,) = _UI64.unpack_from(data, pos + 8)
+                pos += 16
+                yield btype, (sid, start, dump)
+            elif btype == BLOCK_EXECUTIONDATA:
+                (record_id,) = _UI64.unpack_from(data, pos + 1)
+                name, pos = _read_utf(data, pos + 9)
+                count, pos = _read_var_int(data, pos)
+                size = (count + 7) >> 3
+                if pos + size > end:
+                    raise struct.error("probes of {} are truncated".format(name))
+                pos += size
+                yield btype, (record_id, name, count, data[pos - size : pos])
+            else:
+                raise Exception("Unknown block type {:#x} at pos: {}".format(btype, pos))
+    except struct.error as e:
+        raise EOFError("Failed to read block at pos: {} ({})".format(pos, e))
+
+
+def _read_var_int(data, pos):
+    # Variable length representation of an integer value, 7 bits per byte starting from the lowest ones
+    value = 0
+    shift = 0
+    while True:
+        (byte,) = _UI8.unpack_from(data, pos)
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_utf(data, pos):
+    (size,) = _UI16.unpack_from(data, pos)
+    pos += 2
+    if pos + size > len(data):
+        raise struct.error("string of {} bytes is truncated".format(size))
+    return data[pos : pos + size].tobytes(), pos + size
+
+
+def _write_utf(stream, value):
+    stream.write(_UI16.pack(len(value)) + value)
+
+
+def _write_var_int(stream, value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.append(value)
+    stream.write(out)
+
+
+# Packed probes are merged as integers, byte order does not matter for OR
+def _probes_to_int(data):
+    return int(binascii.hexlify(data), 16) if len(data) else 0
+
+
+def _int_to_probes(value, size):
+    return binascii.unhexlify("{:0{}x}".format(value, size * 2)) if size else b""
+
+
+class ExecDataMerger(object):
+    """
+    Merges exec files as jacoco does: probes of a class are OR-ed, all sessions are kept.
+
+    Memory depends on the number of distinct classes only, files are read one by one.
+    """
+
+    def __init__(self):
+        self.sessions = []
+        # class id -> [name, probes count, probes]
+        self.classes = collections.OrderedDict()
+
+    def add_file(self, filename):
+        for btype, value in iter_blocks(map_file(filename)):
+            if btype == BLOCK_SESSIONINFO:
+                self.sessions.append(value)
+            elif btype == BLOCK_EXECUTIONDATA:
+                record_id, name, count, data = value
+                entry = self.classes.get(record_id)
+                if entry is None:
+                    self.classes[record_id] = [name, count, _probes_to_int(data)]
+                elif entry[0] != name or entry[1] != count:
+                    raise Exception(
+                        "Incompatible execution data for class {} with id {:016x} in {}".format(
+                            six.ensure_str(name), record_id, filename
+                        )
+                    )
+                else:
+                    entry[2] |= _probes_to_int(data)
+
+    def write(self, filename):
+        with open(filename, 'wb') as afile:
+            afile.write(_HEADER.pack(BLOCK_HEADER, MAGIC_NUMBER, FORMAT_VERSION))
+            for sid, start, dump in self.sessions:
+                afile.write(_UI8.pack(BLOCK_SESSIONINFO))
+                _write_utf(afile, sid)
+                afile.write(_UI64.pack(start) + _UI64.pack(dump))
+            for record_id, (name, count, probes) in six.iteritems(self.classes):
+                afile.write(_UI8.pack(BLOCK_EXECUTIONDATA) + _UI64.pack(record_id))
+                _write_utf(afile, name)
+                _write_var_int(afile, count)
+                afile.write(_int_to_probes(probes, (count + 7) >> 3))
+
+
+def merge_reports(filenames, output):
+    merger = ExecDataMerger()
+    for filename in filenames:
+        merger.add_file(filename)
+    merger.write(output)
+    return merger
 
 
 if __name__ == "__main__":
-    import sys
-
-    load_report(sys.argv[1])
-    print("Report loaded")
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+", help="Exec files, directories are read recursively")
+    parser.add_argument("--merge", dest="output", help="Merge exec files to the output file")
+    args = parser.parse_args()
+
+    filenames = []
+    for path in args.files:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                filenames.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            filenames.append(path)
+
+    if args.output:
+        merger = merge_reports(filenames, args.output)
+        print("Merged {} files: {} sessions, {} classes".format(len(filenames), len(merger.sessions), len(merger.classes)))
+    else:
+        for filename in filenames:
+            load_report(filename)
+        print("Report loaded")
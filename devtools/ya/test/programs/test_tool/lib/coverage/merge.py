@@ -390,13 +390,20 @@ def merge_segments(record1, record2):
 
 
 def merge_clang_segments(segments):
-    # type: (tuple[list[tuple[int, int, int, bool, bool, bool]], list[tuple[int, int, int, bool, bool, bool]]]) -> list[list[int|bool]]|list[tuple[int, int, int, bool, bool, bool]]
-    left, right = segments  # typing: ignore [misc]
-    if not left:
-        return right
-    if not right:
-        return left
-    # there is at least one item in both
+    # type: (Sequence[list[tuple[int, int, int, bool, bool, bool]]]) -> list[list[int|bool]]|list[tuple[int, int, int, bool, bool, bool]]
+    """
+    Merges clang segments of a file from any number of sources in one sweep.
+
+    A segment lasts until the next one of its source, so at every position the merged segment combines
+    segments started there with the ones still lasting in other sources. A source stops lasting after its
+    last segment, which is always (*, *, 0, false, false, false).
+    The result is the one of llvm-cov export with all sources' objects and their merged profile, as long as
+    sources map the same code of the file in the same way, see tests/test_merge.py.
+    It doesn't depend on the order of sources, and merged exports may be merged again in batches.
+    """
+    segments = [s for s in segments if s]
+    if len(segments) < 2:
+        return segments[0] if segments else []
 
     # clang's segment format: Line, Col, Count, HasCount, IsRegionEntry, IsGapRegion
     COUNTER_FIELD = 2
@@ -407,42 +414,69 @@ def merge_clang_segments(segments):
     # Too big counter cannot be serialized to json by ujson module
     COUNTER_LIMIT = 1 << 62
 
-    def update_by(seg_to_update, seg):
-        seg_to_update[COUNTER_FIELD] = min(seg_to_update[COUNTER_FIELD] + seg[COUNTER_FIELD], COUNTER_LIMIT)
-        seg_to_update[HASCOUNT_FIELD] = seg_to_update[HASCOUNT_FIELD] or seg[HASCOUNT_FIELD]
-        seg_to_update[ISREGIONENTRY_FIELD] = seg_to_update[ISREGIONENTRY_FIELD] or seg[ISREGIONENTRY_FIELD]
-        seg_to_update[ISGAPREGION_FIELD] = seg_to_update[ISGAPREGION_FIELD] and seg[ISGAPREGION_FIELD]
-
-    left = sorted(left)
-    right = sorted(right)
-
+    points = []
+    last = []
+    for idx, source in enumerate(segments):
+        source = sorted(source)
+        last.append(source[-1])
+        points.extend((seg[0], seg[1], idx, seg) for seg in source)
+    # Sources are sorted runs, so the sort merges them
+    points.sort()
+
+    # Sums of fields over lasting segments
+    counter = hascount = isregionentry = gap = 0
+    # Segments with counts started at the current position and gaps among them
+    started = started_gap = 0
+    lasting = [None] * len(segments)
+    ended = []
     result = []  # type: list[list[int|bool]]
-    l_idx = 0
-    r_idx = 0
-    while l_idx < len(left) or r_idx < len(right):
-        if l_idx >= len(left):
-            result.append(list(right[r_idx]))
-            # update by last left not needed. Last left is always (*, *, 0, false, false, false)
-            r_idx += 1
-        elif r_idx >= len(right):
-            result.append(list(left[l_idx]))
-            # update by last right not needed. Last right is always (*, *, 0, false, false, false)
-            l_idx += 1
-        elif left[l_idx][:COUNTER_FIELD] == right[r_idx][:COUNTER_FIELD]:
-            result.append(list(left[l_idx]))
-            update_by(result[-1], right[r_idx])
-            l_idx += 1
-            r_idx += 1
-        elif left[l_idx][:2] < right[r_idx][:2]:
-            result.append(list(left[l_idx]))
-            if r_idx > 0:
-                update_by(result[-1], right[r_idx - 1])
-            l_idx += 1
+
+    def emit():
+        # llvm-cov drops a segment which doesn't change the count, even if it starts or ends a gap region,
+        # so gap flags of sources which have a segment at the position are preferred over the lasting ones
+        isgap = started_gap > 0 if started else gap > 0
+        seg = [line, col, min(counter, COUNTER_LIMIT), hascount > 0, isregionentry > 0, isgap]
+        # Like llvm-cov, don't add a segment which doesn't change count after a segment which is not a region entry
+        if result and not seg[ISREGIONENTRY_FIELD]:
+            prev = result[-1]
+            if prev[HASCOUNT_FIELD] == seg[HASCOUNT_FIELD] and prev[COUNTER_FIELD] == seg[COUNTER_FIELD]:
+                if not prev[ISREGIONENTRY_FIELD]:
+                    return
+        result.append(seg)
+
+    line = col = None
+    for seg_line, seg_col, idx, seg in points:
+        if seg_col != col or seg_line != line:
+            if line is not None:
+                emit()
+                for prev in ended:
+                    counter -= prev[COUNTER_FIELD]
+                    hascount -= bool(prev[HASCOUNT_FIELD])
+                    isregionentry -= bool(prev[ISREGIONENTRY_FIELD])
+                    gap -= bool(prev[HASCOUNT_FIELD] and prev[ISGAPREGION_FIELD])
+                ended = []
+                started = started_gap = 0
+            line, col = seg_line, seg_col
+
+        prev = lasting[idx]
+        if prev is not None:
+            counter -= prev[COUNTER_FIELD]
+            hascount -= bool(prev[HASCOUNT_FIELD])
+            isregionentry -= bool(prev[ISREGIONENTRY_FIELD])
+            gap -= bool(prev[HASCOUNT_FIELD] and prev[ISGAPREGION_FIELD])
+        counter += seg[COUNTER_FIELD]
+        hascount += bool(seg[HASCOUNT_FIELD])
+        isregionentry += bool(seg[ISREGIONENTRY_FIELD])
+        if seg[HASCOUNT_FIELD]:
+            gap += bool(seg[ISGAPREGION_FIELD])
+            started += 1
+            started_gap += bool(seg[ISGAPREGION_FIELD])
+        if seg is last[idx]:
+            lasting[idx] = None
+            ended.append(seg)
         else:
-            result.append(list(right[r_idx]))
-            if l_idx > 0:
-                update_by(result[-1], left[l_idx - 1])
-            r_idx += 1
+            lasting[idx] = seg
+    emit()
 
     return result
 
@@ -482,3 +516,37 @@ def compact_segments(segments):
         prev_ln = sln
 
     yield (start_ln, 0, eln, 0, start_state)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nchunks = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    nsegments = 20
+
+    def gen_segments(rnd):
+        # Chunks cover overlapping parts of a file
+        lines = sorted(rnd.sample(six.moves.xrange(1, nsegments * 4), nsegments))
+        segments = [
+            [line, rnd.randint(1, 80), rnd.choice([0, 1, 100]), True, rnd.random() < 0.5, False] for line in lines
+        ]
+        segments[-1][2:] = [0, False, False, False]
+        return segments
+
+    rnd = random.Random(0)
+    coverage = [[gen_segments(rnd) for _ in six.moves.xrange(nchunks)] for _ in six.moves.xrange(nfiles)]
+
+    start = time.time()
+    pairwise = []
+    for chunks in coverage:
+        merged = []
+        for segments in chunks:
+            merged = merge_clang_segments([merged, segments])
+        pairwise.append(merged)
+    print('pairwise: {:.2f}s'.format(time.time() - start))
+
+    start = time.time()
+    sweep = [merge_clang_segments(chunks) for chunks in coverage]
+    print('one sweep: {:.2f}s'.format(time.time() - start))
@@ -0,0 +1,164 @@
+from devtools.ya.test.programs.test_tool.lib.coverage import merge
+
+# Segments of the same file exported by llvm-cov 14 for every source alone and for all of them merged
+# (llvm-cov export with all objects and the merged profile): Line, Col, Count, HasCount, IsRegionEntry, IsGapRegion
+
+
+def check_llvm_cov_merge(sources, expected):
+    merged = merge.merge_clang_segments(sources)
+    assert [[s[0], s[1], s[2], bool(s[3]), bool(s[4]), bool(s[5])] for s in merged] == [
+        [s[0], s[1], s[2], bool(s[3]), bool(s[4]), bool(s[5])] for s in expected
+    ]
+
+
+def test_gap_is_not_reset_by_lasting_segment_without_count():
+    sources = [
+        [[26, 10, 1, 1, 1, 0], [35, 2, 0, 0, 0, 0]],
+        [[1, 10, 0, 1, 1, 0], [11, 2, 0, 0, 0, 0], [26, 10, 13, 1, 1, 0], [35, 2, 0, 0, 0, 0]],
+        [[1, 10, 3, 1, 1, 0], [11, 2, 0, 0, 0, 0]],
+        [
+            [14, 10, 0, 1, 1, 0],
+            [20, 15, 3, 1, 0, 1],
+            [20, 17, 3, 1, 1, 0],
+            [20, 2147483665, 3, 1, 0, 0],
+            [24, 3, 3, 1, 1, 0],
+            [24, 2147483651, 3, 1, 0, 0],
+            [25, 1, 0, 1, 0, 0],
+            [25, 2, 0, 0, 0, 0],
+            [26, 10, 1, 1, 1, 0],
+            [35, 2, 0, 0, 0, 0],
+        ],
+        [[26, 10, 0, 1, 1, 0], [35, 2, 0, 0, 0, 0]],
+    ]
+    expected = [
+        [1, 10, 3, 1, 1, 0],
+        [11, 2, 0, 0, 0, 0],
+        [14, 10, 0, 1, 1, 0],
+        [20, 15, 3, 1, 0, 1],
+        [20, 17, 3, 1, 1, 0],
+        [20, 2147483665, 3, 1, 0, 0],
+        [24, 3, 3, 1, 1, 0],
+        [24, 2147483651, 3, 1, 0, 0],
+        [25, 1, 0, 1, 0, 0],
+        [25, 2, 0, 0, 0, 0],
+        [26, 10, 15, 1, 1, 0],
+        [35, 2, 0, 0, 0, 0],
+    ]
+    check_llvm_cov_merge(sources, expected)
+
+
+def test_segment_not_changing_count_is_dropped():
+    sources = [
+        [[1, 10, 10, 1, 1, 0], [9, 2, 0, 0, 0, 0]],
+        [[1, 10, 10, 1, 1, 0], [9, 2, 0, 0, 0, 0]],
+        [
+            [1, 10, 10, 1, 1, 0],
+            [9, 2, 0, 0, 0, 0],
+            [10, 10, 0, 1, 1, 0],
+            [14, 15, 10, 1, 0, 1],
+            [14, 17, 10, 1, 1, 0],
+            [14, 2147483665, 10, 1, 0, 0],
+            [15, 4, 0, 1, 0, 0],
+            [17, 2, 0, 0, 0, 0],
+        ],
+        [
+            [1, 10, 3, 1, 1, 0],
+            [9, 2, 0, 0, 0, 0],
+            [10, 10, 10, 1, 1, 0],
+            [14, 15, 0, 1, 0, 1],
+            [14, 17, 0, 1, 1, 0],
+            [14, 2147483665, 0, 1, 0, 0],
+            [15, 4, 10, 1, 0, 0],
+            [17, 2, 0, 0, 0, 0],
+        ],
+    ]
+    expected = [
+        [1, 10, 33, 1, 1, 0],
+        [9, 2, 0, 0, 0, 0],
+        [10, 10, 10, 1, 1, 0],
+        [14, 15, 10, 1, 0, 1],
+        [14, 17, 10, 1, 1, 0],
+        [14, 2147483665, 10, 1, 0, 0],
+        [17, 2, 0, 0, 0, 0],
+    ]
+    check_llvm_cov_merge(sources, expected)
+
+
+def test_gap_of_source_without_dropped_segment():
+    # The last source has no segment at 10:4, llvm-cov dropped it as the count didn't change
+    sources = [
+        [
+            [1, 10, 10, 1, 1, 0],
+            [9, 15, 0, 1, 0, 1],
+            [9, 17, 0, 1, 1, 0],
+            [9, 2147483665, 0, 1, 0, 0],
+            [10, 4, 1, 1, 0, 1],
+            [11, 3, 1, 1, 1, 0],
+            [11, 2147483651, 1, 1, 0, 0],
+            [12, 1, 10, 1, 0, 0],
+            [12, 2, 0, 0, 0, 0],
+            [13, 10, 3, 1, 1, 0],
+            [19, 2, 0, 0, 0, 0],
+        ],
+        [
+            [1, 10, 10, 1, 1, 0],
+            [9, 15, 3, 1, 0, 1],
+            [9, 17, 3, 1, 1, 0],
+            [9, 2147483665, 3, 1, 0, 0],
+            [10, 4, 4, 1, 0, 1],
+            [11, 3, 4, 1, 1, 0],
+            [11, 2147483651, 4, 1, 0, 0],
+            [12, 1, 10, 1, 0, 0],
+            [12, 2, 0, 0, 0, 0],
+        ],
+        [
+            [1, 10, 10, 1, 1, 0],
+            [9, 15, 3, 1, 0, 1],
+            [9, 17, 3, 1, 1, 0],
+            [9, 2147483665, 3, 1, 0, 0],
+            [10, 4, 0, 1, 0, 1],
+            [11, 3, 0, 1, 1, 0],
+            [11, 2147483651, 0, 1, 0, 0],
+            [12, 1, 10, 1, 0, 0],
+            [12, 2, 0, 0, 0, 0],
+            [13, 10, 0, 1, 1, 0],
+            [19, 2, 0, 0, 0, 0],
+        ],
+        [
+            [1, 10, 3, 1, 1, 0],
+            [9, 15, 10, 1, 0, 1],
+            [9, 17, 10, 1, 1, 0],
+            [9, 2147483665, 10, 1, 0, 0],
+            [11, 3, 10, 1, 1, 0],
+            [11, 2147483651, 10, 1, 0, 0],
+            [12, 1, 3, 1, 0, 0],
+            [12, 2, 0, 0, 0, 0],
+            [13, 10, 1, 1, 1, 0],
+            [19, 2, 0, 0, 0, 0],
+        ],
+    ]
+    expected = [
+        [1, 10, 33, 1, 1, 0],
+        [9, 15, 16, 1, 0, 1],
+        [9, 17, 16, 1, 1, 0],
+        [9, 2147483665, 16, 1, 0, 0],
+        [10, 4, 15, 1, 0, 1],
+        [11, 3, 15, 1, 1, 0],
+        [11, 2147483651, 15, 1, 0, 0],
+        [12, 1, 33, 1, 0, 0],
+        [12, 2, 0, 0, 0, 0],
+        [13, 10, 4, 1, 1, 0],
+        [19, 2, 0, 0, 0, 0],
+    ]
+    check_llvm_cov_merge(sources, expected)
+
+
+def test_order_of_sources():
+    sources = [
+        [[1, 1, 1, 1, 1, 0], [2, 5, 0, 1, 0, 1], [3, 1, 2, 1, 1, 0], [4, 1, 0, 0, 0, 0]],
+        [[1, 1, 0, 1, 1, 0], [2, 5, 4, 1, 0, 1], [3, 1, 0, 1, 1, 0], [4, 1, 0, 0, 0, 0]],
+        [[1, 1, 5, 1, 1, 0], [4, 1, 0, 0, 0, 0]],
+    ]
+    merged = merge.merge_clang_segments(sources)
+    assert merge.merge_clang_segments(sources[::-1]) == merged
+    assert merge.merge_clang_segments([merge.merge_clang_segments(sources[:2]), sources[2]]) == merged
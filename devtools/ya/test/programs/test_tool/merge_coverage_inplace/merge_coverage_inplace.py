@@ -64,6 +64,9 @@ def add_resolved_file(merged_coverage, current_coverage):
 
 
 def merge_coverage(resolved_coverage_files, output_path):
+    # Files are merged one by one in the given order: results of merge_segments and
+    # merge_granular_coverage_segments depend on the order of merged sources,
+    # so unlike merge_clang_segments they can't be swept over all sources at once
     merged_coverage = {}
     for coverage_path in resolved_coverage_files:
         current_coverage = get_unified_coverage(coverage_path)
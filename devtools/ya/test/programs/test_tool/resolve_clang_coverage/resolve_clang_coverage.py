@@ -24,6 +24,8 @@ import six
 logger = logging.getLogger(__name__)
 SANCOV_REGEXP = re.compile(r'(.*?)\.\d+?\.sancov')
 SHUTDOWN_REQUESTED = [False]
+# Segments of a file from this many blocks are merged at once
+MAX_SEGMENT_SOURCES = 64
 
 
 def parse_args():
@@ -59,8 +61,8 @@ def is_shutdown_requested():
 
 
 @shared.timeit
-def merge_segments(s1, s2):
-    return lib_coverage.merge.merge_clang_segments([s1, s2])
+def merge_segments(sources):
+    return lib_coverage.merge.merge_clang_segments(sources)
 
 
 @shared.timeit
@@ -82,14 +84,16 @@ def saturate_coverage(covtype, covdata, source_root, cache):
         cache[relfilename] = {
             'segments': [],
             'functions': {},
+            'segment_sources': [],
         }
     cache_entry = cache[relfilename]
 
     if covtype == 'files':
-        if not cache_entry['segments']:
-            cache_entry['segments'] = covdata['segments']
-        else:
-            cache_entry['segments'] = merge_segments(cache_entry['segments'], covdata['segments'])
+        # Merging every block into the result would copy it again and again
+        sources = cache_entry['segment_sources']
+        sources.append(covdata['segments'])
+        if len(sources) >= MAX_SEGMENT_SOURCES:
+            sources[:] = [merge_segments(sources)]
     else:
         start_pos = covdata['regions'][0]
         key = (start_pos[0] - 1, start_pos[1] - 1)
@@ -140,6 +144,12 @@ def gen_empty_output(filename):
         afile.write("")
 
 
+def merge_segment_sources(coverage):
+    logger.debug("Merge segments")
+    for filedata in coverage.values():
+        filedata['segments'] = merge_segments(filedata.pop('segment_sources'))
+
+
 def normalize_function_entries(coverage):
     logger.debug("Normalize functions")
     for filename in coverage:
@@ -225,6 +235,7 @@ def main():
 
     lib_coverage.export.export_llvm_coverage(cmd, process_block, cancel_func=is_shutdown_requested)
 
+    merge_segment_sources(coverage)
     normalize_function_entries(coverage)
     lib_coverage.export.dump_coverage(coverage, args.output)
 
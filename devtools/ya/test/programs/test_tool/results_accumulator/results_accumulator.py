@@ -22,6 +22,7 @@ from test.util import shared
 from devtools.ya.test.programs.test_tool.lib import coverage
 import library.python.cores as cores
 from test.test_types import common
+from devtools.ya.test import tracefile
 from test import const
 
 logger = logging.getLogger(__name__)
@@ -312,26 +313,27 @@ def concatenate_traces(args, files, dst):
     # We need to replace after the concatenation all paths in the trace file that point to
     # modulo** dirs to ones that point to the merged dir
     build_root = os.path.realpath(os.getcwd())
-    shared.concatenate_files(files, dst)
-    trace_content = exts.fs.read_file_unicode(dst, binary=False)
     dst_build_rel_path = os.path.relpath(os.path.realpath(args.accumulator_path), build_root)
     chunk_ids = {}
 
-    for o in args.outputs:
-        o = os.path.realpath(o)
-        output_build_rel_path = os.path.relpath(o, build_root)
-        if args.keep_paths:
-            relative = os.path.relpath(output_build_rel_path, dst_build_rel_path).split('/')
-            assert relative[0] != os.pardir
-            chunk_ids[o] = relative
-        else:
+    if not args.keep_paths:
+        shared.concatenate_files(files, dst)
+        trace_content = exts.fs.read_file_unicode(dst, binary=False)
+        for o in args.outputs:
+            output_build_rel_path = os.path.relpath(os.path.realpath(o), build_root)
             trace_content = trace_content.replace(output_build_rel_path + os.path.sep, dst_build_rel_path + os.path.sep)
 
-    if not args.keep_paths:
         with open(dst, "w") as dstfile:
             dstfile.write(trace_content)
         return
 
+    for o in args.outputs:
+        o = os.path.realpath(o)
+        output_build_rel_path = os.path.relpath(o, build_root)
+        relative = os.path.relpath(output_build_rel_path, dst_build_rel_path).split('/')
+        assert relative[0] != os.pardir
+        chunk_ids[o] = relative
+
     _cut_common_prefix(chunk_ids)
 
     statuses = dict()
@@ -368,13 +370,15 @@ def concatenate_traces(args, files, dst):
 
     suite = common.PerformedTestSuite(None, None)
     suite.set_work_dir(os.getcwd())
-    suite.load_run_results(dst)
+    # Chunk traces are merged without their concatenation on disk
+    tracefile.TestTraceParser.parse_from_files(files, suite=suite, relaxed=True)
     for log in invalid_logs:
         del suite.logs[log]
     suite.logs.update(chunk_logs)
     suite._errors.extend(errors)
 
-    os.remove(dst)  # rewrite trace to delete renamed
+    if os.path.exists(dst):
+        os.remove(dst)
     shared.dump_trace_file(suite, dst)
 
 
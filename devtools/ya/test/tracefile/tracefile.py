@@ -2,6 +2,7 @@
 
 import base64
 import collections
+import heapq
 import json
 import logging
 import os
@@ -16,21 +17,85 @@ from yalibrary.formatter import term
 
 logger = logging.getLogger(__name__)
 
+# Lines decoded with a single json call
+DECODE_BATCH_SIZE = 1000
+FUZZ_TEST_NAME = "fuzz::test"
+# Statuses which are replaced by any later status of the same test
+REPLACEABLE_STATUSES = frozenset([const.Status.NOT_LAUNCHED, const.Status.CRASHED, const.Status.DESELECTED])
+# Statuses which do not keep started timestamp of the test
+NOT_STARTED_STATUSES = frozenset([const.Status.NOT_LAUNCHED, const.Status.DESELECTED])
+
+ESCAPE_CHAR = '\x1b'
+
+_intern = six.moves.intern
+
+
+def _intern_str(s):
+    # Paths and working directories are shared by many tests
+    return _intern(s) if type(s) is str else s
+
+
+class StartedTest(object):
+    """
+    Test mentioned by subtest-started event only.
+
+    Almost every such test is replaced by its subtest-finished event, so TestCase is created only for tests left
+    after all events, as crashed ones.
+    """
+
+    __slots__ = ('name', 'logs', 'cwd', 'path', 'started')
+
+    status = const.Status.CRASHED
+    test_type = None
+
+    def __init__(self, name, logs, cwd, path, started):
+        self.name = name
+        self.logs = logs
+        self.cwd = cwd
+        self.path = path
+        self.started = started
+
+    def to_testcase(self):
+        return facility.TestCase(
+            self.name,
+            self.status,
+            "Test crashed",
+            0,
+            None,
+            None,
+            self.logs,
+            self.cwd,
+            path=self.path,
+            started=self.started,
+        )
+
 
 class TestEventParser(object):
     def __init__(self, suite=None, reporter=None):
         self.reporter = reporter
         self.suite = suite or facility.Suite()
         self.current_chunk = None
+        self.current_chunk_name = None
         self.testcases = collections.OrderedDict()
         self.chunks = {}
+        # (nchunks, chunk_index, chunk_filename) -> (chunk, chunk name)
+        self._chunk_keys = {}
+        self._handlers = {}
+
+    def get_handler(self, event_name):
+        handler = self._handlers.get(event_name)
+        if handler is None:
+            handler = self._handlers[event_name] = getattr(self, event_name.replace('-', '_'))
+        return handler
 
     def add_test(self, chunk, test):
-        chunk_name = chunk.get_name()
+        chunk_name = self.current_chunk_name if chunk is self.current_chunk else chunk.get_name()
         test_name = "-".join([_f for _f in [test.name, test.test_type, test.path] if _f])
-        name = (chunk_name, test_name)
+        # Started and finished events of a test share the key
+        name = (chunk_name, _intern(test_name))
 
-        if name not in self.testcases:
+        stored = self.testcases.get(name)
+        if stored is None:
             self.testcases[name] = test
             return
 
@@ -38,35 +103,32 @@ class TestEventParser(object):
         # for the first time is actual started timestamp from subtest_started event,
         # actual data comes from subtest_finished event,
         # but it's 'timestamp' field specifies time when test was finished
-        started = self.testcases[name].started
-
-        if test_name == "fuzz::test":
+        started = stored.started
+
+        if type(stored) is StartedTest:
+            # the fake test is replaced by any other one
+            self.testcases[name] = stored = test
+        elif test_name == FUZZ_TEST_NAME:
+            if type(test) is StartedTest:
+                test = test.to_testcase()
             # XXX extra steps to merge fuzz::test chunks to the single test
-            self._merge_fuzz_test(self.testcases[name], test)
-            if self.testcases[name].status in [
-                const.Status.NOT_LAUNCHED,
-                const.Status.CRASHED,
-                const.Status.DESELECTED,
-            ]:
-                self.testcases[name] = test
+            self._merge_fuzz_test(stored, test)
+            if stored.status in REPLACEABLE_STATUSES:
+                self.testcases[name] = stored = test
             else:
                 if test.status not in [const.Status.GOOD, const.Status.DESELECTED]:
-                    test.metrics = self.testcases[name].metrics
-                    self.testcases[name] = test
+                    test.metrics = stored.metrics
+                    self.testcases[name] = stored = test
         else:
-            if self.testcases[name].status in [
-                const.Status.NOT_LAUNCHED,
-                const.Status.CRASHED,
-                const.Status.DESELECTED,
-            ]:
+            if stored.status in REPLACEABLE_STATUSES:
                 # replace some previously set statuses
-                self.testcases[name] = test
+                self.testcases[name] = stored = test
             else:
                 if test.status != const.Status.DESELECTED:
-                    self.testcases[name] = test
+                    self.testcases[name] = stored = test
 
-        if started and self.testcases[name].status not in [const.Status.NOT_LAUNCHED, const.Status.DESELECTED]:
-            self.testcases[name].started = started
+        if started and stored.status not in NOT_STARTED_STATUSES:
+            stored.started = started
 
     @staticmethod
     def _merge_fuzz_test(stored, newrec):
@@ -121,17 +183,12 @@ class TestEventParser(object):
         self.add_test(
             self.current_chunk,
             # this fake test will be removed if the corresponding subtest-finished event comes
-            facility.TestCase(
+            StartedTest(
                 testname,
-                const.Status.CRASHED,
-                "Test crashed",
-                0,
-                None,
-                None,
                 event.get('logs'),
-                event.get('cwd', ''),
-                path=event.get('path'),
-                started=event['timestamp'],
+                _intern_str(event.get('cwd', '')),
+                _intern_str(event.get('path')),
+                event['timestamp'],
             ),
         )
 
@@ -139,10 +196,12 @@ class TestEventParser(object):
             self.reporter.on_test_case_started(testname)
 
     def setup_chunk(self, event):
-        self.current_chunk = self.chunks.setdefault(
-            self.get_chunk_name(event),
-            facility.Chunk(event.get('nchunks') or 1, event.get('chunk_index') or 0, event.get('chunk_filename')),
-        )
+        key = (event.get('nchunks') or 1, event.get('chunk_index') or 0, event.get('chunk_filename'))
+        chunk_and_name = self._chunk_keys.get(key)
+        if chunk_and_name is None:
+            name = facility.Chunk.gen_chunk_name(*key)
+            chunk_and_name = self._chunk_keys[key] = (self.chunks.setdefault(name, facility.Chunk(*key)), name)
+        self.current_chunk, self.current_chunk_name = chunk_and_name
 
     def get_chunk_name(self, event):
         return facility.Chunk.gen_chunk_name(
@@ -152,14 +211,15 @@ class TestEventParser(object):
         )
 
     def extract_test_name(self, event):
-        return "{}::{}".format(event['class'], event['subtest'])
+        return _intern("{}::{}".format(event['class'], event['subtest']))
 
     def subtest_finished(self, event):
         self.setup_chunk(event)
 
         comment = event.get('comment', '').strip()
-        # replace escape codes with markup in comment
-        comment = term.ansi_codes_to_markup(comment)
+        if ESCAPE_CHAR in comment:
+            # replace escape codes with markup in comment
+            comment = term.ansi_codes_to_markup(comment)
 
         test = facility.TestCase(
             self.extract_test_name(event),
@@ -169,9 +229,9 @@ class TestEventParser(object):
             event.get('result'),
             event.get('type'),
             event.get('logs'),
-            event.get('cwd', ''),
+            _intern_str(event.get('cwd', '')),
             event.get('metrics'),
-            event.get('path'),
+            _intern_str(event.get('path')),
             event.get('is_diff_test', False),
             tags=event.get('tags'),
         )
@@ -208,6 +268,8 @@ class TestEventParser(object):
     def finalize(self):
         for (chunk_name, _), testcase in self.testcases.items():
             assert chunk_name in self.chunks, (chunk_name, self.chunks.keys())
+            if type(testcase) is StartedTest:
+                testcase = testcase.to_testcase()
             self.chunks[chunk_name].tests.append(testcase)
         self.testcases.clear()
 
@@ -218,6 +280,7 @@ class TestEventParser(object):
         for name in sorted(self.chunks):
             self.suite.chunks.append(self.chunks[name])
         self.chunks.clear()
+        self._chunk_keys.clear()
 
         if self.reporter:
             self.reporter.on_test_suite_finish(self.suite)
@@ -239,18 +302,51 @@ class TestTraceParser(object):
         with io.open(filename, errors='ignore', encoding='utf-8') as afile:
             return TestTraceParser.parse(afile, reporter, suite, relaxed)
 
+    @staticmethod
+    def parse_from_files(filenames, reporter=None, suite=None, relaxed=False):
+        """
+        Parses trace files of several chunks as a single trace.
+
+        Events of all files are merged in one pass by timestamp, events with the same timestamp keep the order of files.
+        """
+        afiles = []
+        for filename in filenames:
+            logger.debug('Read trace data from %s', filename)
+            if os.path.exists(filename):
+                afiles.append(io.open(filename, errors='ignore', encoding='utf-8'))
+            else:
+                logger.debug('Trace file %s is not found', filename)
+
+        def timed_events(index, afile):
+            for line, event in TestTraceParser.decode(afile, relaxed):
+                # index orders events with the same timestamp and prevents comparison of events
+                yield _event_timestamp(event), index, line, event
+
+        try:
+            streams = [timed_events(index, afile) for index, afile in enumerate(afiles)]
+            return TestTraceParser.parse_events(
+                ((line, event) for _, _, line, event in heapq.merge(*streams)), reporter, suite
+            )
+        finally:
+            for afile in afiles:
+                afile.close()
+
     @staticmethod
     def parse_from_string(data, reporter=None, suite=None, relaxed=False):
         return TestTraceParser.parse(data.splitlines(), reporter, suite, relaxed)
 
     @staticmethod
     def parse(it, reporter=None, suite=None, relaxed=False):
+        return TestTraceParser.parse_events(TestTraceParser.decode(it, relaxed), reporter, suite)
+
+    @staticmethod
+    def parse_events(events, reporter=None, suite=None):
         event_parser = TestEventParser(suite, reporter)
         error = None
 
         try:
-            for entry in it:
-                TestTraceParser.process_event(event_parser, entry, relaxed)
+            for line, event in events:
+                TestTraceParser.dispatch_event(event_parser, line, event)
         except ParsingError as e:
             error = e.data
 
@@ -265,30 +361,133 @@ class TestTraceParser(object):
 
         return event_parser.suite
 
+    @staticmethod
+    def decode(it, relaxed=False):
+        """
+        Yields (line, event) for trace lines.
+
+        Lines are decoded in batches as a json array, a batch with a broken line is decoded line by line.
+        """
+        lines, stripped_lines = [], []
+        for line in it:
+            stripped_line = TestTraceParser.strip_line(line)
+            if stripped_line:
+                lines.append(line)
+                stripped_lines.append(stripped_line)
+                if len(lines) == DECODE_BATCH_SIZE:
+                    for item in TestTraceParser.decode_batch(lines, stripped_lines, relaxed):
+                        yield item
+                    lines, stripped_lines = [], []
+        for item in TestTraceParser.decode_batch(lines, stripped_lines, relaxed):
+            yield item
+
+    @staticmethod
+    def strip_line(line):
+        if not line:
+            return None
+        line = strings.to_unicode(line)
+        line_striped = line.strip('\r\t\n\x00 ')
+        if not line_striped:
+            return None
+
+        if len(line_striped) + 2 < len(line):
+            logger.debug("%d trash bytes found in tracefile", len(line) - len(line_striped))
+        return line_striped
+
+    @staticmethod
+    def decode_batch(lines, stripped_lines, relaxed=False):
+        try:
+            events = json.loads('[' + ','.join(stripped_lines) + ']')
+        except ValueError:
+            events = None
+
+        # A line may hold several values or a part of a value only
+        if events is None or len(events) != len(lines) or not all(type(event) is dict for event in events):
+            for line, stripped_line in zip(lines, stripped_lines):
+                yield line, TestTraceParser.decode_line(line, stripped_line, relaxed)
+            return
+
+        for line, event in zip(lines, events):
+            yield line, strings.ensure_str_deep(event) if six.PY2 else event
+
+    @staticmethod
+    def decode_line(line, stripped_line, relaxed=False):
+        try:
+            return strings.ensure_str_deep(json.loads(stripped_line))
+        except ValueError:
+            b64data = base64.b64encode(six.ensure_binary(strings.to_unicode(line)))
+            if relaxed:
+                raise ParsingError(b64data)
+            logger.error('Incorrect json - unable to load line b64:"%s"', b64data)
+            raise
+
     @staticmethod
     def process_event(event_parser, line, relaxed=False):
-        if line:
-            line = strings.to_unicode(line)
-            line_striped = line.strip('\r\t\n\x00 ')
-            if not line_striped:
-                return
-
-            if len(line_striped) + 2 < len(line):
-                logger.debug("%d trash bytes found in tracefile", len(line) - len(line_striped))
-
-            try:
-                event = strings.ensure_str_deep(json.loads(line_striped))
-            except ValueError:
-                b64data = base64.b64encode(six.ensure_binary(line))
-                if relaxed:
-                    raise ParsingError(b64data)
-                logger.error('Incorrect json - unable to load line b64:"%s"', b64data)
-                raise
-
-            try:
-                data = event['value']
-                data['timestamp'] = event['timestamp']
-                event_parser.__getattribute__(event['name'].replace('-', '_'))(data)
-            except Exception:
-                logger.error('Failed to process event, b64:"%s"', base64.b64encode(six.ensure_binary(line)))
-                raise
+        stripped_line = TestTraceParser.strip_line(line)
+        if stripped_line:
+            TestTraceParser.dispatch_event(event_parser, line, TestTraceParser.decode_line(line, stripped_line, relaxed))
+
+    @staticmethod
+    def dispatch_event(event_parser, line, event):
+        try:
+            data = event['value']
+            data['timestamp'] = event['timestamp']
+            event_parser.get_handler(event['name'])(data)
+        except Exception:
+            logger.error(
+                'Failed to process event, b64:"%s"', base64.b64encode(six.ensure_binary(strings.to_unicode(line)))
+            )
+            raise
+
+
+def _event_timestamp(event):
+    # Broken events fail later in dispatch_event, in the order of their file
+    try:
+        return float(event['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+if __name__ == '__main__':
+    import shutil
+    import sys
+    import tempfile
+    import time
+
+    nevents = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    nchunks = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    def write_trace(filename, chunk_index, count):
+        with open(filename, 'w') as afile:
+            for i in six.moves.xrange(count // 2):
+                value = {
+                    'class': 'test_module_{}.py::TestClass'.format(i % 50),
+                    'subtest': 'test_param[{}]'.format(i),
+                    'nchunks': nchunks,
+                    'chunk_index': chunk_index,
+                    'path': 'devtools/dummy_tests/test.py',
+                    'cwd': '/build/cwd',
+                    'logs': {'logsdir': '/build/logs'},
+                }
+                timestamp = 1700000000.0 + i
+                afile.write(json.dumps({'name': 'subtest-started', 'timestamp': timestamp, 'value': value}) + '\n')
+                value.update(status='good', time=0.5, metrics={'rss': i}, comment='')
+                afile.write(json.dumps({'name': 'subtest-finished', 'timestamp': timestamp, 'value': value}) + '\n')
+
+    def timed(name, f):
+        start = time.time()
+        suite = f()
+        print('{}: {:.2f}s, {} tests'.format(name, time.time() - start, sum(len(c.tests) for c in suite.chunks)))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        trace = os.path.join(tmp, 'ytest.report.trace')
+        write_trace(trace, 0, nevents)
+        timed('{} events'.format(nevents), lambda: TestTraceParser.parse_from_file(trace))
+
+        traces = [os.path.join(tmp, 'chunk{}.trace'.format(i)) for i in range(nchunks)]
+        for i, filename in enumerate(traces):
+            write_trace(filename, i, nevents // nchunks)
+        timed('{} events in {} chunks'.format(nevents, nchunks), lambda: TestTraceParser.parse_from_files(traces))
+    finally:
+        shutil.rmtree(tmp)
@@ -12,6 +12,12 @@ import typing as tp
 
 logger = logging.getLogger(__name__)
 
+YMAKE_STAGE_STARTED = 'NEvent.TStageStarted'
+YMAKE_STAGE_FINISHED = 'NEvent.TStageFinished'
+# Events used by load_from_evlog, other evlog lines are not decoded
+EVLOG_NAMESPACES = ('ymake',)
+EVLOG_EVENTS = ('node-finished', 'stage-finished', 'node-detailed', 'critical_path')
+
 
 class Node(object):
     def __init__(self, name, tag, start, end, color, thread_name, is_critical, event=None, has_detailed=False):
@@ -27,7 +33,7 @@ class Node(object):
 
 
 def get_cmd_from_evlog(filename: str) -> str:
-    reader = yalibrary.evlog.EvlogReader(filename)
+    reader = yalibrary.evlog.EvlogReader(filename, events=('init',))
     for node in reader:
         if node['event'] == 'init':
             return ' '.join(node['value']['args'])
@@ -83,9 +89,6 @@ def load_from_distbuild(evlog_reader):
 
 
 def load_from_evlog(evlog_reader, detailed=False):
-    ymake_stage_started = 'NEvent.TStageStarted'
-    ymake_stage_finished = 'NEvent.TStageFinished'
-
     events_to_check = ['node-finished', 'stage-finished']
     if detailed:
         events_to_check.append('node-detailed')
@@ -105,9 +108,9 @@ def load_from_evlog(evlog_reader, detailed=False):
             critical_uids = set(x['uid'] for x in v['value']['nodes'])
 
         if v['namespace'] == 'ymake':
-            if v['event'] == ymake_stage_started:
+            if v['event'] == YMAKE_STAGE_STARTED:
                 opened_ymake_stages[(v['thread_name'], v['value']['StageName'])] = v
-            elif v['event'] == ymake_stage_finished:
+            elif v['event'] == YMAKE_STAGE_FINISHED:
                 ymake_nodes.append((opened_ymake_stages[(v['thread_name'], v['value']['StageName'])], v))
 
     for x, y in ymake_nodes:
@@ -168,12 +171,12 @@ def load_evlog(
 
     filepath = distbuild_file or evlog_file
     items = None
-    evlog_reader = yalibrary.evlog.EvlogReader(filepath)
     file_name = os.path.basename(filepath)
 
     if check_for_distbuild and distbuild_file is not None:
-        items = list(set_zero_start(load_from_file(evlog_reader, 'distbuild')))
+        items = list(set_zero_start(load_from_file(yalibrary.evlog.EvlogReader(filepath), 'distbuild')))
     if items is None:
+        evlog_reader = yalibrary.evlog.EvlogReader(filepath, namespaces=EVLOG_NAMESPACES, events=EVLOG_EVENTS)
         items = list(set_zero_start(load_from_file(evlog_reader, 'evlog', opts.detailed)))
 
     return file_name, items
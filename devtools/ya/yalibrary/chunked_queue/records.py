@@ -0,0 +1,215 @@
+import os
+import threading
+
+from exts import fs
+from exts import filelock
+
+from yalibrary.chunked_queue.queue import uniq_name
+
+
+__all__ = ['RecordQueue']
+
+
+READ_SIZE = 4 << 20
+
+
+def pack_record(header, values):
+    """Packs (header fields..., payload), the length of the payload is the last field of the header"""
+    payload = values[-1]
+    return header.pack(*(tuple(values[:-1]) + (len(payload),))) + payload
+
+
+def unpack_records(header, data):
+    """Returns (records, size of complete records in data), a partially written tail record is left"""
+    size = header.size
+    end = len(data)
+    unpack_from = header.unpack_from
+    records = []
+    pos = 0
+    while pos + size <= end:
+        values = unpack_from(data, pos)
+        start = pos + size
+        stop = start + values[-1]
+        if stop > end:
+            break
+        records.append(values[:-1] + (data[start:stop],))
+        pos = stop
+    return records, pos
+
+
+def read_records(header, f):
+    """Yields lists of records read from f by blocks"""
+    tail = b''
+    while True:
+        block = f.read(READ_SIZE)
+        if not block:
+            return
+        data = tail + block if tail else block
+        records, pos = unpack_records(header, data)
+        tail = data[pos:]
+        yield records
+
+
+class RecordChunk(object):
+    """Chunk of variable-size binary records: a fixed header, the last field of which is the length of the payload"""
+
+    def __init__(self, data_dir, tag, header):
+        self._data_dir = data_dir
+        self._tag = tag
+        self._data_path = os.path.join(data_dir, tag)
+        self._header = header
+        self._lock = threading.Lock()
+        self._stream = None
+
+    @property
+    def tag(self):
+        return self._tag
+
+    def open(self):
+        with self._lock:
+            if self._stream is not None:
+                raise RuntimeError('Already opened')
+            self._stream = open(self._data_path, 'w+b')
+
+    def close(self):
+        with self._lock:
+            if self._stream is None:
+                raise RuntimeError('Stream is not opened')
+            self._stream.close()
+
+    def _iter_records(self, f):
+        for records in read_records(self._header, f):
+            for record in records:
+                yield record
+
+    def consume(self, action):
+        with self._lock:
+            if self._stream is None:
+                with open(self._data_path, 'rb') as f:
+                    for record in self._iter_records(f):
+                        for x in action(record):
+                            yield x
+                fs.remove_file(self._data_path)
+            else:
+                self._stream.seek(0)
+                for record in self._iter_records(self._stream):
+                    for x in action(record):
+                        yield x
+                self._stream.seek(0)
+                self._stream.truncate()
+                self._stream.flush()
+
+    def analyze(self, analyzer):
+        self.flush()
+        with self._lock:
+            with open(self._data_path, 'rb') as f:
+                for record in self._iter_records(f):
+                    for x in analyzer(record):
+                        yield x
+
+    def consume_records(self, records_filter):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.flush()
+            # Records are only dropped, so the writer never overtakes the reader
+            with open(self._data_path, 'rb') as src, open(self._data_path, 'r+b') as dst:
+                for records in read_records(self._header, src):
+                    dst.write(b''.join(pack_record(self._header, r) for r in records if records_filter(r)))
+                dst.truncate()
+                left_over = dst.tell()
+
+            if self._stream is not None:
+                self._stream.seek(0, os.SEEK_END)
+            elif not left_over:
+                fs.remove_file(self._data_path)
+
+    def add(self, data):
+        with self._lock:
+            if self._stream is None:
+                raise RuntimeError('Chunk is not opened')
+            self._stream.write(data)
+
+    def flush(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.flush()
+
+
+class RecordQueue(object):
+    """
+    Chunked queue of binary records (header fields..., payload), see RecordChunk.
+
+    Producers append packed records to a shared buffer of at most BUFFER_RECORDS records,
+    which is written to the active chunk in bulk when full or on flush().
+    """
+
+    BUFFER_RECORDS = 1024
+
+    def __init__(self, store_dir, header):
+        fs.create_dirs(store_dir)
+
+        self._header = header
+        self._data_dir = os.path.join(store_dir, 'data')
+        self._consume_lock = filelock.FileLock(os.path.join(store_dir, 'consume.lock'))
+        fs.create_dirs(self._data_dir)
+        self._active_chunk = RecordChunk(self._data_dir, uniq_name(), header)
+        self._active_chunk.open()
+
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+
+    def close(self):
+        self.flush()
+        self._active_chunk.close()
+
+    def _take_buffer(self):
+        with self._buffer_lock:
+            buf, self._buffer = self._buffer, []
+        return buf
+
+    def push(self, *values):
+        data = pack_record(self._header, values)
+        with self._buffer_lock:
+            self._buffer.append(data)
+            if len(self._buffer) < self.BUFFER_RECORDS:
+                return
+            buf, self._buffer = self._buffer, []
+        self._active_chunk.add(b''.join(buf))
+
+    def flush(self):
+        buf = self._take_buffer()
+        if buf:
+            self._active_chunk.add(b''.join(buf))
+        self._active_chunk.flush()
+
+    def _chunks(self, include_active):
+        for chunk_name in sorted(os.listdir(self._data_dir)):
+            if os.path.basename(chunk_name) != self._active_chunk.tag:
+                yield RecordChunk(self._data_dir, chunk_name, self._header)
+            elif include_active:
+                yield self._active_chunk
+
+    def sieve(self, consumer, max_chunks=None):
+        with self._consume_lock:
+            for chunk in list(self._chunks(include_active=False))[:max_chunks]:
+                for x in chunk.consume(consumer):
+                    yield x
+
+    def sieve_current_chunk(self, consumer):
+        self.flush()
+        with self._consume_lock:
+            for x in self._active_chunk.consume(consumer):
+                yield x
+
+    def analyze(self, analyzer):
+        self.flush()
+        with self._consume_lock:
+            for chunk in self._chunks(include_active=True):
+                for x in chunk.analyze(analyzer):
+                    yield x
+
+    def strip(self, records_filter):
+        self.flush()
+        with self._consume_lock:
+            for chunk in self._chunks(include_active=True):
+                chunk.consume_records(records_filter)
@@ -259,7 +259,7 @@ class DumpItem(BaseDumpItem):
 
     def _lazy_read(self):
         filepath = str(self.path)
-        evlog_reader = evlog_lib.EvlogReader(filepath)
+        evlog_reader = evlog_lib.EvlogReader(filepath, namespaces=(self.EVLOG_NAMESPACE,))
         for i, record in enumerate(evlog_reader):
             yield filepath, i, record
 
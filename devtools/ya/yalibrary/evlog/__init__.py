@@ -1,8 +1,11 @@
+import collections
 import contextlib
+import copy
 import datetime
 import io
 import logging
 import os
+import re
 import sys
 import threading
 import time
@@ -16,6 +19,8 @@ from exts import fs
 from exts import os2
 from exts import yjson
 
+from . import seekable
+
 _LOG_FILE_NAME_FMT = '%H-%M-%S'
 _LOG_DIR_NAME_FMT = '%Y-%m-%d'
 DAYS_TO_SAVE = 10
@@ -54,8 +59,17 @@ def is_compressed(filepath):
 
 
 class EvlogReader:
-    def __init__(self, filepath):
+    """
+    Reads events of an evlog, optionally only those with given namespaces or event names.
+
+    Indexed evlogs (see seekable) are read by frames: frames without requested events are skipped,
+    large selections are decoded in `jobs` processes.
+    """
+
+    def __init__(self, filepath, namespaces=None, events=None, jobs=None):
         self.filepath = filepath
+        self._filter = seekable.EventFilter(namespaces, events)
+        self._jobs = jobs
 
     @contextlib.contextmanager
     def _get_stream(self):
@@ -63,7 +77,11 @@ class EvlogReader:
             dctx = zstd.ZstdDecompressor()
 
             with open(self.filepath, 'rb') as afile:
-                stream_reader = dctx.stream_reader(afile)
+                if six.PY3:
+                    # Not closed seekable evlogs have several frames and no index
+                    stream_reader = dctx.stream_reader(afile, read_across_frames=True)
+                else:
+                    stream_reader = dctx.stream_reader(afile)
                 text_stream = io.TextIOWrapper(stream_reader, encoding='utf-8')
                 yield text_stream
         else:
@@ -71,13 +89,24 @@ class EvlogReader:
                 yield afile
 
     def __iter__(self):
+        frames = seekable.read_index(self.filepath) if is_compressed(self.filepath) else None
+        if frames is not None:
+            for event in seekable.iter_events(self.filepath, frames, self._filter, self._jobs):
+                yield event
+            return
+
+        regex = self._filter.regex if self._filter else None
         with self._get_stream() as stream:
             for nline, line in enumerate(stream):
+                if regex is not None and not regex.search(line):
+                    continue
                 try:
-                    yield yjson.loads(line)
+                    event = yjson.loads(line)
                 except Exception:
                     logging.warning("Skip broken entry at %s line. File: %s", nline + 1, self.filepath)
                     continue
+                if regex is None or self._filter.match(event):
+                    yield event
 
 
 class EmptyEvlogListException(Exception):
@@ -101,15 +130,12 @@ class EvlogWriter(object):
         self._fileobj = self._open_file(filepath)
         self._lock = threading.Lock()
         self._replacements = self._get_replacements(replacements)
+        self._secrets = self._compile_secrets(self._replacements)
 
     @staticmethod
     def _open_file(filepath):
         if is_compressed(filepath):
-            if six.PY3:
-                return zstd.open(filepath, 'w', cctx=zstd.ZstdCompressor(level=1))
-            # XXX Remove when YA-261 is done
-            else:
-                return zstd.ZstdCompressor(level=1).stream_writer(open(filepath, 'w'))
+            return seekable.SeekableZstdFile(filepath, level=1)
 
         return open(filepath, 'w')
 
@@ -138,29 +164,44 @@ class EvlogWriter(object):
 
         return s not in frozenset(["true", "false", "null"])
 
+    @staticmethod
+    def _compile_secrets(replacements):
+        if not replacements:
+            return None
+        # Longest first, so a secret containing another one is masked as a whole
+        return re.compile('|'.join(re.escape(r) for r in sorted(replacements, key=len, reverse=True)))
+
     def _remove_secrets(self, s):
-        for r in self._replacements:
-            s = s.replace(r, "[SECRET]")
-        return s
+        if self._secrets is None:
+            return s
+        return self._secrets.sub("[SECRET]", s)
 
-    def write(self, namespace, event, **kwargs):
+    @staticmethod
+    def _dumps(timestamp, thread_name, namespace, event, kwargs):
         value = {
-            'timestamp': time.time(),
-            'thread_name': threading.current_thread().name,
+            'timestamp': timestamp,
+            'thread_name': thread_name,
             'namespace': namespace,
             'event': event,
             'value': kwargs,
         }
         try:
-            s = yjson.dumps(value) + '\n'
+            return yjson.dumps(value) + '\n'
         except (UnicodeDecodeError, OverflowError):
-            s = yjson.dumps(_fix_non_utf8(value)) + '\n'
+            return yjson.dumps(_fix_non_utf8(value)) + '\n'
 
-        s = self._remove_secrets(s)
+    def write(self, namespace, event, **kwargs):
+        timestamp = time.time()
+        s = self._dumps(timestamp, threading.current_thread().name, namespace, event, kwargs)
+        self._write_data(self._remove_secrets(s), ((namespace, event, timestamp),))
 
+    def _write_data(self, s, keys):
         with self._lock:
             try:
-                self._fileobj.write(s)
+                if isinstance(self._fileobj, seekable.SeekableZstdFile):
+                    self._fileobj.write(s, keys)
+                else:
+                    self._fileobj.write(s)
             except IOError as e:
                 import errno
 
@@ -184,6 +225,133 @@ class EvlogWriter(object):
         return inner
 
 
+class AsyncEvlogWriter(EvlogWriter):
+    """
+    Writer serialising, masking and compressing events in batches on a dedicated thread.
+
+    Producers only append event tuples to a deque under a short lock, which orders appends with close():
+    an event is either queued before the writer is stopped or written synchronously. When the deque is full
+    producers wait for the writer thread,
+    or drop the event if drop_on_overflow is set, both cases are counted. Events which cannot be
+    serialised are dropped one by one and counted as failed.
+    """
+
+    MAX_QUEUE_SIZE = 100000
+    BATCH_SIZE = 1000
+    FLUSH_PERIOD = 0.1
+
+    def __init__(self, filepath, replacements=None, max_queue_size=None, drop_on_overflow=False):
+        super(AsyncEvlogWriter, self).__init__(filepath, replacements)
+        self._queue = collections.deque()
+        self._max_queue_size = max_queue_size or self.MAX_QUEUE_SIZE
+        self._drop_on_overflow = drop_on_overflow
+        self._wakeup = threading.Event()
+        self._drained = threading.Condition()
+        self._state_lock = threading.Lock()
+        self._stopped = False
+        # Counters are changed under self._drained
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._loop, name='EvlogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, namespace, event, **kwargs):
+        if self._stopped:
+            return super(AsyncEvlogWriter, self).write(namespace, event, **kwargs)
+        queue = self._queue
+        if len(queue) >= self._max_queue_size and not self._wait_queue():
+            return
+        # Event is serialised later, values which the caller may change after the call are copied
+        item = (
+            time.time(),
+            threading.current_thread().name,
+            namespace,
+            event,
+            {k: copy.copy(v) if isinstance(v, (dict, list, set)) else v for k, v in six.iteritems(kwargs)},
+        )
+        with self._state_lock:
+            stopped = self._stopped
+            if not stopped:
+                queue.append(item)
+        if stopped:
+            # Writer was stopped while the event was prepared
+            return super(AsyncEvlogWriter, self).write(namespace, event, **kwargs)
+        if len(queue) >= self.BATCH_SIZE and not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def _wait_queue(self):
+        with self._drained:
+            if self._drop_on_overflow:
+                self.dropped += 1
+                return False
+            self.blocked += 1
+            self._wakeup.set()
+            while len(self._queue) >= self._max_queue_size and not self._stopped:
+                self._drained.wait(self.FLUSH_PERIOD)
+        return True
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.FLUSH_PERIOD)
+            self._wakeup.clear()
+            stopped = self._stopped
+            self._write_queue()
+            if stopped:
+                return
+            if isinstance(self._fileobj, seekable.SeekableZstdFile):
+                with self._lock:
+                    self._fileobj.flush_expired()
+
+    def _write_queue(self):
+        queue = self._queue
+        while queue:
+            batch = []
+            try:
+                for _ in six.moves.xrange(self.BATCH_SIZE):
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            with self._drained:
+                self._drained.notify_all()
+            lines = []
+            keys = []
+            for item in batch:
+                try:
+                    lines.append(self._dumps(*item))
+                except Exception:
+                    with self._drained:
+                        self.failed += 1
+                    logging.exception("Cannot serialise evlog event %s:%s", item[2], item[3])
+                    continue
+                keys.append((item[2], item[3], item[0]))
+            if not lines:
+                continue
+            try:
+                self._write_data(self._remove_secrets(''.join(lines)), keys)
+                with self._drained:
+                    self.written += len(lines)
+            except Exception:
+                logging.exception("Cannot write %d events to evlog", len(lines))
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'blocked': self.blocked, 'failed': self.failed}
+
+    def close(self):
+        with self._state_lock:
+            stopping = not self._stopped
+            self._stopped = True
+        if stopping:
+            self._wakeup.set()
+            self._thread.join()
+            # Events appended after the last pass of the writer thread
+            self._write_queue()
+            logging.debug("Evlog writer stats: %s", self.stats())
+        super(AsyncEvlogWriter, self).close()
+
+
 class EvlogFileFinder(object):
     def __init__(self, evlog_dir, filter_func=lambda x: True):
         self._evlog_dir = evlog_dir
@@ -203,7 +371,7 @@ class EvlogFileFinder(object):
 
 
 class EvlogFacade(object):
-    def __init__(self, evlog_dir, filename=None, replacements=None, compress_evlog=True):
+    def __init__(self, evlog_dir, filename=None, replacements=None, compress_evlog=True, async_writer=False):
         fs.create_dirs(evlog_dir)
 
         self._evlog_dir = evlog_dir
@@ -212,7 +380,8 @@ class EvlogFacade(object):
         filepath = filename or self._gen_default_filepath(compress_evlog)
         logging.debug('Event log file is %s', filepath)
 
-        self.writer = EvlogWriter(filepath, replacements)
+        writer_type = AsyncEvlogWriter if async_writer else EvlogWriter
+        self.writer = writer_type(filepath, replacements)
         self.file_finder = EvlogFileFinder(evlog_dir, lambda f: f != os.path.basename(filepath))
 
     @property
@@ -265,7 +434,8 @@ class EvlogFacade(object):
 def with_evlog(params, evlog_dir, hide_token):
     filename = getattr(params, 'evlog_file', None)
     compress_evlog = getattr(params, 'compress_evlog', True)
-    evlog = EvlogFacade(evlog_dir, filename, hide_token, compress_evlog)
+    async_writer = getattr(params, 'async_evlog', False)
+    evlog = EvlogFacade(evlog_dir, filename, hide_token, compress_evlog, async_writer)
     evlog.cleanup_old_dirs()
     evlog.write('init', 'init', args=sys.argv, env=os.environ.copy())
 
@@ -273,3 +443,39 @@ def with_evlog(params, evlog_dir, hide_token):
         yield evlog
     finally:
         evlog.close()
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    threads = 64
+    secrets = ['secret-token-{}'.format(i) for i in range(10)]
+
+    for name, writer_type in ('sync', EvlogWriter), ('async', AsyncEvlogWriter):
+        path = os.path.join(tempfile.mkdtemp(), 'bench' + EvlogSuffix.ZST)
+        writer = writer_type(path, secrets)
+        write = writer.get_writer('bench')
+
+        def produce(start):
+            for x in six.moves.xrange(start, qty, threads):
+                write('NodeFinished', uid='uid-{}'.format(x), status='OK', token=secrets[x % len(secrets)])
+
+        t1 = time.time()
+        producers = [threading.Thread(target=produce, args=(i,)) for i in range(threads)]
+        for p in producers:
+            p.start()
+        for p in producers:
+            p.join()
+        t2 = time.time()
+        writer.close()
+        t3 = time.time()
+
+        written = sum(1 for event in EvlogReader(path) if event['value']['token'] == '[SECRET]')
+        assert written == qty, written
+        print(
+            '{}: producers {:.2f}s, with close {:.2f}s, {:.0f} events/s'.format(name, t2 - t1, t3 - t1, qty / (t3 - t1))
+        )
+        if hasattr(writer, 'stats'):
+            print('{}: {}'.format(name, writer.stats()))
+        fs.remove_tree_safe(os.path.dirname(path))
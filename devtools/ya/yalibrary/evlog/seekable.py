@@ -0,0 +1,253 @@
+"""
+Seekable evlog format.
+
+File is a sequence of independent zstd frames, each holding whole event lines, and a trailing zstd skippable frame
+with the json index of data frames: offset, size, line count, time range and events by namespace.
+Standard zstd tools decompress such files as usual, skipping the index.
+"""
+
+import json
+import logging
+import os
+import re
+import struct
+import time
+
+import six
+import zstandard as zstd
+
+from exts import yjson
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_MAGIC = b'YEVI'
+SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+# skippable frame magic, frame size
+FRAME_HEADER = struct.Struct('<II')
+# index length, index magic
+INDEX_TRAILER = struct.Struct('<I4s')
+# Uncompressed size of a data frame
+FRAME_SIZE = 4 * 1024 * 1024
+# Seconds after which buffered lines are written as a frame regardless of its size
+FRAME_PERIOD = 5
+# Smaller selections are not worth starting processes
+MIN_PARALLEL_SIZE = 16 * 1024 * 1024
+
+
+class EventFilter(object):
+    """
+    Selects events by namespace or name: an event passes if any of them matches.
+
+    Lines are prefiltered with a regex over raw json, so unrelated lines are not decoded.
+    Top level keys precede 'value' both in insertion and sorted order, hence a raw match can only be
+    a false positive from nested values, and it is rechecked after decoding.
+    """
+
+    def __init__(self, namespaces=None, events=None):
+        self.namespaces = frozenset(namespaces or ())
+        self.events = frozenset(events or ())
+        self._regex = None
+
+    def __bool__(self):
+        return bool(self.namespaces or self.events)
+
+    __nonzero__ = __bool__
+
+    def __getstate__(self):
+        return self.namespaces, self.events
+
+    def __setstate__(self, state):
+        self.namespaces, self.events = state
+        self._regex = None
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            alternatives = []
+            for key, names in ('namespace', self.namespaces), ('event', self.events):
+                if names:
+                    values = '|'.join(re.escape(json.dumps(name)) for name in sorted(names))
+                    alternatives.append(r'"{}": ?(?:{})'.format(key, values))
+            self._regex = re.compile('|'.join(alternatives))
+        return self._regex
+
+    def match_frame(self, frame):
+        for namespace, events in six.iteritems(frame['events']):
+            if namespace in self.namespaces or not self.events.isdisjoint(events):
+                return True
+        return False
+
+    def match(self, event):
+        return event.get('namespace') in self.namespaces or event.get('event') in self.events
+
+
+class SeekableZstdFile(object):
+    """
+    Writes evlog lines into independent zstd frames and the index of frames on close.
+
+    A frame is written when it reaches frame_size or when its first line is older than frame_period,
+    so a running or killed process leaves recent events on disk.
+    """
+
+    def __init__(self, filepath, level=1, frame_size=FRAME_SIZE, frame_period=FRAME_PERIOD):
+        self._file = open(filepath, 'wb')
+        self._cctx = zstd.ZstdCompressor(level=level)
+        self._frame_size = frame_size
+        self._frame_period = frame_period
+        self._frames = []
+        self._reset_frame()
+        self.closed = False
+
+    def _reset_frame(self):
+        self._buffer = []
+        self._buffer_size = 0
+        self._frame_time = None
+        self._lines = 0
+        self._start = None
+        self._end = None
+        self._events = {}
+
+    def write(self, data, keys=()):
+        """Writes whole lines, keys are (namespace, event, timestamp) of them"""
+        data = six.ensure_binary(data)
+        if self._frame_time is None:
+            self._frame_time = time.time()
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        for namespace, event, timestamp in keys:
+            self._events.setdefault(namespace, set()).add(event)
+            if self._start is None or timestamp < self._start:
+                self._start = timestamp
+            if self._end is None or timestamp > self._end:
+                self._end = timestamp
+            self._lines += 1
+        if self._buffer_size >= self._frame_size:
+            self._write_frame()
+        else:
+            self.flush_expired()
+
+    def flush_expired(self):
+        """Writes and flushes the buffered frame if it is older than frame period"""
+        if self._frame_time is not None and time.time() - self._frame_time >= self._frame_period:
+            self.flush()
+
+    def _write_frame(self):
+        if not self._buffer:
+            return
+        frame = self._cctx.compress(b''.join(self._buffer))
+        offset = self._file.tell()
+        self._file.write(frame)
+        self._frames.append(
+            {
+                'offset': offset,
+                'size': len(frame),
+                'lines': self._lines,
+                'start': self._start,
+                'end': self._end,
+                'events': {namespace: sorted(events) for namespace, events in six.iteritems(self._events)},
+            }
+        )
+        self._reset_frame()
+
+    def flush(self):
+        self._write_frame()
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._write_frame()
+            index = six.ensure_binary(json.dumps({'version': INDEX_VERSION, 'frames': self._frames}))
+            payload = index + INDEX_TRAILER.pack(len(index), INDEX_MAGIC)
+            self._file.write(FRAME_HEADER.pack(SKIPPABLE_FRAME_MAGIC, len(payload)) + payload)
+        finally:
+            self._file.close()
+            self.closed = True
+
+
+def read_index(filepath):
+    """Returns list of data frames or None if the file has no index (legacy or not closed evlog)"""
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+        if file_size < FRAME_HEADER.size + INDEX_TRAILER.size:
+            return None
+        f.seek(file_size - INDEX_TRAILER.size)
+        index_size, magic = INDEX_TRAILER.unpack(f.read(INDEX_TRAILER.size))
+        header_offset = file_size - INDEX_TRAILER.size - index_size - FRAME_HEADER.size
+        if magic != INDEX_MAGIC or header_offset < 0:
+            return None
+        f.seek(header_offset)
+        frame_magic, payload_size = FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))
+        if frame_magic != SKIPPABLE_FRAME_MAGIC or payload_size != index_size + INDEX_TRAILER.size:
+            return None
+        index = json.loads(f.read(index_size))
+    if index.get('version') != INDEX_VERSION:
+        logger.debug("Unsupported evlog index version %s in %s", index.get('version'), filepath)
+        return None
+    return index['frames']
+
+
+def decode_lines(lines, event_filter, loads):
+    regex = event_filter.regex if event_filter else None
+    for line in lines:
+        if regex is not None and not regex.search(line):
+            continue
+        try:
+            event = loads(line)
+        except Exception:
+            logger.warning("Skip broken evlog entry: %s", line[:100])
+            continue
+        if regex is None or event_filter.match(event):
+            yield event
+
+
+def _iter_frame(filepath, offset, size, event_filter):
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        data = zstd.ZstdDecompressor().decompress(f.read(size))
+    lines = six.ensure_str(data, errors='replace').split('\n')
+    return decode_lines((line for line in lines if line), event_filter, yjson.loads)
+
+
+def _read_frame(args):
+    return list(_iter_frame(*args))
+
+
+def _get_pool(jobs):
+    try:
+        import multiprocessing
+
+        # Workers must not import ya again, so only fork is suitable
+        return multiprocessing.get_context('fork').Pool(jobs)
+    except (AttributeError, ValueError, OSError) as e:
+        logger.debug("Cannot start evlog reader processes: %s", e)
+        return None
+
+
+def iter_events(filepath, frames, event_filter=None, jobs=None):
+    """Decodes selected frames in order, in parallel processes for large selections"""
+    if event_filter:
+        frames = [frame for frame in frames if event_filter.match_frame(frame)]
+    tasks = [(filepath, frame['offset'], frame['size'], event_filter) for frame in frames]
+
+    if jobs is None:
+        jobs = os.cpu_count() if six.PY3 else 1
+    pool = None
+    if len(tasks) > 1 and jobs > 1 and sum(frame['size'] for frame in frames) >= MIN_PARALLEL_SIZE:
+        pool = _get_pool(min(jobs, len(tasks)))
+
+    if pool is None:
+        for task in tasks:
+            for event in _iter_frame(*task):
+                yield event
+        return
+
+    try:
+        for events in pool.imap(_read_frame, tasks):
+            for event in events:
+                yield event
+    finally:
+        pool.terminate()
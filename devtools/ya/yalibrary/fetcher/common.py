@@ -1,3 +1,4 @@
+import errno
 import logging
 import os
 import stat
@@ -6,7 +7,9 @@ from functools import wraps
 from toolz.functoolz import curry, memoize
 
 import exts.fs as fs
+import exts.process
 import exts.yjson as json
+from exts import uniq_id
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +18,13 @@ RENAME = 1
 FIXED_NAME = 2
 BINARY = 3
 
+RESOURCE_INFO_JSON = "resource_info.json"
+RESOURCE_CONTENT_FILE_NAME = "resource"
+RESOURCE_URI = "lnk"
+
+# Download runs ahead of extraction by the pipe buffer at most
+STREAM_BUFFER_SIZE = 1024 * 1024
+
 
 def clean_dir(dir):
     try:
@@ -26,10 +36,6 @@ def clean_dir(dir):
 
 
 def deploy_tool(archive, extract_to, post_process, resource_info, resource_uri, binname=None, strip_prefix=None):
-    RESOURCE_INFO_JSON = "resource_info.json"
-    RESOURCE_CONTENT_FILE_NAME = "resource"
-    RESOURCE_URI = "lnk"
-
     if UNTAR == post_process:
         try:
             import exts.archive
@@ -52,6 +58,88 @@ def deploy_tool(archive, extract_to, post_process, resource_info, resource_uri,
         st = os.stat(full_path)
         os.chmod(full_path, st.st_mode | stat.S_IEXEC)
 
+    _write_meta(extract_to, resource_info, resource_uri)
+
+
+def can_stream_deploy():
+    return exts.process.can_fork()
+
+
+def stream_deploy_tool(download_stream, extract_to, resource_info, resource_uri, strip_prefix=None):
+    """
+    Extracts archive while it is being downloaded, the archive is not stored on disk.
+
+    download_stream(write) passes the archive content to write and checks its integrity after the last byte.
+    Content goes through a pipe to a forked process, which extracts it to a temporary dir: libarchive holds
+    the GIL while it waits for data, so it cannot be fed by a thread. The temporary dir replaces extract_to
+    only if both extraction and download succeed.
+    """
+    # Imported before fork, so that the extraction process does not import it
+    import exts.archive  # noqa: F401
+
+    tmp_dir = '{}.extract-{}'.format(extract_to, uniq_id.gen8())
+    read_fd, write_fd = exts.process.make_pipe(STREAM_BUFFER_SIZE)
+    try:
+        extraction = exts.process.ForkedCall(_extract_stream, (read_fd, tmp_dir, strip_prefix), keep_fds=(read_fd,))
+    except Exception:
+        os.close(write_fd)
+        raise
+    finally:
+        os.close(read_fd)
+
+    logger.debug(
+        "extract stream to {0} dir (strip_prefix={1}) in process {2}".format(tmp_dir, strip_prefix, extraction.pid)
+    )
+    try:
+        try:
+            with os.fdopen(write_fd, 'wb') as stream:
+                download_stream(stream.write)
+        except EnvironmentError as e:
+            # Extraction has stopped early, its error is raised below
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            # Extraction process reads the stream to the end, so download error goes first
+            error = extraction.wait()
+        if error is not None:
+            raise Exception("Extraction of downloaded stream failed: {}".format(error))
+        _replace_dir(tmp_dir, extract_to)
+    except Exception:
+        fs.remove_tree_safe(tmp_dir)
+        raise
+
+    _write_meta(extract_to, resource_info, resource_uri)
+
+
+def _extract_stream(read_fd, tmp_dir, strip_prefix):
+    import exts.archive
+
+    exts.archive.extract_from_tar(read_fd, tmp_dir, strip_components=strip_prefix)
+    # Archive may be followed by padding, download is finished and checked only after it is read
+    _drain(read_fd)
+
+
+def _drain(fd):
+    while os.read(fd, STREAM_BUFFER_SIZE):
+        pass
+
+
+def _replace_dir(src, dst):
+    try:
+        # Resource dir is empty unless something is already deployed there
+        os.rmdir(dst)
+    except OSError:
+        pass
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        return
+
+    for name in os.listdir(src):
+        os.rename(os.path.join(src, name), os.path.join(dst, name))
+    os.rmdir(src)
+
+
+def _write_meta(extract_to, resource_info, resource_uri):
     meta_info = os.path.join(extract_to, RESOURCE_INFO_JSON)
     if os.path.exists(meta_info):
         logger.debug("Meta information cannot be stored: {} already exists".format(meta_info))
@@ -16,8 +16,10 @@ from .common import (
     RENAME,
     UNTAR,
     ProgressPrinter,
+    can_stream_deploy,
     clean_dir,
     deploy_tool,
+    stream_deploy_tool,
 )
 
 from .cache_helper import install_resource
@@ -85,7 +87,16 @@ def fetch_resource_if_need(
     def do_deploy(download_to, resource_info):
         deploy_tool(download_to, result_dir, post_process, resource_info, resource_uri, binname, strip_prefix)
 
-    return _do_fetch_resource_if_need(result_dir, downloader, do_deploy, target_is_tool_dir, force_refetch)
+    def do_stream_deploy():
+        stream_deploy_tool(downloader.download_stream, result_dir, downloader.info, resource_uri, strip_prefix)
+
+    stream_deployer = None
+    if post_process == UNTAR and downloader.can_stream() and can_stream_deploy():
+        stream_deployer = do_stream_deploy
+
+    return _do_fetch_resource_if_need(
+        result_dir, downloader, do_deploy, target_is_tool_dir, force_refetch, stream_deployer
+    )
 
 
 def select_resource(item, platform=None):
@@ -139,9 +150,17 @@ def _get_downloader(fetcher, parsed_uri, progress_callback, state, keep_director
         raise Exception('Unsupported resource_uri {}'.format(parsed_uri.resource_uri))
 
 
-def _do_fetch_resource_if_need(result_dir, downloader, deployer, target_is_tool_dir=True, force_refetch=False):
+def _do_fetch_resource_if_need(
+    result_dir, downloader, deployer, target_is_tool_dir=True, force_refetch=False, stream_deployer=None
+):
     def do_install():
         guards.update_guard(guards.GuardTypes.FETCH)
+        if stream_deployer is not None:
+            try:
+                return stream_deployer()
+            except Exception as e:
+                logger.debug("Extraction while downloading to %s failed, download the archive first: %s", result_dir, e)
+                clean_dir(result_dir)
         download_to = os.path.join(result_dir, 'resource.' + uniq_id.gen8())
         resource_info = downloader(download_to)
         deployer(download_to, resource_info)
@@ -158,6 +177,12 @@ class DownloaderBase(object):
     def __call__(self, download_to):
         raise NotImplementedError()
 
+    def can_stream(self):
+        return False
+
+    def download_stream(self, write):
+        raise NotImplementedError()
+
 
 class _HttpDownloader(DownloaderBase):
     def __init__(self, resource_url, resource_md5, resource_info):
@@ -169,6 +194,16 @@ class _HttpDownloader(DownloaderBase):
         http_client.download_file(url=self._url, path=download_to, expected_md5=self._md5)
         return self._info
 
+    @property
+    def info(self):
+        return self._info
+
+    def can_stream(self):
+        return True
+
+    def download_stream(self, write):
+        http_client.download_stream_with_integrity(self._url, write, 'md5-' + (self._md5 or ''), 'hex')
+
 
 class _HttpDownloaderWithIntegrity(DownloaderBase):
     def __init__(self, resource_url, integrity, resource_info):
@@ -181,6 +216,16 @@ class _HttpDownloaderWithIntegrity(DownloaderBase):
         http_client.download_file_with_integrity(url=self._url, path=download_to, integrity=self._integrity)
         return self._info
 
+    @property
+    def info(self):
+        return self._info
+
+    def can_stream(self):
+        return True
+
+    def download_stream(self, write):
+        http_client.download_stream_with_integrity(self._url, write, self._integrity)
+
 
 class _HttpDownloaderWithConfigMapping(_HttpDownloader):
     def __init__(self, resource_id, resource_info):
@@ -44,6 +44,13 @@ class OutputsExceedLimitError(BuildRootError):
     pass
 
 
+def _file_signature(st):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1e9)
+    return st.st_ino, st.st_size, mtime_ns
+
+
 class OutputDigests(object):
     def __init__(self, root_path, version, file_digests, outputs_uid):
         self._root_path = root_path
@@ -100,21 +107,33 @@ class BuildRoot(object):
         self._dir_outputs = []
         self._validate_content = validate_content
         self._compute_hash = compute_hash
+        # path -> ((inode, size, mtime_ns), digest), digests are computed again only for changed files
+        self._file_digests = {}
+        self._dir_outputs_scan = None
+        self.hashed_bytes = 0
+        self.skipped_bytes = 0
         if dir_outputs:
             self._dir_outputs = [x.replace('$(BUILD_ROOT)', path) for x in dir_outputs]
 
+    def _scan_dir_outputs(self):
+        """Walks dir outputs once, returns their files and empty directories"""
+        if self._dir_outputs_scan is None:
+            files = []
+            empty_dirs = []
+            for dir_output in self._dir_outputs:
+                # Missing dir output is walked as empty
+                for root, dirs, names in os.walk(dir_output):
+                    files.extend(os.path.join(root, name) for name in names)
+                    if not dirs and not names:
+                        empty_dirs.append(root)
+            self._dir_outputs_scan = files, empty_dirs
+        return self._dir_outputs_scan
+
     @exts.func.lazy_property
     def dir_outputs_files(self):
-        dir_output_files = []
-        empty_dirs = []
-        for dir_output in self._dir_outputs:
-            if not os.path.exists(dir_output):
-                continue
-            for root, dirs, files in os.walk(dir_output):
-                for f in files:
-                    dir_output_files.append(os.path.join(root, f))
-                if not dirs and not files:
-                    empty_dirs.append(os.path.relpath(root, self.path))
+        files, empty_dirs = self._scan_dir_outputs()
+        dir_output_files = list(files)
+        empty_dirs = [os.path.relpath(d, self.path) for d in empty_dirs]
         empty_meta_path = os.path.join(self.path, EMPTY_DIR_OUTPUTS_META)
         if os.path.exists(empty_meta_path):
             # case when we're restoring dir outputs from cache
@@ -211,12 +230,11 @@ class BuildRoot(object):
 
     def validate_dir_outputs(self):
         dir_outputs_archive_map = self.dir_outputs_archive_map
+        _, empty_dirs = self._scan_dir_outputs()
+        for empty_dir in empty_dirs:
+            if empty_dir not in self._dir_outputs:
+                logger.warning("{} directory is empty".format(empty_dir))
         for dir_output in self._dir_outputs:
-            for root, dirs, files in os.walk(dir_output):
-                for d in dirs:
-                    joined_dir = os.path.join(os.path.join(root, d))
-                    if not os.listdir(joined_dir):
-                        logger.warning("{} directory is empty".format(joined_dir))
             if dir_outputs_archive_map[dir_output] is None:
                 raise ValueError("No declared archive for {} dir_output, outputs: {}".format(dir_output, self._outputs))
 
@@ -229,6 +247,7 @@ class BuildRoot(object):
                 and exts.archive.is_archive_type(dir_output_archive_path)
             ):
                 archive.extract_from_tar(dir_output_archive_path, dir_output)
+                self._dir_outputs_scan = None
 
     def propagate_dir_outputs(self):
         for real_dir_output in self.dir_outputs_files:
@@ -253,6 +272,25 @@ class BuildRoot(object):
     def _output_digests_file(self):
         return os.path.join(self.path, OUTPUT_DIGESTS_FILE_NAME)
 
+    def _file_digest(self, path):
+        """Returns digest of the file or None if it does not exist"""
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        signature = _file_signature(st)
+        cached = self._file_digests.get(path)
+        if cached is not None and cached[0] == signature:
+            self.skipped_bytes += st.st_size
+            return cached[1]
+
+        digest = acdigest.get_file_digest(path)
+        self._file_digests[path] = signature, digest
+        self.hashed_bytes += st.st_size
+        return digest
+
     def read_output_digests(self, force_recalc=False, write_if_absent=False):
         digests_file = self._output_digests_file()
         content_hash_file = self._hash_file()
@@ -275,12 +313,11 @@ class BuildRoot(object):
         digests = {}
         hashes = []
         for output in self._outputs:
-            if os.path.exists(output):
-                d = acdigest.get_file_digest(output)
-                digests[output] = d
-                hashes.append(d.content_digest)
-            else:
+            d = self._file_digest(output)
+            if d is None:
                 return None
+            digests[output] = d
+            hashes.append(d.content_digest)
         outputs_uid = hashing.sum_hashes(hashes)
 
         output_digests = OutputDigests(self.path, acdigest.digest_current_version, digests, outputs_uid)
@@ -446,6 +483,11 @@ class BuildRootSet(object):
         try:
             dirs_left = len(os.listdir(self._build_root)) - 1  # Account for STAMP file in self._build_root
             logger.debug('Build root %s created=%s left=%s', self._build_root, len(self._roots), dirs_left)
+            logger.debug(
+                'Output digests: %s hashed, %s reused',
+                formatter.format_size(sum(root.hashed_bytes for root in self._roots)),
+                formatter.format_size(sum(root.skipped_bytes for root in self._roots)),
+            )
         except Exception:
             pass
 
@@ -0,0 +1,133 @@
+import array
+import heapq
+import logging
+
+import exts.yjson as json
+
+
+logger = logging.getLogger(__name__)
+
+# Weight of a node without any duration estimate
+UNIT_DURATION = 1
+MAX_WEIGHT = 2**31 - 1
+
+
+def execution_log_durations(execution_log):
+    """
+    Extracts node durations (ms) by uid from the runner execution log ({uid: {'timing': [start, end]}}, seconds).
+    """
+    durations = {}
+    for uid, info in execution_log.items():
+        timing = info.get('timing') if isinstance(info, dict) else None
+        if timing:
+            durations[uid] = int((timing[1] - timing[0]) * 1000)
+    return durations
+
+
+def load_durations(path):
+    """
+    Loads historical node durations (ms) by uid.
+    Accepts either a dumped execution log or a list of task descriptions with 'uid' and 'elapsed' (ms)
+    as written by build statistics.
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        return execution_log_durations(data)
+    return {task['uid']: int(task['elapsed']) for task in data if task.get('uid') and task.get('elapsed') is not None}
+
+
+def node_durations(index, durations=None):
+    """
+    Returns per-node durations column for the GraphIndex.
+    Nodes without history get the median of known durations, or UNIT_DURATION if nothing is known.
+    Durations are clamped to [UNIT_DURATION, MAX_WEIGHT] to fit the column.
+    """
+    durations = durations or {}
+    known = sorted(v for v in durations.values() if v > 0)
+    default = known[len(known) // 2] if known else UNIT_DURATION
+    return array.array(
+        'i', (min(max(durations.get(uid, default), UNIT_DURATION), MAX_WEIGHT) for uid in index.uids())
+    )
+
+
+def calc_remaining_path(index, durations, out=None):
+    """
+    Computes longest remaining path weight for every node: its own duration plus the heaviest chain of dependants.
+    Nodes are visited in reverse topological order without recursion, so the pass is linear in graph size.
+    """
+    size = len(index)
+    weights = out if out is not None else array.array('i', bytes(size * 4))
+    dependants = array.array('i', bytes(size * 4))
+    for d in index.dep_targets:
+        dependants[d] += 1
+
+    stack = [i for i in range(size) if dependants[i] == 0]
+    while stack:
+        i = stack.pop()
+        w = min(weights[i] + durations[i], MAX_WEIGHT)
+        weights[i] = w
+        for d in index.deps(i):
+            if weights[d] < w:
+                weights[d] = w
+            dependants[d] -= 1
+            if dependants[d] == 0:
+                stack.append(d)
+
+    return weights
+
+
+def simulate(index, durations, priorities, threads):
+    """
+    List scheduling of the graph on `threads` identical slots.
+    Ready nodes are started in order of descending priority. Returns predicted wall time in ms.
+    """
+    if threads < 1:
+        raise ValueError('Number of threads must be positive, got {}'.format(threads))
+    size = len(index)
+    waiting = array.array('i', (index.dep_offsets[i + 1] - index.dep_offsets[i] for i in range(size)))
+    dependants = [[] for _ in range(size)]
+    for i in range(size):
+        for d in index.deps(i):
+            dependants[d].append(i)
+
+    ready = [(-priorities[i], i) for i in range(size) if waiting[i] == 0]
+    heapq.heapify(ready)
+    running = []
+    now = 0
+    while ready or running:
+        while ready and len(running) < threads:
+            _, i = heapq.heappop(ready)
+            heapq.heappush(running, (now + durations[i], i))
+        now, i = heapq.heappop(running)
+        for x in dependants[i]:
+            waiting[x] -= 1
+            if waiting[x] == 0:
+                heapq.heappush(ready, (-priorities[x], x))
+
+    return now
+
+
+def compare_orderings(graph, durations, threads):
+    """
+    Replays recorded node durations (ms by uid) against the static graph priorities, hop-based max_dist
+    and the critical path ordering.
+    Returns predicted wall times in ms.
+    """
+    from yalibrary.runner.graph_index import GraphIndex
+
+    index = GraphIndex(graph['graph'])
+    node_times = node_durations(index, durations)
+    static = [n.get('priority') or 0 for n in graph['graph']]
+    # Runner's default max_dist ordering is the longest chain of dependants in hops
+    hops = calc_remaining_path(index, node_durations(index))
+    critical = calc_remaining_path(index, node_times)
+    result = {
+        'static_priority': simulate(index, node_times, static, threads),
+        'max_dist': simulate(index, node_times, hops, threads),
+        'critical_path': simulate(index, node_times, critical, threads),
+        'lower_bound': max(critical) if critical else 0,
+    }
+    logger.debug('Predicted wall time (ms) for %d threads: %s', threads, result)
+    return result
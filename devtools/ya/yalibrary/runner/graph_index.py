@@ -0,0 +1,94 @@
+import array
+
+
+class GraphIndex(object):
+    """
+    Numbered view of the build graph.
+
+    Every node gets a dense integer id in graph order. Dependencies are kept in CSR form
+    (dep_offsets/dep_targets) and per-node counters live in array-backed columns.
+    Runner nodes keep only a reference to the node dict of the graph, mutable state lives in the columns.
+    """
+
+    def __init__(self, graph_nodes):
+        self.ids = {}
+        size = 0
+        for n in graph_nodes:
+            self.ids[n.get('uid')] = size
+            size += 1
+
+        self.dep_offsets = array.array('i', [0])
+        self.dep_targets = array.array('i')
+        ids = self.ids
+        for n in graph_nodes:
+            self.dep_targets.extend(ids[d] for d in n.get('deps') or ())
+            self.dep_offsets.append(len(self.dep_targets))
+
+        self.refcounts = array.array('i', bytes(size * self.dep_offsets.itemsize))
+        self.max_dists = array.array('i', bytes(size * self.dep_offsets.itemsize))
+
+    def __len__(self):
+        return len(self.dep_offsets) - 1
+
+    def __contains__(self, uid):
+        return uid in self.ids
+
+    def id(self, uid):
+        return self.ids[uid]
+
+    def uids(self):
+        """Returns uids ordered by node id"""
+        result = [None] * len(self)
+        for uid, i in self.ids.items():
+            result[i] = uid
+        return result
+
+    def deps(self, i):
+        return self.dep_targets[self.dep_offsets[i] : self.dep_offsets[i + 1]]
+
+    def count_refs(self):
+        refcounts = self.refcounts
+        for d in self.dep_targets:
+            refcounts[d] += 1
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import time
+    import tracemalloc
+
+    from yalibrary.runner import critical_path
+
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    rnd = random.Random(0)
+    graph_nodes = [
+        {'uid': 'uid-{}'.format(i), 'deps': ['uid-{}'.format(rnd.randrange(i)) for _ in range(min(i, rnd.randint(0, 4)))]}
+        for i in range(qty)
+    ]
+
+    def first_dispatch(critical):
+        index = GraphIndex(graph_nodes)
+        index.count_refs()
+        if critical:
+            critical_path.calc_remaining_path(index, critical_path.node_durations(index), out=index.max_dists)
+        offsets = index.dep_offsets
+        ready = (i for i in range(len(index)) if offsets[i] == offsets[i + 1])
+        return index, max(ready, key=index.max_dists.__getitem__)
+
+    for critical in False, True:
+        t = time.time()
+        index, first = first_dispatch(critical)
+        print('first dispatch{} (s)'.format(' with critical path' if critical else ''), time.time() - t)
+        del index
+
+    tracemalloc.start()
+    index, first = first_dispatch(True)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('nodes {}, deps {}'.format(len(index), len(index.dep_targets)))
+    print('index memory (MB)', current / float(1 << 20))
+    print('index memory per node (bytes)', current / float(qty))
+    print('peak memory (MB)', peak / float(1 << 20))
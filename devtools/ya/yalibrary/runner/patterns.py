@@ -1,5 +1,6 @@
 import logging
 import re
+import threading
 from six.moves import collections_abc
 
 import six
@@ -7,15 +8,79 @@ import six
 SUBST_PATTERN = re.compile(r'\$\((.*?)\)')
 
 
+class Template(object):
+    """String split once into literal parts (even positions) and pattern names (odd positions)"""
+
+    __slots__ = ('text', 'parts', 'names', 'format')
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = SUBST_PATTERN.split(text)
+        self.names = frozenset(self.parts[1::2])
+        # %-format string renders the whole template in one call
+        self.format = None
+        if not any('(' in name or ')' in name for name in self.names):
+            self.format = ''.join(
+                '%(' + part + ')s' if i % 2 else part.replace('%', '%%') for i, part in enumerate(self.parts)
+            )
+
+    def render(self, values, unresolved=None):
+        if unresolved is None and self.format is not None:
+            try:
+                return self.format % values
+            except KeyError:
+                pass
+        parts = self.parts
+        result = list(parts)
+        for i in six.moves.xrange(1, len(parts), 2):
+            value = values.get(parts[i])
+            if value is None:
+                value = '$(' + parts[i] + ')'
+                if unresolved is not None:
+                    unresolved.add(parts[i])
+            result[i] = value
+        return ''.join(result)
+
+
+_STRING_TYPES = frozenset(six.string_types)
+
+# Command arguments repeat a lot across graph nodes, every distinct string is parsed once
+_templates = {}
+
+
+def compile_template(text):
+    """Returns interned Template of the string or None if it has no patterns"""
+    if '$(' not in text:
+        return None
+    template = _templates.get(text)
+    if template is None:
+        template = Template(text)
+        if not template.names:
+            template = None
+        _templates[text] = template
+    return template
+
+
+def _fill_string(text, values, unresolved):
+    template = compile_template(text)
+    return text if template is None else template.render(values, unresolved)
+
+
 class Patterns(object):
     def __init__(self, parent=None):
         self._parent = parent
         self._map = {}
+        self._lock = threading.Lock()
+        # Flattened chain of maps and the parent's flattened map it was built from
+        self._values = None
+        self._values_base = None
 
     def __setitem__(self, key, value):
         assert key not in self._map
         assert isinstance(value, six.string_types)
-        self._map[key] = value
+        with self._lock:
+            self._map[key] = value
+            self._values = None
 
     def sub(self):
         return Patterns(self)
@@ -50,14 +115,27 @@ class Patterns(object):
         except KeyError:
             return default
 
+    def values(self):
+        """Returns all patterns of the chain as a single dict, it must not be modified"""
+        base = self._parent.values() if self._parent is not None else None
+        with self._lock:
+            if self._values is None or self._values_base is not base:
+                values = dict(base) if base else {}
+                values.update(self._map)
+                self._values = values
+                self._values_base = base
+            return self._values
+
     @staticmethod
     def _iter(obj):
         try:
             if obj is None:
                 return
             elif isinstance(obj, six.string_types):  # In python2: str & bytes, in py3 only str
-                for x in SUBST_PATTERN.finditer(obj):
-                    yield x.group(1)
+                template = compile_template(obj)
+                if template is not None:
+                    for x in template.names:
+                        yield x
             elif isinstance(obj, dict):
                 for v in six.itervalues(obj):
                     for x in Patterns._iter(v):
@@ -78,34 +156,45 @@ class Patterns(object):
             logging.warning("Patterns._iter stack: (%r) `%r`", type(obj), obj)
             raise
 
-    def unresolved(self, obj):
-        seen = set()
+    def names(self, obj):
+        return set(self._iter(obj))
 
-        for x in self._iter(obj):
-            seen.add(x)
+    def missing(self, names):
+        values = self.values()
+        return {x for x in names if x not in values}
 
-        for x in seen:
-            try:
-                self[x]
-            except KeyError:
-                yield x
+    def unresolved(self, obj):
+        for x in self.missing(self.names(obj)):
+            yield x
 
     def fix(self, obj):
         return self.fill(obj)
 
-    def fill(self, obj):
+    def fill(self, obj, unresolved=None):
+        """Substitutes patterns in strings of obj, names without value are added to unresolved set if given"""
+        return self._fill(obj, self.values(), unresolved)
+
+    @staticmethod
+    def _fill(obj, values, unresolved):
         try:
             if obj is None:
                 return obj
             if isinstance(obj, six.string_types):  # py2: str & bytes, py3: str
-                return SUBST_PATTERN.sub(lambda x: self.get(x.group(1), x.group(0)), obj)
+                return _fill_string(obj, values, unresolved)
             if isinstance(obj, dict):
-                return {k: self.fill(v) for k, v in six.iteritems(obj)}
+                # Strings without patterns are the most common case, they are returned without calls
+                return {
+                    k: v if type(v) in _STRING_TYPES and '$(' not in v else Patterns._fill(v, values, unresolved)
+                    for k, v in six.iteritems(obj)
+                }
             if isinstance(obj, six.binary_type):
                 # This will fail only on python3
                 raise TypeError("Can't fill binary string `{!r}`, check logs and convert it into str".format(obj))
             if isinstance(obj, collections_abc.Iterable):
-                return [self.fill(x) for x in obj]
+                return [
+                    x if type(x) in _STRING_TYPES and '$(' not in x else Patterns._fill(x, values, unresolved)
+                    for x in obj
+                ]
 
             raise TypeError("Unknown value type to fill `{!r}`: {!r}".format(type(obj), obj))
         except Exception:
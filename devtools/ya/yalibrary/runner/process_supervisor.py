@@ -0,0 +1,330 @@
+import errno
+import logging
+import os
+import threading
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+import six
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+# Exits are polled with this period for children without pidfd
+POLL_PERIOD = 0.01
+MAX_STDERR_SIZE = 64 * 1024 * 1024
+
+
+def is_supported():
+    return selectors is not None and os.name == 'posix'
+
+
+def _pidfd_open(pid):
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        return None
+
+
+class Child(object):
+    """
+    Output and exit state of a supervised process.
+
+    Stderr is split into lines by the supervisor thread: lines starting with the message prefix are queued
+    for the owner, the rest is kept in a buffer bounded by MAX_STDERR_SIZE.
+    """
+
+    def __init__(self, proc, message_prefix):
+        self.proc = proc
+        self._message_prefix = message_prefix
+        self._cond = threading.Condition()
+        self._messages = []
+        self._stderr = []
+        self._stderr_size = 0
+        self._truncated = 0
+        self._tail = b''
+        self._eof = False
+        self._exited = False
+        self.failed = False
+        self.pidfd = _pidfd_open(proc.pid)
+
+    def _append_stderr(self, data):
+        room = MAX_STDERR_SIZE - self._stderr_size
+        if len(data) > room:
+            self._truncated += len(data) - max(room, 0)
+            data = data[: max(room, 0)]
+        if data:
+            self._stderr.append(data)
+            self._stderr_size += len(data)
+
+    def feed(self, data):
+        data = self._tail + data
+        end = data.rfind(b'\n') + 1
+        self._tail = data[end:]
+        self._split(data[:end])
+
+    def _split(self, data):
+        prefix = self._message_prefix
+        if not data.startswith(prefix) and b'\n' + prefix not in data:
+            self._append_stderr(data)
+            return
+
+        messages = []
+        start = 0
+        while start < len(data):
+            end = data.find(b'\n', start) + 1 or len(data)
+            line = data[start:end]
+            start = end
+            if line.startswith(prefix):
+                messages.append(six.ensure_str(line, errors='replace'))
+            else:
+                self._append_stderr(line)
+        with self._cond:
+            self._messages.extend(messages)
+            self._cond.notify()
+
+    def set_eof(self):
+        if self._tail:
+            # Last line without line feed
+            self._split(self._tail)
+            self._tail = b''
+        with self._cond:
+            self._eof = True
+            self._cond.notify()
+
+    def fail(self, error):
+        """Stops reading stderr after a supervisor error, the error is added to stderr"""
+        self.failed = True
+        self._tail = b''
+        self._append_stderr(six.ensure_binary('\n[Cannot read stderr of the process: {}]\n'.format(error)))
+        self.set_eof()
+
+    def set_exited(self):
+        with self._cond:
+            self._exited = True
+            self._cond.notify()
+
+    def wait(self, handle_message, timeout):
+        """Passes queued messages to handle_message, returns True when stderr is closed and the process exited"""
+        with self._cond:
+            if not self._messages and not (self._eof and self._exited):
+                self._cond.wait(timeout)
+            messages, self._messages = self._messages, []
+            done = self._eof and self._exited
+        for message in messages:
+            handle_message(message)
+        return done
+
+    def stderr(self):
+        stderr = six.ensure_str(b''.join(self._stderr), errors='replace')
+        if self._truncated:
+            stderr += '\n[{} bytes of stderr truncated]\n'.format(self._truncated)
+        return stderr
+
+
+class ProcessSupervisor(object):
+    """
+    Single thread serving stderr pipes and exits of all supervised children with one selector.
+
+    Exits are watched with pidfd where available and polled otherwise.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in self._wakeup_r, self._wakeup_w:
+            _set_nonblocking(fd)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._polled = set()
+        self._thread = threading.Thread(target=self._loop, name='ProcessSupervisor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, proc, message_prefix):
+        child = Child(proc, message_prefix)
+        with self._lock:
+            self._pending.append(child)
+        try:
+            os.write(self._wakeup_w, b'.')
+        except OSError as e:
+            # Pipe is full, so the supervisor is going to wake up anyway
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        return child
+
+    def _register(self, child):
+        self._selector.register(child.proc.stderr.fileno(), selectors.EVENT_READ, (child, False))
+        if child.pidfd is not None:
+            self._selector.register(child.pidfd, selectors.EVENT_READ, (child, True))
+        else:
+            self._polled.add(child)
+
+    def _wakeup(self):
+        try:
+            while os.read(self._wakeup_r, READ_SIZE):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for child in pending:
+            try:
+                self._register(child)
+            except Exception as e:
+                self._fail(child, e)
+
+    def _fail(self, child, error):
+        """Stops serving stderr of the child, its exit is still watched"""
+        logger.exception('Cannot serve process %s', child.proc.pid)
+        if not child.proc.stderr.closed:
+            self._unregister(child.proc.stderr.fileno())
+            child.proc.stderr.close()
+        if child.pidfd is not None:
+            self._unregister(child.pidfd)
+            os.close(child.pidfd)
+            child.pidfd = None
+        child.fail(error)
+        if child.proc.poll() is None:
+            self._polled.add(child)
+        else:
+            self._polled.discard(child)
+            child.set_exited()
+
+    def _unregister(self, fd):
+        try:
+            self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+
+    def _read(self, child, fd):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            logger.debug('Cannot read stderr of %s: %s', child.proc.pid, e)
+            data = b''
+        if data:
+            child.feed(data)
+            return
+        self._selector.unregister(fd)
+        child.proc.stderr.close()
+        child.set_eof()
+
+    def _reap(self, child):
+        pidfd, child.pidfd = child.pidfd, None
+        self._selector.unregister(pidfd)
+        os.close(pidfd)
+        child.proc.poll()
+        child.set_exited()
+
+    def _poll_exits(self):
+        for child in list(self._polled):
+            if child.proc.poll() is not None:
+                self._polled.discard(child)
+                child.set_exited()
+
+    def _loop(self):
+        while True:
+            try:
+                for key, _ in self._selector.select(POLL_PERIOD if self._polled else None):
+                    if key.data is None:
+                        self._wakeup()
+                        continue
+                    child, is_pidfd = key.data
+                    if child.failed:
+                        # Descriptors of the child are closed by an error of its other event
+                        continue
+                    try:
+                        if is_pidfd:
+                            self._reap(child)
+                        else:
+                            self._read(child, key.fd)
+                    except Exception as e:
+                        self._fail(child, e)
+                if self._polled:
+                    self._poll_exits()
+            except Exception:
+                logger.exception('Process supervisor failure')
+
+
+def _set_nonblocking(fd):
+    import fcntl
+
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = ProcessSupervisor()
+        return _supervisor
+
+
+if __name__ == '__main__':
+    import resource
+    import subprocess
+    import sys
+    import time
+
+    from six.moves import queue
+
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    cmd = ['sh', '-c', 'echo "##status##x" >&2; echo warning >&2']
+
+    def with_thread(proc):
+        lines = queue.Queue()
+
+        def readline():
+            for line in iter(proc.stderr.readline, b''):
+                lines.put(line)
+            lines.put(b'')
+
+        threading.Thread(target=readline).start()
+        stderr = []
+        while True:
+            line = lines.get()
+            if not line:
+                break
+            stderr.append(line)
+        proc.wait()
+
+    def with_supervisor(proc):
+        child = get_supervisor().watch(proc, b'##')
+        while not child.wait(lambda message: None, 1):
+            pass
+        child.stderr()
+
+    for name, communicate in ('thread per process', with_thread), ('supervisor', with_supervisor):
+        max_threads = [0]
+
+        def worker(count):
+            for _ in range(count):
+                proc = subprocess.Popen(cmd, stderr=subprocess.PIPE)
+                max_threads[0] = max(max_threads[0], threading.active_count())
+                communicate(proc)
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        workers = [threading.Thread(target=worker, args=(qty // jobs,)) for _ in range(jobs)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        wall = time.time() - start
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = end_usage.ru_utime + end_usage.ru_stime - usage.ru_utime - usage.ru_stime
+        print('{}: wall {:.2f}s, cpu {:.2f}s, max threads {}'.format(name, wall, cpu, max_threads[0]))
@@ -6,6 +6,7 @@ import logging
 import os
 import re
 import time
+import types
 
 import typing as tp  # noqa
 
@@ -26,7 +27,10 @@ from yalibrary import status_view
 from yalibrary.active_state import Cancelled
 from yalibrary.fetcher.resource_fetcher import fetch_resource_if_need
 from yalibrary.runner import build_root
+from yalibrary.runner import critical_path
+from yalibrary.runner.graph_index import GraphIndex
 from yalibrary.runner import patterns as ptn
+from yalibrary.runner import process_supervisor
 from yalibrary.runner import runqueue
 from yalibrary.runner import statcalc
 from yalibrary.runner import worker_threads
@@ -38,6 +42,10 @@ from yalibrary.status_view.helpers import format_paths
 
 logger = logging.getLogger(__name__)
 
+# Shared read-only defaults for missing node fields
+_NO_ITEMS = ()
+_NO_MAPPING = types.MappingProxyType({}) if six.PY3 else {}
+
 
 class EarlyStoppingException(Cancelled):
     pass
@@ -221,8 +229,23 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
     ninja = opts.output_style == 'ninja'
 
     class Noda(object):
-        def __init__(self, kwargs, is_result_node=False):
+        __slots__ = (
+            'args',
+            'id',
+            'is_result_node',
+            'uid',
+            'self_uid',
+            'hashable',
+            'content_uid',
+            'output_digests',
+            '_dep_nodes',
+            '_pattern_names',
+        )
+
+        def __init__(self, kwargs, node_id, is_result_node=False):
+            # The node dict is owned by the graph (ctx.graph), the node only refers to it
             self.args = kwargs
+            self.id = node_id
             self.is_result_node = is_result_node
             self.uid = kwargs.get('uid')
             self.self_uid = kwargs.get('self_uid', None)
@@ -230,23 +253,39 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
             self.hashable = True if self.self_uid else False
             self.content_uid = None
             self.output_digests = None
-            self.inputs = kwargs.get('inputs')
-            self.outputs = kwargs.get('outputs')
-            self.resources = kwargs.get('resources', [])
-            self.tared_outputs = kwargs.get('tared_outputs', [])
-            self.dir_outputs = kwargs.get('dir_outputs', [])
-            self.tags = kwargs.get('tags', [])
-            self.deps = kwargs.get('deps')
-            self.kv = kwargs.get('kv')
-            self.requirements = kwargs.get('requirements', {})
-            self.cacheable = kwargs.get('cache', True)
-            self.priority = kwargs.get('priority')
-            self.target_properties = kwargs.get('target_properties', {})
-            self.max_dist = 0
-            self.ignore_broken_dependencies = kwargs.get('ignore_broken_dependencies', False)
-            self.refcount = 0
-            self.stable_dir_outputs = kwargs.get('stable_dir_outputs', False)
-            self.__dep_nodes = None
+            self._dep_nodes = None
+            self._pattern_names = None
+
+        inputs = property(lambda self: self.args.get('inputs'))
+        outputs = property(lambda self: self.args.get('outputs'))
+        resources = property(lambda self: self.args.get('resources', _NO_ITEMS))
+        tared_outputs = property(lambda self: self.args.get('tared_outputs', _NO_ITEMS))
+        dir_outputs = property(lambda self: self.args.get('dir_outputs', _NO_ITEMS))
+        tags = property(lambda self: self.args.get('tags', _NO_ITEMS))
+        deps = property(lambda self: self.args.get('deps'))
+        kv = property(lambda self: self.args.get('kv'))
+        requirements = property(lambda self: self.args.get('requirements', _NO_MAPPING))
+        cacheable = property(lambda self: self.args.get('cache', True))
+        priority = property(lambda self: self.args.get('priority'))
+        target_properties = property(lambda self: self.args.get('target_properties', _NO_MAPPING))
+        ignore_broken_dependencies = property(lambda self: self.args.get('ignore_broken_dependencies', False))
+        stable_dir_outputs = property(lambda self: self.args.get('stable_dir_outputs', False))
+
+        @property
+        def refcount(self):
+            return graph_index.refcounts[self.id]
+
+        @refcount.setter
+        def refcount(self, value):
+            graph_index.refcounts[self.id] = value
+
+        @property
+        def max_dist(self):
+            return graph_index.max_dists[self.id]
+
+        @max_dist.setter
+        def max_dist(self, value):
+            graph_index.max_dists[self.id] = value
 
         @property
         def has_self_uid_support(self):
@@ -298,36 +337,51 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
             return self.deps
 
         def unresolved_patterns(self):
-            return set(patterns.unresolved(self._unresolved_sources())) - {'BUILD_ROOT'}
+            # Names used by the node do not change, only their resolution does
+            if self._pattern_names is None:
+                self._pattern_names = frozenset(patterns.names(self._unresolved_sources()) - {'BUILD_ROOT'})
+            return patterns.missing(self._pattern_names)
 
         def dep_nodes(self):
-            if self.__dep_nodes is None:
-                self.__dep_nodes = [who_provides[d] for d in self.consume()]
-            return self.__dep_nodes
+            if self._dep_nodes is None:
+                self._dep_nodes = [nodes[i] for i in graph_index.deps(self.id)]
+            return self._dep_nodes
 
     results = frozenset(graph['result'])
 
-    nodes = [Noda(x, x.get('uid') in results) for x in graph['graph']]
+    graph_index = GraphIndex(graph['graph'])
+    timer.show_step('build graph index')
+
+    if opts.critical_path_priority:
+        durations = None
+        if opts.critical_path_durations:
+            try:
+                durations = critical_path.load_durations(opts.critical_path_durations)
+            except Exception as e:
+                logger.warning("Failed to load node durations from %s: %s", opts.critical_path_durations, e)
+        critical_path.calc_remaining_path(
+            graph_index, critical_path.node_durations(graph_index, durations), out=graph_index.max_dists
+        )
+        timer.show_step('calc critical path weights')
+
+    nodes = [Noda(x, i, x.get('uid') in results) for i, x in enumerate(graph['graph'])]
 
     timer.show_step('build nodes')
 
-    who_provides = dict()
-    refs = dict()
+    class WhoProvides(object):
+        __slots__ = ()
 
-    for n in nodes:
-        for p in n.provide():
-            refs[p] = 0
-            who_provides[p] = n
-    timer.show_step('build who provides, ref count')
+        def __contains__(self, uid):
+            return uid in graph_index
+
+        def __getitem__(self, uid):
+            return nodes[graph_index.id(uid)]
+
+    who_provides = WhoProvides()
 
     def setup_incremental_cleanup():
         if not ctx.opts.use_distbuild:
-            for n in nodes:
-                for d in n.consume():
-                    refs[d] += 1
-
-            for u, v in list(refs.items()):
-                who_provides[u].refcount = v
+            graph_index.count_refs()
 
         # Do not delete results for last_failed module
         for suite in ctx.tests:
@@ -402,6 +456,8 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
                             cache_stderr=False, debug=core.config.is_test_mode()
                         )
                     self.executor_type = yalibrary.runner.tasks.run.LocalExecutor
+                elif getattr(opts, 'popen_supervisor', False) and process_supervisor.is_supported():
+                    self.executor_type = yalibrary.runner.tasks.run.SupervisedPopenExecutor
                 else:
                     self.executor_type = yalibrary.runner.tasks.run.PopenExecutor
 
@@ -693,6 +749,9 @@ def _run(ctx, app_ctx, callback, exit_stack, output_replacements=None):
             dist_cache_evlog_writer = app_ctx.evlog.get_writer('yt_store') if getattr(app_ctx, 'evlog', None) else None
             dist_cache.stats(execution_log, dist_cache_evlog_writer)
 
+        if dist_cache and hasattr(dist_cache, 'close'):
+            dist_cache.close()
+
     wall_time = time.time() - start_time
 
     if not opts.use_distbuild:
@@ -22,6 +22,7 @@ import exts.shlex2
 
 import yalibrary.runner
 from yalibrary import formatter
+from yalibrary.runner import process_supervisor
 import yalibrary.worker_threads as worker_threads
 from exts.fs import create_dirs, ensure_removed, hardlink_tree, remove_tree_with_perm_update
 from yalibrary.runner.build_root import BuildRootError
@@ -140,6 +141,19 @@ class ExecutorBase(object):
     def run(self, **kwargs):
         raise NotImplementedError()
 
+    def _handle_message(self, line):
+        """Handles special stderr line, returns False for ordinary ones"""
+        if line.startswith(self.status_prefix):
+            status = line[self.status_prefix_len :].rstrip(os.linesep)
+            self._set_status_func(status)
+        elif line.startswith(self.append_prefix):
+            self._append_tag_func(line[self.append_prefix_len :].strip())
+        elif line.startswith(self.prefix):
+            self._display_func(line[self.prefix_len :].replace("|n", "\n"))
+        else:
+            return False
+        return True
+
 
 class PopenExecutor(ExecutorBase):
     def run(self, **kwargs):
@@ -172,6 +186,17 @@ class PopenExecutor(ExecutorBase):
                 proc.wait()
                 logger.debug('Cancelled %s', proc.pid)
 
+        with self._state.with_finalizer(cancel_cb):
+            proc = exts.process.popen(
+                args, stderr=subprocess.PIPE, stdout=stdout, env=env, cwd=cwd, close_fds=close_fds, preexec_fn=set_nice
+            )
+            stderr = self._communicate(proc)
+
+            self._state.check_cancel_state()
+
+            return stderr, proc.returncode
+
+    def _communicate(self, proc):
         def readline(f, queue):
             while True:
                 line = six.ensure_str(f.readline())
@@ -183,43 +208,40 @@ class PopenExecutor(ExecutorBase):
 
             f.close()
 
-        with self._state.with_finalizer(cancel_cb):
-            proc = exts.process.popen(
-                args, stderr=subprocess.PIPE, stdout=stdout, env=env, cwd=cwd, close_fds=close_fds, preexec_fn=set_nice
-            )
-            stderr = ""
+        stderr = []
 
-            queue = Queue.Queue()
-            read_thread = threading.Thread(target=readline, args=(proc.stderr, queue))
-            read_thread.start()
+        queue = Queue.Queue()
+        read_thread = threading.Thread(target=readline, args=(proc.stderr, queue))
+        read_thread.start()
 
-            while True:
-                if queue is not None:
-                    try:
-                        line = queue.get(True, 1)
-
-                        if not line:
-                            queue = None
-
-                        if line.startswith(self.status_prefix):
-                            status = line[self.status_prefix_len :].rstrip(os.linesep)
-                            self._set_status_func(status)
-                        elif line.startswith(self.append_prefix):
-                            self._append_tag_func(line[self.append_prefix_len :].strip())
-                        elif line.startswith(self.prefix):
-                            self._display_func(line[self.prefix_len :].replace("|n", "\n"))
-                        else:
-                            stderr += line
-                    except Queue.Empty:
-                        pass
-                elif proc.poll() is not None:
-                    break
+        while True:
+            if queue is not None:
+                try:
+                    line = queue.get(True, 1)
+
+                    if not line:
+                        queue = None
 
-                self._state.check_cancel_state()
+                    if not self._handle_message(line):
+                        stderr.append(line)
+                except Queue.Empty:
+                    pass
+            elif proc.poll() is not None:
+                break
 
             self._state.check_cancel_state()
 
-            return stderr, proc.returncode
+        return ''.join(stderr)
+
+
+class SupervisedPopenExecutor(PopenExecutor):
+    """Popen executor without own reader thread: stderr and exit of the process are watched by the shared supervisor"""
+
+    def _communicate(self, proc):
+        child = process_supervisor.get_supervisor().watch(proc, six.ensure_binary(self.prefix))
+        while not child.wait(self._handle_message, timeout=1):
+            self._state.check_cancel_state()
+        return child.stderr()
 
 
 class LocalExecutor(ExecutorBase):
@@ -249,14 +271,7 @@ class LocalExecutor(ExecutorBase):
                 executor_address, args, stdout.name, cwd, env, requirements=requirements, **nice_arg
             ) as res:
                 for line in res.iter_stderr():
-                    if line.startswith(self.status_prefix):
-                        status = line[self.status_prefix_len :].rstrip(os.linesep)
-                        self._set_status_func(status)
-                    elif line.startswith(self.append_prefix):
-                        self._append_tag_func(line[self.append_prefix_len :].strip())
-                    elif line.startswith(self.prefix):
-                        self._display_func(line[self.prefix_len :].replace("|n", "\n"))
-                    else:
+                    if not self._handle_message(line):
                         stderr += line
                 return stderr, res.returncode
         except executor.ShutdownException:
@@ -300,7 +315,7 @@ class RunNodeTask(object):
         self._detailed_timings = DetailedTimelineStore()
         self._stderr = None
         self.raw_stderr = None
-        self._tags = self._node.tags[:]
+        self._tags = list(self._node.tags)
         self._seen_tags = set()
         self._status = None
         self._patterns = ctx.patterns.sub()
@@ -6,7 +6,9 @@ import logging
 import os
 import os.path as os_path
 import threading
+import time
 
+from exts import fs
 from exts import hashing
 from six.moves.urllib import parse
 from yalibrary.store.dist_store import DistStore
@@ -18,6 +20,8 @@ import requests.auth
 import zstandard as zstd
 
 DOWNLOAD_CHUNK_SIZE = 1 << 15
+# Smaller blobs are uploaded without an existence check: the extra round trip costs more than the upload
+EXISTENCE_CHECK_MIN_SIZE = 1 << 20
 META_VERSION = '1'
 SHA256_LENGTH = 64
 
@@ -149,6 +153,27 @@ class BazelStoreClient(object):
         if username and password:
             self.session.auth = requests.auth.HTTPBasicAuth(username, password)
         self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self._max_connections = max_connections
+        self._transfer_pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.skipped_blobs = 0
+
+    def _get_transfer_pool(self):
+        # Shared by all uids, one transfer per pooled connection
+        with self._pool_lock:
+            if self._transfer_pool is None:
+                import concurrent.futures as cf
+
+                self._transfer_pool = cf.ThreadPoolExecutor(self._max_connections, "BazelStoreTransfer")
+            return self._transfer_pool
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._transfer_pool = self._transfer_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        self.session.close()
 
     def _retry_func(self, func, f_args=(), f_kwargs=None, conf=retry.DEFAULT_CONF):
         if f_kwargs is None:
@@ -190,9 +215,7 @@ class BazelStoreClient(object):
 
     def get_blob(self, hash, file_path):
         cas_url = self._cas_url(hash)
-        dirname = os_path.dirname(file_path)
-        if not os_path.exists(dirname):
-            os.makedirs(dirname)
+        fs.create_dirs(os_path.dirname(file_path))
         codec = self.get_codec()
         headers = {'Accept-Encoding': codec}
         digest_got = self._retry_func(
@@ -205,8 +228,13 @@ class BazelStoreClient(object):
                 hash,
             )
 
-    def put_blob(self, file_path):
-        hashstr = hashing.file_hash(file_path, hashlib.sha256())
+    def blob_exists(self, hashstr):
+        response = self.session.head(self._cas_url(hashstr))
+        return response.status_code == 200
+
+    def put_blob(self, file_path, hashstr=None):
+        if hashstr is None:
+            hashstr = hashing.file_hash(file_path, hashlib.sha256())
         size = os.stat(file_path).st_size
 
         cas_url = self._cas_url(hashstr)
@@ -216,7 +244,8 @@ class BazelStoreClient(object):
             with open(file_path, 'rb') as afile:
                 response = self.session.put(cas_url, afile)
 
-        if response.status_code != 200:
+        # Upload of a blob the server already has is a success as well
+        if not response.ok:
             raise BazelStoreException(
                 'Failed to upload file %s, status_code %d',
                 file_path,
@@ -239,22 +268,59 @@ class BazelStoreClient(object):
             raise BazelStoreIntegrityError('Broken metadata for UID `%s`', uid)
         return result
 
+    def _put_file(self, file, root_dir):
+        if not file.startswith(root_dir):
+            raise AssertionError('File is outside of rootpath')
+
+        path = os_path.abspath(file)
+        stat = os.stat(file)
+        hashstr = hashing.file_hash(path, hashlib.sha256())
+        # Blobs are content addressed, there is no need to upload large ones the server already has
+        uploaded = stat.st_size < EXISTENCE_CHECK_MIN_SIZE or not self._retry_func(
+            self.blob_exists, f_args=(hashstr,), conf=self.retry_policy.read_conf
+        )
+        if uploaded:
+            self._retry_func(self.put_blob, f_args=(path, hashstr), conf=self.retry_policy.write_conf)
+
+        file_data = {
+            'hash': hashstr,
+            'executable': os.access(file, os.X_OK),
+            'mode': stat.st_mode,
+            'size': stat.st_size,
+        }
+        return os_path.relpath(file, root_dir), file_data, uploaded
+
+    def _report_throughput(self, action, uid, size, start_time, files_count, skipped=0):
+        elapsed = time.time() - start_time
+        logger.debug(
+            '%s %s: %d files (%d skipped), %d bytes in %.3fs (%.1f MB/s)',
+            action,
+            uid,
+            files_count,
+            skipped,
+            size,
+            elapsed,
+            size / elapsed / 2**20 if elapsed > 0 else 0.0,
+        )
+
     def put_data(self, files, root_dir, uid, name):
+        start_time = time.time()
         result = {'files': {}, 'name': name}
-        for file in sorted(files):
-            if not file.startswith(root_dir):
-                raise AssertionError('File is outside of rootpath')
-
-            stat = os.stat(file)
-            result['files'][os_path.relpath(file, root_dir)] = {
-                'hash': self._retry_func(
-                    self.put_blob, f_args=(os_path.abspath(file),), conf=self.retry_policy.write_conf
-                ),
-                'executable': os.access(file, os.X_OK),
-                'mode': stat.st_mode,
-                'size': stat.st_size,
-            }
+        skipped = 0
+        uploaded_size = 0
+        for rel_path, file_data, uploaded in self._get_transfer_pool().map(
+            lambda x: self._put_file(x, root_dir), sorted(files)
+        ):
+            result['files'][rel_path] = file_data
+            if uploaded:
+                uploaded_size += file_data['size']
+            else:
+                skipped += 1
+
         self._retry_func(self.put_meta, f_args=(uid, result), conf=self.retry_policy.write_conf)
+        with self._stats_lock:
+            self.skipped_blobs += skipped
+        self._report_throughput('Uploaded', uid, uploaded_size, start_time, len(result['files']), skipped)
         return result
 
     def download_file(self, file_path, file_data):
@@ -262,14 +328,22 @@ class BazelStoreClient(object):
         os.chmod(file_path, file_data['mode'])
 
     def get_data(self, root_dir, uid, filter_func=None):
+        start_time = time.time()
         meta = self.get_meta(uid)
         if filter_func is None:
             filter_func = always_false
 
+        to_download = []
         for rel_path, file_data in meta['files'].items():
             file_path = os_path.join(root_dir, rel_path)
             if not filter_func(file_path, self._cas_url(file_data['hash'])):
-                self.download_file(file_path, file_data)
+                to_download.append((file_path, file_data))
+
+        for _ in self._get_transfer_pool().map(lambda x: self.download_file(*x), to_download):
+            pass
+
+        size = sum(file_data.get('size', 0) for _, file_data in to_download)
+        self._report_throughput('Downloaded', uid, size, start_time, len(to_download))
         return meta
 
     def exists(self, uid):
@@ -392,6 +466,13 @@ class BazelStore(DistStore):
         self._inc_data_size(data_size, 'get')
         return True
 
+    def close(self):
+        self._client.close()
+
+    def stats(self, execution_log, evlog_writer):
+        super(BazelStore, self).stats(execution_log, evlog_writer)
+        execution_log['$({}-skipped-blobs)'.format(self._name)] = {'count': self._client.skipped_blobs}
+
     @property
     def avg_compression_ratio(self):
         return 1.0
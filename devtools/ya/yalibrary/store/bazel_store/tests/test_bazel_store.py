@@ -0,0 +1,127 @@
+import os
+import threading
+
+import pytest
+import zstandard as zstd
+
+from exts import http_server
+from yalibrary.store.bazel_store import bazel_store
+
+
+class CacheHandler(http_server.SilentHandler):
+    """Serves CAS and AC entries from the current directory like bazel-remote does over HTTP"""
+
+    lock = threading.Lock()
+    calls = []
+
+    def _record(self):
+        with self.lock:
+            self.calls.append((self.command, self.path.split('/')[1]))
+
+    def do_HEAD(self):
+        self._record()
+        http_server.SilentHandler.do_HEAD(self)
+
+    def do_PUT(self):
+        self._record()
+        path = self.translate_path(self.path)
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._record()
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        if self.path.startswith('/cas/'):
+            data = zstd.ZstdCompressor().compress(data)
+            self.send_header('Content-Encoding', 'zstd')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    server_dir = tmp_path / 'server'
+    server_dir.mkdir()
+    monkeypatch.chdir(server_dir)
+    del CacheHandler.calls[:]
+    with http_server.SilentHTTPServer(handler=CacheHandler) as server:
+        client = bazel_store.BazelStoreClient('http://localhost:{}/'.format(server.port), max_connections=4)
+        yield client
+        client.close()
+
+
+def write_files(root, files):
+    paths = []
+    for name, data in files.items():
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+FILES = {
+    'small.txt': b'small',
+    'empty': b'',
+    'sub/large.bin': os.urandom(bazel_store.EXISTENCE_CHECK_MIN_SIZE + 1),
+}
+
+
+def test_put_and_restore(client, tmp_path):
+    root = str(tmp_path / 'src')
+    client.put_data(write_files(root, FILES), root, 'uid-1', 'small.txt')
+
+    into = str(tmp_path / 'dst')
+    meta = client.get_data(into, 'uid-1')
+
+    assert sorted(meta['files']) == sorted(FILES)
+    for name, data in FILES.items():
+        with open(os.path.join(into, name), 'rb') as f:
+            assert f.read() == data
+
+
+def test_existence_is_checked_for_large_blobs_only(client, tmp_path):
+    root = str(tmp_path / 'src')
+    client.put_data(write_files(root, FILES), root, 'uid-1', 'small.txt')
+
+    assert CacheHandler.calls.count(('HEAD', 'cas')) == 1
+    assert CacheHandler.calls.count(('PUT', 'cas')) == len(FILES)
+    assert client.skipped_blobs == 0
+
+
+def test_existing_large_blob_is_not_uploaded(client, tmp_path):
+    root = str(tmp_path / 'src')
+    paths = write_files(root, FILES)
+    client.put_data(paths, root, 'uid-1', 'small.txt')
+    del CacheHandler.calls[:]
+
+    client.put_data(paths, root, 'uid-2', 'small.txt')
+
+    assert CacheHandler.calls.count(('PUT', 'cas')) == len(FILES) - 1
+    assert client.skipped_blobs == 1
+
+
+def test_client_is_usable_after_close(client, tmp_path):
+    root = str(tmp_path / 'src')
+    client.put_data(write_files(root, FILES), root, 'uid-1', 'small.txt')
+    pool = client._transfer_pool
+    client.close()
+
+    assert client._transfer_pool is None
+    assert pool._shutdown
+    assert client.get_data(str(tmp_path / 'dst'), 'uid-1')['name'] == 'small.txt'
@@ -77,6 +77,10 @@ class DistStore(object):
     def prepare(self, *args, **kwargs):
         return
 
+    def close(self):
+        """Releases connections and threads, the store may be used again after that"""
+        return
+
     def _do_has(self, uid):
         raise NotImplementedError()
 
@@ -3,6 +3,8 @@ import errno
 import os
 import six
 
+import cityhash
+
 from exts import fs
 
 
@@ -37,9 +39,7 @@ class OpenHashMap(object):
         self._buckets = len(self._mm) // self._item_size
 
     @staticmethod
-    def _hash(key):
-        import cityhash
-
+    def hash(key):
         return cityhash.hash64(six.ensure_binary(key))
 
     def _offset(self, hash):
@@ -52,15 +52,18 @@ class OpenHashMap(object):
                 yield values[1:]
 
     def __setitem__(self, key, values):
-        h = self._hash(key)
-        offset = self._offset(h)
-        struct.pack_into(self._fmt, self._mm, offset, h, *values)
+        self.set_hashed(self.hash(key), values)
+
+    def set_hashed(self, h, values):
+        struct.pack_into(self._fmt, self._mm, self._offset(h), h, *values)
 
     def _get_from(self, offset):
         return struct.unpack_from(self._fmt, self._mm, offset)
 
     def __getitem__(self, key):
-        h0 = self._hash(key)
+        return self.get_hashed(self.hash(key))
+
+    def get_hashed(self, h0):
         offset = self._offset(h0)
         values = self._get_from(offset)
         h, values = values[0], values[1:]
@@ -69,7 +72,7 @@ class OpenHashMap(object):
         return values
 
     def __delitem__(self, key):
-        h = self._hash(key)
+        h = self.hash(key)
         offset = self._offset(h)
         self._mm[offset : offset + self._item_size] = b'\0' * self._item_size
 
@@ -1,88 +1,142 @@
+from __future__ import print_function
 from itertools import chain
+import itertools
+import logging
 import os
+import struct
 import time
-import threading
+
+import six
 
 import yalibrary.store.usage_map as usage_map
 
-from yalibrary.chunked_queue import queue
+from exts import filelock
+from exts import fs
+from yalibrary.chunked_queue import records
+
+
+logger = logging.getLogger(__name__)
+
+# key hash, stamp, id, key length; followed by the key
+RECORD = struct.Struct('<QIIH')
+# Written once the journal has the history of the text queue
+JOURNAL_VERSION = '1'
 
 
 class Series(object):
     def __init__(self):
-        self._lock = threading.Lock()
-        self._id = 0
+        # next() on itertools.count is atomic, no lock is needed
+        self._counter = itertools.count(1)
 
     def next(self):
-        with self._lock:
-            self._id += 1
-            return self._id
+        return next(self._counter)
 
 
 class LruQueue(object):
     def __init__(self, store_path, updater=None):
         self._usage = usage_map.UsageMap(os.path.join(store_path, 'usage'))
-        self._queue = queue.Queue(os.path.join(store_path, 'queue'))
+        self._queue = records.RecordQueue(os.path.join(store_path, 'journal'), RECORD)
         self._updater = updater
         if self._updater:
             # Postponed updates
-            self._update_queue = queue.Queue(os.path.join(store_path, 'queue'))
+            self._update_queue = records.RecordQueue(os.path.join(store_path, 'journal'), RECORD)
         self._series = Series()
+        self._convert_text_queue(os.path.join(store_path, 'journal'), os.path.join(store_path, 'queue'))
+
+    def _convert_text_queue(self, journal_path, path):
+        """
+        Copies usage history from the text queue used before the binary journal, once.
+        The text queue is left in place: ya versions without the journal still append to it and sieve it.
+        """
+        version_path = os.path.join(journal_path, 'version')
+        if os.path.exists(version_path):
+            return
+
+        with filelock.FileLock(os.path.join(journal_path, 'convert.lock')):
+            if os.path.exists(version_path):
+                return
+            data_dir = os.path.join(path, 'data')
+            if os.path.isdir(data_dir):
+                with filelock.FileLock(os.path.join(path, 'consume.lock')):
+                    chunks = sorted(os.listdir(data_dir))
+                    converted = sum(self._convert_text_chunk(os.path.join(data_dir, name)) for name in chunks)
+                logger.debug('Converted %d records of %s', converted, path)
+            self._queue.flush()
+            fs.write_file(version_path, JOURNAL_VERSION)
+
+    def _convert_text_chunk(self, path):
+        converted = 0
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        key, stamp, id = line.rstrip('\n').split('|')
+                        self._queue.push(self._usage.hash(key), int(stamp), int(id), six.ensure_binary(key))
+                        converted += 1
+                    except ValueError:
+                        pass
+        except (IOError, OSError) as e:
+            # Consumed by a concurrent ya without the journal
+            logger.debug('Cannot convert %s: %s', path, e)
+        return converted
 
     def touch(self, key, update_queue=None):
         stamp = int(time.time())
         id = self._series.next()
-        self._usage.touch(key, stamp=stamp, id=id)
-        self._queue.push(key + '|' + str(stamp) + '|' + str(id))
+        h = self._usage.touch(key, stamp=stamp, id=id)
+        k = six.ensure_binary(key)
+        self._queue.push(h, stamp, id, k)
         if update_queue and self._updater:
-            self._update_queue.push(key + '|' + str(stamp) + '|' + str(id))
+            self._update_queue.push(h, stamp, id, k)
 
-    def __action(self, consumer, value):
-        """Wrapper for consumer to use in sieve, avoids double processing"""
-        try:
-            key, stamp, id = value.split('|')
-            stamp = int(stamp)
-            id = int(id)
-        except ValueError:
-            # TODO: logging
-            return
-        last_usage, last_id = self._usage.last_usage(key)
+    @staticmethod
+    def _is_live(usage, record):
+        h, stamp, id, key = record
+        last_usage, last_id = usage.last_usage_hashed(h)
         if last_usage is None or last_usage == stamp and last_id == id:
+            return six.ensure_str(key), stamp
+        return None, stamp
+
+    def __action(self, usage, consumer, record):
+        """Wrapper for consumer to use in sieve, avoids double processing"""
+        key, stamp = self._is_live(usage, record)
+        if key is not None:
             ret = consumer(stamp, key)
             yield key, stamp, ret
 
-    def __strip_action(self, line_to_retain, value):
+    def __strip_action(self, line_to_retain, record):
         """Wrapper for consumer to use in sieve, avoids double processing"""
-        try:
-            key, stamp, id = value.split('|')
-            stamp = int(stamp)
-            id = int(id)
-        except ValueError:
-            # TODO: logging
-            return
-        last_usage, last_id = self._usage.last_usage(key)
-        if last_usage is None or last_usage == stamp and last_id == id:
-            ret = line_to_retain(stamp, key)
-            if ret:
-                yield value
+        key, stamp = self._is_live(self._usage, record)
+        return key is not None and line_to_retain(stamp, key)
+
+    def compact(self, eraser, max_chunks=None):
+        """
+        Passes live journal records of closed chunks to eraser and drops the chunks.
+        Liveness is looked up by the key hash of a record in a copy of the usage map taken once,
+        so keys are neither hashed nor decoded for stale records.
+        """
+        usage = self._usage.snapshot()
+        return self._queue.sieve(lambda value: self.__action(usage, eraser, value), max_chunks)
 
     def sieve(self, eraser, max_chunks=None):
         if self._updater:
             return chain(
-                self._update_queue.sieve_current_chunk(lambda value: self.__action(self._updater, value)),
-                self._queue.sieve(lambda value: self.__action(eraser, value), max_chunks),
+                self._update_queue.sieve_current_chunk(lambda value: self.__action(self._usage, self._updater, value)),
+                self.compact(eraser, max_chunks),
             )
 
-        return self._queue.sieve(lambda value: self.__action(eraser, value), max_chunks)
+        return self.compact(eraser, max_chunks)
 
     def analyze(self, analyzer):
-        return self._queue.analyze(lambda value: self.__action(analyzer, value))
+        return self._queue.analyze(lambda value: self.__action(self._usage, analyzer, value))
 
     def flush(self):
         if self._updater:
             # Process postponed updates
-            # Eager consumption of lines before truncation
-            for _ in self._update_queue.sieve_current_chunk(lambda value: self.__action(self._updater, value)):
+            # Eager consumption of records before truncation
+            for _ in self._update_queue.sieve_current_chunk(
+                lambda value: self.__action(self._usage, self._updater, value)
+            ):
                 pass
         self._queue.flush()
         self._usage.flush()
@@ -90,3 +144,38 @@ class LruQueue(object):
     # Should be synchronized externally
     def strip(self, uids_filter):
         return self._queue.strip(lambda value: self.__strip_action(uids_filter, value))
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import threading
+
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    keys = int(sys.argv[2]) if len(sys.argv) > 2 else qty // 10
+    threads = 8
+
+    path = tempfile.mkdtemp()
+    lru = LruQueue(path)
+
+    def touch(start):
+        for x in six.moves.xrange(start, qty, threads):
+            lru.touch('H' + str(x % keys))
+
+    t1 = time.time()
+    workers = [threading.Thread(target=touch, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    lru.flush()
+    t2 = time.time()
+
+    # Active chunk of a process is compacted by the next one
+    live = sum(1 for _ in LruQueue(path).compact(lambda stamp, key: key))
+    t3 = time.time()
+
+    print('per one touch (us)', 1000000.0 * (t2 - t1) / qty)
+    print('compact of {} entries, {} live (s)'.format(qty, live), t3 - t2)
+    print('per one compacted entry (us)', 1000000.0 * (t3 - t2) / qty)
+    fs.remove_tree_safe(path)
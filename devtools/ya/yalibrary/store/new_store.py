@@ -5,9 +5,10 @@ if six.PY3:
     import contextlib
 else:
     import contextlib2 as contextlib
-import exts.yjson as json
 import os
 import logging
+import stat
+import threading
 import time
 
 import core.report
@@ -17,6 +18,7 @@ from exts.timer import AccumulateTime
 import yalibrary.store.file_store as file_store
 import yalibrary.store.lru as lru
 import yalibrary.store.size_store as size_store
+import yalibrary.store.uid_index as uid_index
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +41,9 @@ class NewStoreItemInfo(object):
 
 
 class NewStore(object):
+    # Blobs of a single uid are hashed concurrently, hashing of large files releases the GIL
+    BLOB_THREADS = 8
+
     def __init__(self, store_path):
         def touch_finalizer(stamp, key):
             """'touch'es HASHes left over from 'has'. See _get_file_info"""
@@ -58,9 +63,15 @@ class NewStore(object):
 
         self._file_store = file_store.Store(os.path.join(store_path, 'blob'))
         self._uid_store = file_store.Store(os.path.join(store_path, 'uid'))
+        # Per-uid json files in 'uid' are only read to populate a freshly created index
+        self._uid_index = uid_index.UidIndex(
+            os.path.join(store_path, 'uid_index'), migrate_from=os.path.join(store_path, 'uid')
+        )
         self._lru = lru.LruQueue(os.path.join(store_path, 'lru'), touch_finalizer)
         self._size_store = size_store.SizeStore(os.path.join(store_path, 'size'))
         self._store_path = store_path
+        self._blob_pool_executor = None
+        self._blob_pool_lock = threading.Lock()
         logger.debug('Initialized store in %s', self._store_path)
 
         self.timers = {'has': 0, 'put': 0, 'get': 0, 'remove': 0}
@@ -74,37 +85,56 @@ class NewStore(object):
     def _count_failure(self, tag):
         self.failures[tag] += 1
 
+    def _put_blob(self, path, codec):
+        st = os.lstat(path)
+        is_link = stat.S_ISLNK(st.st_mode)
+        mode = os.stat(path).st_mode if is_link else st.st_mode
+        x_new, h, size = self._file_store.put_file(path, codec)
+        # Without codec the blob is a hardlink to the original file, so its stat is already known
+        fsize = self._get_fs_file_size(x_new) if codec or is_link else self._fs_file_size(st)
+        return h, {
+            'hash': h,
+            'size': size,
+            'codec': codec,
+            'mode': mode,
+            'fsize': fsize,
+        }
+
+    def _blob_pool(self):
+        with self._blob_pool_lock:
+            if self._blob_pool_executor is None:
+                import concurrent.futures as cf
+
+                self._blob_pool_executor = cf.ThreadPoolExecutor(self.BLOB_THREADS, "NewStorePut")
+            return self._blob_pool_executor
+
     def put(self, uid, root_dir, files, codec=None):
         with AccumulateTime(lambda x: self._inc_time(x, 'put')):
             file_map = {}
+            files = list(files)
             try:
-                for x in files:
-                    mode = os.stat(x).st_mode
-                    x_new, h, size = self._file_store.put_file(x, codec)
+                if len(files) > 1:
+                    blobs = self._blob_pool().map(lambda x: self._put_blob(x, codec), files)
+                else:
+                    blobs = (self._put_blob(x, codec) for x in files)
+
+                for x, (h, file_info) in zip(files, blobs):
                     self._lru.touch(ItemType.HASH + h)
-                    fsize = self._get_fs_file_size(x_new)
-                    self._size_store[h] = fsize
-                    file_map[os.path.relpath(x, root_dir)] = {
-                        'hash': h,
-                        'size': size,
-                        'codec': codec,
-                        'mode': mode,
-                        'fsize': fsize,
-                    }
-
-                content = json.dumps({'files': file_map, 'uid': uid})
+                    self._size_store[h] = file_info['fsize']
+                    file_map[os.path.relpath(x, root_dir)] = file_info
+
                 self._lru.touch(ItemType.UID + uid)
-                self._uid_store.put(uid, content)
-                logger.debug('Store %s for %s', content, uid)
+                self._uid_index.put(uid, file_map)
+                logger.debug('Store %s for %s', file_map, uid)
             except Exception as e:
                 self._count_failure('put')
-                logger.exception('Error (%s) storing %s(%s, %s)', e, uid, list(files), file_map)
+                logger.exception('Error (%s) storing %s(%s, %s)', e, uid, files, file_map)
 
     def has(self, uid):
         with AccumulateTime(lambda x: self._inc_time(x, 'has')):
             res = False
 
-            if self._uid_store.has(uid):
+            if self._uid_index.has(uid):
                 # Postpone complete update
                 self._lru.touch(ItemType.UID + uid, update_queue=True)
                 res = True
@@ -160,7 +190,10 @@ class NewStore(object):
 
     def _get_fs_file_size(self, path):
         s = os.lstat(path) if os.path.islink(path) else os.stat(path)
+        return self._fs_file_size(s)
 
+    @staticmethod
+    def _fs_file_size(s):
         if hasattr(s, 'st_blocks'):
             return s.st_blocks * 512
 
@@ -168,34 +201,17 @@ class NewStore(object):
 
     def _get_file_info(self, uid):
         try:
-            raw_data = self._uid_store.get(uid)
-            try:
-                meta = json.loads(raw_data)
-            except ValueError:
-                raise file_store.NotInCacheError('Cannot decode metadata for {}'.format(uid))
-
-            for rel_path, file_info in six.iteritems(meta['files']):
-                yield rel_path, file_info
-
-        except file_store.NotInCacheError:
+            files = self._uid_index.get(uid)
+        except uid_index.NotInIndexError:
             logger.debug('File info of uid %s is missing', uid)
-            raise
+            raise file_store.NotInCacheError('Cannot find metadata for {}'.format(uid))
+
+        for rel_path, file_info in six.iteritems(files):
+            yield rel_path, file_info
 
     def _get_file_stats(self, uid, no_touch=False):
         # Does not update lru.
-        try:
-            raw_data = self._uid_store.get(uid)
-            try:
-                meta = json.loads(raw_data)
-            except ValueError:
-                raise file_store.NotInCacheError('Cannot decode metadata for {}'.format(uid))
-
-            for rel_path, file_info in six.iteritems(meta['files']):
-                yield rel_path, file_info
-
-        except file_store.NotInCacheError:
-            logger.debug('File info of uid %s is missing', uid)
-            raise
+        return self._get_file_info(uid)
 
     def sieve(self, stopper, state):
         def remover(stamp, key):
@@ -203,7 +219,7 @@ class NewStore(object):
                 logger.debug('Stop sieve on stamp %d', stamp)
                 raise StopSieve
             if key.startswith(ItemType.UID):
-                self._uid_store.remove(key[1:])
+                self._uid_index.remove(key[1:])
                 logger.debug('Removed %s / %d from uid store', key[1:], stamp)
             elif key.startswith(ItemType.HASH):
                 self._file_store.remove(key[1:])
@@ -300,6 +316,7 @@ class NewStore(object):
         used_uids = set()
         used_file_uids = set()
         file_uids_to_remove = set()
+        uids_to_remove = set()
 
         def uids_filter(stamp, key):
             # HASHes are stripped from LRU using regular compact process
@@ -326,6 +343,7 @@ class NewStore(object):
                     return True
                 else:
                     file_uids_to_remove.update(file_uids)
+                    uids_to_remove.add(key[1:])
                     return False
 
             except file_store.NotInCacheError:
@@ -343,17 +361,26 @@ class NewStore(object):
         self._file_store.gc(used_file_uids)
 
         logger.debug("Cleaning uid store")
-        self._uid_store.gc(used_uids)
+        self._uid_index.retain(used_uids)
+        # Legacy json metadata is still read by ya versions without the index, only stripped uids are removed
+        for uid in uids_to_remove:
+            self._uid_store.remove(uid)
 
     def flush(self):
         self._size_store.flush()
+        self._uid_index.flush()
         self._lru.flush()
+        # Store is flushed when the build is over, the pool is created again by the next put
+        with self._blob_pool_lock:
+            pool, self._blob_pool_executor = self._blob_pool_executor, None
+        if pool is not None:
+            pool.shutdown(wait=True)
 
     def clear_uid(self, uid):
         with AccumulateTime(lambda x: self._inc_time(x, 'remove')):
             # lru is shared by both UIDs and HASHes.
             # HASHes should be collected separately in compact using _lru.
-            self._uid_store.remove(uid)
+            self._uid_index.remove(uid)
 
     def stats(self, execution_log):
         for k, v in six.iteritems(self.timers):
@@ -367,3 +394,51 @@ class NewStore(object):
             }
             core.report.telemetry.report('new_store_stats-{}'.format(k), stat_dict)
             execution_log["$(new-store-{})".format(k)] = stat_dict
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    small_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    large_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    large_size = int(sys.argv[3]) if len(sys.argv) > 3 else 2 << 30
+
+    work_dir = tempfile.mkdtemp()
+    src = os.path.join(work_dir, 'src')
+    block = os.urandom(1 << 20)
+    small_files = []
+    for i in range(small_count):
+        path = os.path.join(src, 'small', str(i % 100), str(i))
+        fs.create_dirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(block[i % 1024 :][:4096] + str(i).encode())
+        small_files.append(path)
+    large_files = []
+    for i in range(large_count):
+        path = os.path.join(src, 'large', str(i))
+        fs.create_dirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(str(i).encode())
+            for _ in range(large_size >> 20):
+                f.write(block)
+        large_files.append(path)
+
+    for threads in 1, NewStore.BLOB_THREADS:
+        store = NewStore(os.path.join(work_dir, 'store{}'.format(threads)))
+        store.BLOB_THREADS = threads
+        for name, files, per_uid in ('small', small_files, 100), ('large', large_files, 1):
+            size = sum(os.stat(x).st_size for x in files)
+            start = time.time()
+            for i in range(0, len(files), per_uid):
+                store.put('{}-{}'.format(name, i), src, files[i : i + per_uid])
+            elapsed = time.time() - start
+            print(
+                '{} threads, {} {} files: {:.3f}s, {:.1f} MiB/s'.format(
+                    threads, len(files), name, elapsed, size / float(1 << 20) / max(elapsed, 1e-6)
+                )
+            )
+        store.flush()
+        assert not sum(store.failures.values())
+
+    fs.remove_tree_safe(work_dir)
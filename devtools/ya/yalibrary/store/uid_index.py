@@ -0,0 +1,454 @@
+import collections
+import errno
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import cityhash
+import six
+
+import exts.yjson as json
+from exts import filelock, fs
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'YAUIDX01'
+TABLE_MAGIC = b'YAUIDT02'
+
+# record: total length, uid length, number of files
+_RECORD = struct.Struct('<IHI')
+# file: rel path length, hash length, codec length, size, fs size (NO_FSIZE if unknown), mode
+_FILE = struct.Struct('<HHHQQI')
+NO_FSIZE = 2**64 - 1
+
+# table header: magic, obsolete flag, used slots (live and removed), bytes of removed records,
+# number of removed or replaced records
+_HEADER = struct.Struct('<8sQQQQ')
+_COUNTER = struct.Struct('<Q')
+_OBSOLETE_OFFSET = len(TABLE_MAGIC)
+_CHANGES_OFFSET = _HEADER.size - _COUNTER.size
+# slot: uid hash, record offset
+_SLOT = struct.Struct('<QQ')
+# Records never start before the log magic, so these offsets mark free slots
+EMPTY = 0
+REMOVED = 1
+
+
+class NotInIndexError(KeyError):
+    pass
+
+
+class BadIndexError(Exception):
+    pass
+
+
+def encode_record(uid, files):
+    uid = six.ensure_binary(uid)
+    parts = [None, uid]
+    for rel_path, info in six.iteritems(files):
+        rel_path = six.ensure_binary(rel_path)
+        h = six.ensure_binary(info['hash'])
+        codec = six.ensure_binary(info.get('codec') or '')
+        fsize = info.get('fsize')
+        parts.append(
+            _FILE.pack(
+                len(rel_path),
+                len(h),
+                len(codec),
+                info['size'],
+                NO_FSIZE if fsize is None else fsize,
+                info['mode'],
+            )
+        )
+        parts.append(rel_path)
+        parts.append(h)
+        parts.append(codec)
+    size = _RECORD.size + sum(len(p) for p in parts[1:])
+    parts[0] = _RECORD.pack(size, len(uid), len(files))
+    return b''.join(parts)
+
+
+def decode_files(buf, offset):
+    size, uid_len, qty = _RECORD.unpack_from(buf, offset)
+    pos = offset + _RECORD.size + uid_len
+    files = {}
+    for _ in six.moves.xrange(qty):
+        rel_len, h_len, codec_len, fsize_, fsize, mode = _FILE.unpack_from(buf, pos)
+        pos += _FILE.size
+        rel_path = six.ensure_str(bytes(buf[pos : pos + rel_len]))
+        pos += rel_len
+        h = six.ensure_str(bytes(buf[pos : pos + h_len]))
+        pos += h_len
+        codec = six.ensure_str(bytes(buf[pos : pos + codec_len])) or None
+        pos += codec_len
+        info = {'hash': h, 'size': fsize_, 'codec': codec, 'mode': mode}
+        if fsize != NO_FSIZE:
+            info['fsize'] = fsize
+        files[rel_path] = info
+    return files
+
+
+def record_uid(buf, offset):
+    """Returns (uid, record size) of the record at offset or (None, 0) if there is no record"""
+    if offset < len(MAGIC) or offset + _RECORD.size > len(buf):
+        return None, 0
+    size, uid_len, _ = _RECORD.unpack_from(buf, offset)
+    start = offset + _RECORD.size
+    if offset + size > len(buf) or start + uid_len > offset + size:
+        return None, 0
+    return bytes(buf[start : start + uid_len]), size
+
+
+def _hash(uid):
+    return cityhash.hash64(uid)
+
+
+class _Table(object):
+    """Memory-mapped hash table uid hash -> record offset with linear probing"""
+
+    def __init__(self, path):
+        with open(path, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+        if len(self.mm) < _HEADER.size or self.mm[: len(TABLE_MAGIC)] != TABLE_MAGIC:
+            self.mm.close()
+            raise BadIndexError('Bad uid index table {}'.format(path))
+        self.slots = (len(self.mm) - _HEADER.size) // _SLOT.size
+
+    @staticmethod
+    def create(path, slots):
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(TABLE_MAGIC, 0, 0, 0, 0))
+            # Sparse file, untouched slots are zeros, i.e. EMPTY
+            f.truncate(_HEADER.size + slots * _SLOT.size)
+
+    @property
+    def obsolete(self):
+        return _COUNTER.unpack_from(self.mm, _OBSOLETE_OFFSET)[0] != 0
+
+    def mark_obsolete(self):
+        _COUNTER.pack_into(self.mm, _OBSOLETE_OFFSET, 1)
+
+    @property
+    def changes(self):
+        """Number of records removed or replaced by any process, cached records are valid while it stays the same"""
+        return _COUNTER.unpack_from(self.mm, _CHANGES_OFFSET)[0]
+
+    def get_counters(self):
+        """Returns (used slots, removed bytes)"""
+        return _HEADER.unpack_from(self.mm, 0)[2:4]
+
+    def set_counters(self, used, removed_bytes, changed=False):
+        _HEADER.pack_into(
+            self.mm, 0, TABLE_MAGIC, 0, used, removed_bytes, self.changes + 1 if changed else self.changes
+        )
+
+    def get_slot(self, i):
+        return _SLOT.unpack_from(self.mm, _HEADER.size + i * _SLOT.size)
+
+    def set_slot(self, i, h, offset):
+        _SLOT.pack_into(self.mm, _HEADER.size + i * _SLOT.size, h, offset)
+
+    def find(self, uid, h, data):
+        """Returns (slot, first free slot) for uid, slot is None if uid is missing"""
+        free = None
+        i = h % self.slots
+        for _ in six.moves.xrange(self.slots):
+            slot_hash, offset = self.get_slot(i)
+            if offset == EMPTY:
+                return None, i if free is None else free
+            if offset == REMOVED:
+                if free is None:
+                    free = i
+            elif slot_hash == h and record_uid(data, offset)[0] == uid:
+                return i, free
+            i = (i + 1) % self.slots
+        return None, free
+
+    def live_offsets(self):
+        for i in six.moves.xrange(self.slots):
+            offset = self.get_slot(i)[1]
+            if offset not in (EMPTY, REMOVED):
+                yield offset
+
+    def close(self):
+        self.mm.close()
+
+
+class UidIndex(object):
+    """
+    Append-only binary log of uid metadata plus a memory-mapped hash table uid -> record offset.
+
+    The table is probed linearly and every candidate is verified against the uid stored in the record,
+    so collisions cost extra probes, not entries. Lookups read only the mappings and take no file locks.
+    Writers are serialized by a file lock. Log and table are replaced as a whole when the table
+    is too loaded or removed records take most of the log, the old table is marked obsolete
+    and every process reopens the index before using it again. Decoded records are cached in process
+    while no record is removed or replaced, which is counted in the table header.
+    """
+
+    INITIAL_SLOTS = 1 << 20
+    MAX_LOAD = 0.5
+    # Log is compacted when removed records take a half of it and at least this size
+    MIN_COMPACT_SIZE = 16 * 1024 * 1024
+    DECODED_CACHE_SIZE = 4096
+
+    def __init__(self, store_path, migrate_from=None):
+        fs.create_dirs(store_path)
+        self._data_path = os.path.join(store_path, 'data')
+        self._table_path = os.path.join(store_path, 'table')
+        self._flock = filelock.FileLock(os.path.join(store_path, 'lock'))
+        # Guards the decoded cache and swapping of mappings
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._decoded = collections.OrderedDict()
+        # Table and its number of changes the decoded cache is valid for
+        self._decoded_version = None
+        self._table = None
+        self._fd = None
+        self._mm = None
+        self._mm_size = 0
+
+        with self._write_lock, self._flock:
+            if self._open() and migrate_from:
+                self._migrate(migrate_from)
+
+    def _open(self):
+        """Opens log and table, recreates them if they are missing or broken. Returns True if created"""
+        created = not os.path.exists(self._data_path)
+        if not created:
+            try:
+                self._open_files()
+                return False
+            except (BadIndexError, IOError, OSError) as e:
+                logger.debug('Recreate uid index: %s', e)
+        self._write_files([], self.INITIAL_SLOTS)
+        self._open_files()
+        return created
+
+    def _open_files(self):
+        fd = os.open(self._data_path, os.O_RDWR | os.O_APPEND)
+        try:
+            if os.read(fd, len(MAGIC)) != MAGIC:
+                raise BadIndexError('Bad uid index log {}'.format(self._data_path))
+            table = _Table(self._table_path)
+        except Exception:
+            os.close(fd)
+            raise
+        # Previous mappings may still be read by other threads, they are unmapped when released
+        with self._lock:
+            old_fd, self._fd, self._table = self._fd, fd, table
+            self._mm_size = 0
+            self._remap()
+            self._decoded.clear()
+        if old_fd is not None:
+            os.close(old_fd)
+
+    def _reopen(self):
+        """Must be called with the file lock held"""
+        if self._table.obsolete:
+            self._open()
+
+    def close(self):
+        with self._write_lock:
+            self.flush()
+            self._table.close()
+            os.close(self._fd)
+
+    def flush(self):
+        self._table.mm.flush()
+
+    def _remap(self):
+        size = os.fstat(self._fd).st_size
+        if size != self._mm_size:
+            # Previous mapping may still be read by other threads, it is unmapped when released
+            self._mm = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+            self._mm_size = size
+        return self._mm
+
+    def _find(self, uid):
+        """Returns (mapping, offset) of the live record for uid or (None, None)"""
+        table = self._table
+        if table.obsolete:
+            with self._write_lock, self._flock:
+                self._reopen()
+            table = self._table
+
+        uid = six.ensure_binary(uid)
+        h = _hash(uid)
+        mm = self._mm
+        i = h % table.slots
+        for _ in six.moves.xrange(table.slots):
+            slot_hash, offset = table.get_slot(i)
+            if offset == EMPTY:
+                break
+            if offset != REMOVED and slot_hash == h:
+                if offset + _RECORD.size > len(mm):
+                    # Written by another process after our mapping was made
+                    with self._lock:
+                        mm = self._remap()
+                if record_uid(mm, offset)[0] == uid:
+                    return mm, offset
+            i = (i + 1) % table.slots
+        return None, None
+
+    def has(self, uid):
+        return self._cached(uid)[0] is not None or self._find(uid)[1] is not None
+
+    def _cached(self, uid):
+        """Returns (decoded files of uid or None, cache version)"""
+        with self._lock:
+            table = self._table
+            version = (table, table.changes)
+            if version != self._decoded_version or table.obsolete:
+                # Records may have been removed or replaced by another process
+                self._decoded.clear()
+                self._decoded_version = version
+                return None, version
+            files = self._decoded.get(uid)
+            if files is not None:
+                self._decoded.move_to_end(uid)
+            return files, version
+
+    def get(self, uid):
+        files, version = self._cached(uid)
+        if files is not None:
+            return files
+
+        mm, offset = self._find(uid)
+        if offset is None:
+            raise NotInIndexError(uid)
+        files = decode_files(mm, offset)
+
+        with self._lock:
+            if version == self._decoded_version:
+                self._decoded[uid] = files
+                if len(self._decoded) > self.DECODED_CACHE_SIZE:
+                    self._decoded.popitem(last=False)
+        return files
+
+    def put(self, uid, files):
+        record = encode_record(uid, files)
+        uid = six.ensure_binary(uid)
+        h = _hash(uid)
+        with self._write_lock, self._flock:
+            self._reopen()
+            offset = os.lseek(self._fd, 0, os.SEEK_END)
+            os.write(self._fd, record)
+            with self._lock:
+                mm = self._remap()
+                self._decoded.pop(six.ensure_str(uid), None)
+
+            table = self._table
+            used, removed_bytes = table.get_counters()
+            slot, free = table.find(uid, h, mm)
+            replaced = slot is not None
+            if replaced:
+                removed_bytes += record_uid(mm, table.get_slot(slot)[1])[1]
+            else:
+                slot = free
+                if table.get_slot(slot)[1] == EMPTY:
+                    used += 1
+            table.set_slot(slot, h, offset)
+            table.set_counters(used, removed_bytes, changed=replaced)
+
+            if used > table.slots * self.MAX_LOAD:
+                self._rebuild()
+
+    def remove(self, uid):
+        uid = six.ensure_binary(uid)
+        h = _hash(uid)
+        with self._write_lock, self._flock:
+            self._reopen()
+            with self._lock:
+                mm = self._remap()
+                self._decoded.pop(six.ensure_str(uid), None)
+
+            table = self._table
+            slot, _ = table.find(uid, h, mm)
+            if slot is None:
+                return
+            used, removed_bytes = table.get_counters()
+            removed_bytes += record_uid(mm, table.get_slot(slot)[1])[1]
+            table.set_slot(slot, h, REMOVED)
+            table.set_counters(used, removed_bytes, changed=True)
+
+            if removed_bytes >= self.MIN_COMPACT_SIZE and removed_bytes * 2 > len(mm):
+                self._rebuild()
+
+    def retain(self, uids):
+        """Rewrites the log keeping only given uids"""
+        uids = set(six.ensure_binary(uid) for uid in uids)
+        with self._write_lock, self._flock:
+            self._reopen()
+            self._rebuild(uids)
+
+    def _rebuild(self, keep=None):
+        """Writes a new log of live records and a new table for them. Must be called with the file lock held"""
+        with self._lock:
+            mm = self._remap()
+        records = []
+        for offset in sorted(self._table.live_offsets()):
+            uid, size = record_uid(mm, offset)
+            if uid is not None and (keep is None or uid in keep):
+                records.append((uid, mm[offset : offset + size]))
+
+        slots = max(self.INITIAL_SLOTS, int(len(records) / self.MAX_LOAD) * 2)
+        logger.debug('Rebuild uid index: %d records of %d bytes, %d slots', len(records), len(mm), slots)
+        self._write_files(records, slots)
+        # Processes that have the old table open reopen the index on the next access
+        self._table.mark_obsolete()
+        self._open_files()
+
+    def _write_files(self, records, slots):
+        data_tmp = '{}.{}.tmp'.format(self._data_path, os.getpid())
+        table_tmp = '{}.{}.tmp'.format(self._table_path, os.getpid())
+        _Table.create(table_tmp, slots)
+        table = _Table(table_tmp)
+        try:
+            with open(data_tmp, 'wb') as f:
+                f.write(MAGIC)
+                offset = len(MAGIC)
+                for uid, record in records:
+                    h = _hash(uid)
+                    i = h % slots
+                    while table.get_slot(i)[1] != EMPTY:
+                        i = (i + 1) % slots
+                    table.set_slot(i, h, offset)
+                    f.write(record)
+                    offset += len(record)
+            table.set_counters(len(records), 0)
+            table.mm.flush()
+        finally:
+            table.close()
+        # Readers of a new table need its log, so the log is replaced first
+        os.rename(data_tmp, self._data_path)
+        os.rename(table_tmp, self._table_path)
+
+    def _migrate(self, uid_store_path):
+        """
+        Imports per-uid json metadata of file_store.Store into the just created index with a single rewrite.
+        Must be called with the file lock held. The json files are left for ya versions without the index.
+        """
+        data_dir = os.path.join(uid_store_path, 'data')
+        records = {}
+        for root, _, files in os.walk(data_dir):
+            for name in files:
+                try:
+                    with open(os.path.join(root, name)) as f:
+                        meta = json.load(f)
+                    records[six.ensure_binary(meta['uid'])] = encode_record(meta['uid'], meta['files'])
+                except (IOError, OSError) as e:
+                    if e.errno != errno.ENOENT:
+                        logger.debug('Cannot migrate %s: %s', name, e)
+                except Exception as e:
+                    logger.debug('Cannot migrate %s: %s', name, e)
+        if not records:
+            return
+        slots = max(self.INITIAL_SLOTS, int(len(records) / self.MAX_LOAD) * 2)
+        self._write_files(sorted(six.iteritems(records)), slots)
+        self._table.mark_obsolete()
+        self._open_files()
+        logger.debug('Migrated %d uids from %s', len(records), uid_store_path)
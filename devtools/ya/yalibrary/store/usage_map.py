@@ -5,6 +5,19 @@ import six
 from yalibrary.store import hash_map
 
 
+class UsageSnapshot(object):
+    """In-memory copy of the usage map for bulk lookups, does not see later touches"""
+
+    def __init__(self, data):
+        self._hmap = hash_map.OpenHashMap(data, 'II')
+
+    def last_usage_hashed(self, h):
+        try:
+            return self._hmap.get_hashed(h)
+        except KeyError:
+            return None, None
+
+
 class UsageMap(object):
     FILE_SIZE = 12 * 1003001
 
@@ -18,20 +31,30 @@ class UsageMap(object):
         self._mm.close()
         self._f.close()
 
+    @staticmethod
+    def hash(key):
+        return hash_map.OpenHashMap.hash(key)
+
     def touch(self, key, stamp=None, id=0):
+        """Returns hash of the key, see last_usage_hashed()"""
         if stamp is None:
             stamp = time.time()
-        self._hmap[key] = (
-            stamp,
-            id,
-        )
+        h = self.hash(key)
+        self._hmap.set_hashed(h, (stamp, id))
+        return h
 
     def last_usage(self, key):
+        return self.last_usage_hashed(self.hash(key))
+
+    def last_usage_hashed(self, h):
         try:
-            return self._hmap[key]
+            return self._hmap.get_hashed(h)
         except KeyError:
             return None, None
 
+    def snapshot(self):
+        return UsageSnapshot(self._mm[:])
+
     def flush(self):
         self._hmap.flush()
 
@@ -1,5 +1,5 @@
-import collections
 import heapq
+import itertools
 import logging
 import threading
 import time
@@ -42,7 +42,8 @@ class Action(object):
 class ResInfo(object):
     def __init__(self, *args, **kwargs):
         self.__d = dict(*args, **kwargs)
-        self._hash = hash(tuple(sorted(self.__d.items())))
+        self._key = tuple(sorted((k, v) for k, v in self.__d.items() if v))
+        self._hash = hash(self._key)
 
     @staticmethod
     def _iter(d1, d2):
@@ -59,7 +60,7 @@ class ResInfo(object):
         return all(v1 <= v2 for _, v1, v2 in self._iter(self.__d, other.__d))
 
     def __eq__(self, other):
-        return all(v1 == v2 for _, v1, v2 in self._iter(self.__d, other.__d))
+        return self._key == other._key
 
     def __hash__(self):
         return self._hash
@@ -67,54 +68,109 @@ class ResInfo(object):
     def __repr__(self):
         return str(self.__d)
 
+    def keys(self):
+        return self.__d.keys()
+
+    def compile(self, keys):
+        """
+        Returns amounts as a tuple ordered by keys or None if a resource missing from keys is requested.
+        """
+        if any(v > 0 and k not in keys for k, v in self.__d.items()):
+            return None
+        return tuple(self.__d.get(k, 0) for k in keys)
+
+
+def _fits(need, usage, cap):
+    for n, u, c in zip(need, usage, cap):
+        if n + u > c:
+            return False
+    return True
+
+
+class _Bucket(object):
+    __slots__ = ['res', 'need', 'heap', 'indexed']
+
+    def __init__(self, res, need):
+        self.res = res
+        self.need = need
+        self.heap = []
+        # Sequence number of the valid entry of the bucket in the priority index
+        self.indexed = None
+
+    def prio_key(self):
+        return self.heap[0][0]
+
+
+class _Worker(object):
+    __slots__ = ['cond', 'task']
+
+    def __init__(self, lock):
+        self.cond = threading.Condition(lock)
+        # (res, action) handed over while the worker was idle
+        self.task = None
+
 
 class WorkerThreads(object):
+    """
+    Runs actions in worker threads within resource capacity, higher priority first.
+
+    Actions of the same resource class (equal ResInfo) share a bucket. Non-empty buckets are kept
+    in a priority index by their head priority, so the best fitting action is found without scanning
+    all classes. Idle workers wait on their own conditions: when an action of some class can be started,
+    it is handed to a single idle worker, which is the only one woken.
+    """
+
     def __init__(self, state, threads, zero, cap, evlog):
         self._all_threads = []
         self._state = state
         self._out_q = Queue.Queue()
         self._active = 0
 
-        self._active_set = collections.defaultdict(list)
-        self._active_res_usage = [zero]
-        self._condition = threading.Condition(threading.Lock())
+        # Resource amounts are compiled into tuples ordered by self._res_keys
+        self._res_keys = tuple(sorted(cap.keys()))
+        self._cap = cap.compile(self._res_keys)
+        self._usage = list(zero.compile(self._res_keys) or (0,) * len(self._res_keys))
+        self._buckets = {}
+        # Heap of (head priority key, sequence number, bucket), entries of changed buckets are skipped
+        self._index = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._idle = []
         self._evlog_writer = evlog.get_writer(__name__) if evlog else lambda *a, **kw: None
 
         def exec_target():
+            worker = _Worker(self._lock)
+
             def take_or_wait():
                 while self._state.check_cancel_state():
-                    with self._condition:
-                        max_prio = None
-                        best_key = None
-                        for k, v in self._active_set.items():
-                            if v and k + self._active_res_usage[0] <= cap:
-                                if max_prio is None or max_prio < -v[0][0]:
-                                    max_prio = -v[0][0]
-                                    best_key = k
-
-                        if best_key is not None:
-                            self._active_res_usage[0] += best_key
-                            logger.debug('Active res usage %s', self._active_res_usage)
-                            _, elem = heapq.heappop(self._active_set[best_key])
-                            self._condition.notify()
-                            logger.debug('Found job %s %s with prio %s', best_key, elem, max_prio)
-                            return best_key, elem
-
-                        logger.debug(
-                            'Cannot find any job from %s', dict((k, len(v)) for k, v in self._active_set.items())
-                        )
+                    with self._lock:
+                        task = worker.task or self._take()
+                        worker.task = None
+
+                        if task is not None:
+                            # Capacity may be left for idle workers, e.g. after a release
+                            if self._idle:
+                                self._dispatch()
+                            logger.debug('Found job %s %s', task[0], task[1])
+                            return task
+
+                        logger.debug('Cannot find any job fitting usage %s', self._usage)
 
                         self._state.check_cancel_state()
-                        self._condition.wait()
+                        self._idle.append(worker)
+                        worker.cond.wait()
+                        if worker.task is None and worker in self._idle:
+                            # Woken by join
+                            self._idle.remove(worker)
 
             def execute():
                 while self._state.check_cancel_state():
                     res, action = take_or_wait()
                     self.__execute_action(action, res)
-                    with self._condition:
-                        self._active_res_usage[0] -= res
-                        logger.debug('Active res usage %s', self._active_res_usage)
-                        self._condition.notify()
+                    with self._lock:
+                        for i, n in enumerate(self._buckets[res].need):
+                            self._usage[i] -= n
+                        logger.debug('Active res usage %s', self._usage)
 
             self._out_q.put(asyncthread.wrap(execute))
 
@@ -123,6 +179,56 @@ class WorkerThreads(object):
             exec_thr.start()
             self._all_threads.append(exec_thr)
 
+    def _index_bucket(self, bucket):
+        seq = next(self._seq)
+        bucket.indexed = seq
+        heapq.heappush(self._index, (bucket.prio_key(), seq, bucket))
+
+    def _take(self):
+        """Pops the highest priority action fitting the free capacity, returns (res, action) or None"""
+        index = self._index
+        skipped = []
+        found = None
+        while index:
+            entry = heapq.heappop(index)
+            bucket = entry[2]
+            if entry[1] != bucket.indexed:
+                continue
+            if bucket.need is not None and _fits(bucket.need, self._usage, self._cap):
+                found = bucket
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(index, entry)
+        if found is None:
+            return None
+
+        prio, action = heapq.heappop(found.heap)
+        for i, n in enumerate(found.need):
+            self._usage[i] += n
+        logger.debug('Active res usage %s, prio %s', self._usage, -prio)
+        if found.heap:
+            self._index_bucket(found)
+        else:
+            found.indexed = None
+        return found.res, action
+
+    def _dispatch(self):
+        """Hands startable actions to idle workers, each of them is woken individually"""
+        while self._idle:
+            task = self._take()
+            if task is None:
+                return
+            worker = self._idle.pop()
+            worker.task = task
+            worker.cond.notify()
+
+    def _bucket(self, res):
+        bucket = self._buckets.get(res)
+        if bucket is None:
+            bucket = self._buckets[res] = _Bucket(res, res.compile(self._res_keys))
+        return bucket
+
     def __execute_action(self, action, res, inline=False):
         logger.debug('Run %s with res %s', action, res)
         name = str(action) + ("-inline" if inline else "")
@@ -156,33 +262,37 @@ class WorkerThreads(object):
         logger.debug('Add %s with res %s and prio %s', action, res, prio)
         self._state.check_cancel_state()
         if inplace_execution:
-            with self._condition:
+            with self._lock:
                 self._active += 1
             self.__execute_action(action, res, inline=True)
         else:
-            with self._condition:
+            with self._lock:
                 self._active += 1
+                bucket = self._bucket(res)
                 heapq.heappush(
-                    self._active_set[res],
+                    bucket.heap,
                     (
                         -prio,
                         action,
                     ),
                 )
-                if len(self._active_set[res]) == 1:
-                    self._condition.notify()
+                if bucket.indexed is None or bucket.prio_key() == -prio:
+                    self._index_bucket(bucket)
+                # Only a new action of this class may have become startable
+                if self._idle and bucket.need is not None and _fits(bucket.need, self._usage, self._cap):
+                    self._dispatch()
 
     def __iter__(self):
         return self
 
     def next(self, timeout=0.1, ready_to_stop=None):
-        with self._condition:
+        with self._lock:
             if self._active == 0:
                 if ready_to_stop is None or ready_to_stop():
                     raise StopIteration
         try:
             value = self._out_q.get(timeout=timeout)
-            with self._condition:
+            with self._lock:
                 self._active -= 1
             return asyncthread.unwrap(value)
         except Queue.Empty:
@@ -193,8 +303,9 @@ class WorkerThreads(object):
 
     def join(self):
         assert self._state.is_stopped()
-        with self._condition:
-            self._condition.notify_all()
+        with self._lock:
+            for worker in self._idle:
+                worker.cond.notify()
         for t in self._all_threads:
             logger.debug('will join %s', t)
             t.join()
@@ -221,3 +332,30 @@ class WorkerThreads(object):
                         pass
             except Queue.Empty:
                 break
+
+
+if __name__ == '__main__':
+    import sys
+
+    from yalibrary.active_state import ActiveState
+
+    # Dispatch throughput of no-op actions of several resource classes
+    qty = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    classes = [ResInfo(cpu=1), ResInfo(cpu=1, io=1), ResInfo(io=1), ResInfo(cpu=1, test=1), ResInfo(download=1)]
+
+    for threads in 1, 16, 128:
+        state = ActiveState('bench')
+        cap = ResInfo(cpu=threads, io=max(threads // 4, 1), test=threads, download=threads)
+        workers = WorkerThreads(state, threads, ResInfo(), cap, None)
+        start = time.time()
+        for i in range(qty):
+            workers.add(Action(lambda: None, classes[i % len(classes)], i % 100))
+        try:
+            while True:
+                workers.next()
+        except StopIteration:
+            pass
+        elapsed = time.time() - start
+        state.stopping()
+        workers.join()
+        print('{:>3} workers: {:.2f}s, {:.0f} actions/s'.format(threads, elapsed, qty / elapsed))
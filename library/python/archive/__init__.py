@@ -1,3 +1,4 @@
+import collections
 import errno
 import logging
 import os
@@ -7,6 +8,8 @@ import stat
 import string
 import sys
 
+from multiprocessing.pool import ThreadPool
+
 import six
 
 import libarchive
@@ -21,6 +24,13 @@ ZSTD = "zstd"
 
 ENCODING = "utf-8"
 
+# Files up to this size are read into memory and written by the thread pool in batches
+SMALL_FILE_SIZE = 1024 * 1024
+BATCH_FILES = 256
+BATCH_SIZE = 4 * 1024 * 1024
+# Limit of file contents read ahead of writing
+MAX_PENDING_SIZE = 64 * 1024 * 1024
+
 
 class ConfigureError(Exception):
     pass
@@ -61,14 +71,27 @@ def encode(value, encoding):
 
 
 def extract_tar(
-    tar_file_path, output_dir, strip_components=None, fail_on_duplicates=True, apply_mtime=True, entry_filter=None
+    tar_file_path,
+    output_dir,
+    strip_components=None,
+    fail_on_duplicates=True,
+    apply_mtime=True,
+    entry_filter=None,
+    threads=None,
 ):
     """
     entry_filter: function that takes a libarchive.Entry and returns True if the entry should be extracted
+    threads: number of threads writing small files, files are written by the calling thread if it is None or 1
     """
     output_dir = encode(output_dir, ENCODING)
     _make_dirs(output_dir)
-    with libarchive.Archive(tar_file_path, mode="rb") as tarfile:
+    # Directories known to exist, so that entries of the same directory do not call makedirs
+    dirs = {output_dir}
+    check_duplicates = bool(strip_components and fail_on_duplicates)
+
+    with libarchive.Archive(tar_file_path, mode="rb") as tarfile, _FileWriter(
+        threads or 1, apply_mtime, strip_components if check_duplicates else None
+    ) as writer:
         for e in tarfile:
             if entry_filter and not entry_filter(e):
                 continue
@@ -77,37 +100,162 @@ def extract_tar(
                 continue
             dest = os.path.join(output_dir, encode(p, ENCODING))
             if e.pathname.endswith("/") or e.isdir():
-                _make_dirs(dest)
+                if dest not in dirs:
+                    _make_dirs(dest)
+                    dirs.add(dest)
+                continue
+
+            dirname = os.path.dirname(dest)
+            if dirname not in dirs:
+                _make_dirs(dirname)
+                dirs.add(dirname)
+
+            if e.ishardlink() or e.issym():
+                if check_duplicates and (dest in writer or os.path.exists(dest)):
+                    raise _duplicate_error(dest, strip_components)
+                writer.wait(dest)
+
+                if e.ishardlink():
+                    hardlink = _strip_prefix(six.ensure_text(e.hardlink, ENCODING), strip_components)
+                    src = os.path.join(output_dir, encode(hardlink, ENCODING))
+                    # Link target must be written completely
+                    writer.wait(src)
+                    _hardlink(src, dest)
+                else:
+                    src = _strip_prefix(e.linkname, strip_components)
+                    _symlink(src, dest)
                 continue
 
-            if strip_components and fail_on_duplicates:
-                if os.path.exists(dest):
-                    raise Exception(
-                        "The file {} is duplicated because of strip_components={}".format(dest, strip_components)
-                    )
+            if writer.parallel and e.size <= SMALL_FILE_SIZE:
+                data = tarfile.read(e.size) if e.size else b""
+                writer.write_data(dest, e.mode, e.mtime, data)
+            else:
+                writer.write_stream(dest, e.mode, e.mtime, tarfile)
 
-            _make_dirs(os.path.dirname(dest))
 
-            if e.ishardlink():
-                src = os.path.join(output_dir, _strip_prefix(e.hardlink, strip_components))
-                _hardlink(src, dest)
-                continue
-            if e.issym():
-                src = _strip_prefix(e.linkname, strip_components)
-                _symlink(src, dest)
-                continue
+def _duplicate_error(dest, strip_components):
+    return Exception("The file {} is duplicated because of strip_components={}".format(dest, strip_components))
+
+
+class _FileWriter(object):
+    """
+    Writes extracted files in the calling thread or in a thread pool.
+
+    Small files are written by the pool in batches. Operations on a path keep the archive order:
+    pending write of the path is waited for before the path is written again or linked to.
+    """
+
+    def __init__(self, threads, apply_mtime, exclusive_strip_components=None):
+        self._pool = ThreadPool(threads) if threads > 1 else None
+        self._apply_mtime = apply_mtime
+        self._strip_components = exclusive_strip_components
+        # Existing file is a duplicate if strip_components is checked, open fails for it instead of a stat call
+        self._flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        if exclusive_strip_components:
+            self._flags |= os.O_EXCL
+        self._batch = []
+        self._batch_size = 0
+        # dest -> async result of its batch, None if the batch is not submitted yet
+        self._pending = {}
+        # (async result, paths, size) of submitted batches in order
+        self._submitted = collections.deque()
+        self._submitted_size = 0
+
+    @property
+    def parallel(self):
+        return self._pool is not None
+
+    def __contains__(self, path):
+        return path in self._pending
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pool is None:
+            return
+        finished = False
+        try:
+            if exc_type is None:
+                self._submit()
+                while self._submitted:
+                    self._wait_oldest()
+                finished = True
+        finally:
+            if finished:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
 
-            with open(dest, "wb") as f:
-                if hasattr(os, "fchmod"):
-                    os.fchmod(f.fileno(), e.mode & 0o7777)
-                libarchive.call_and_check(
-                    _libarchive.archive_read_data_into_fd,
-                    tarfile._a,
-                    tarfile._a,
-                    f.fileno(),
-                )
-            if apply_mtime:
-                os.utime(dest, (e.mtime, e.mtime))
+    def wait(self, path):
+        if path not in self._pending:
+            return
+        if self._pending[path] is None:
+            self._submit()
+        self._pending[path].get()
+
+    def write_data(self, dest, mode, mtime, data):
+        # Batch is written in order by a single thread
+        if self._pending.get(dest) is not None:
+            self.wait(dest)
+        self._batch.append((dest, mode, mtime, data))
+        self._batch_size += len(data)
+        self._pending[dest] = None
+        if len(self._batch) >= BATCH_FILES or self._batch_size >= BATCH_SIZE:
+            self._submit()
+
+    def write_stream(self, dest, mode, mtime, tarfile):
+        def fill(f):
+            libarchive.call_and_check(
+                _libarchive.archive_read_data_into_fd,
+                tarfile._a,
+                tarfile._a,
+                f.fileno(),
+            )
+
+        self.wait(dest)
+        self._write(dest, mode, mtime, fill)
+
+    def _submit(self):
+        if not self._batch:
+            return
+        batch, size = self._batch, self._batch_size
+        self._batch, self._batch_size = [], 0
+        result = self._pool.apply_async(self._write_batch, (batch,))
+        paths = [item[0] for item in batch]
+        for path in paths:
+            self._pending[path] = result
+        self._submitted.append((result, paths, size))
+        self._submitted_size += size
+        while self._submitted_size > MAX_PENDING_SIZE:
+            self._wait_oldest()
+
+    def _wait_oldest(self):
+        result, paths, size = self._submitted.popleft()
+        self._submitted_size -= size
+        for path in paths:
+            if self._pending.get(path) is result:
+                del self._pending[path]
+        result.get()
+
+    def _write_batch(self, batch):
+        for dest, mode, mtime, data in batch:
+            self._write(dest, mode, mtime, lambda f: f.write(data))
+
+    def _write(self, dest, mode, mtime, fill):
+        try:
+            fd = os.open(dest, self._flags, 0o666)
+        except OSError as e:
+            if e.errno == errno.EEXIST and self._strip_components:
+                raise _duplicate_error(dest, self._strip_components)
+            raise
+        with os.fdopen(fd, "wb") as f:
+            if hasattr(os, "fchmod"):
+                os.fchmod(f.fileno(), mode & 0o7777)
+            fill(f)
+        if self._apply_mtime:
+            os.utime(dest, (mtime, mtime))
 
 
 def _strip_prefix(path, strip_components):
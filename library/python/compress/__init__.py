@@ -1,5 +1,6 @@
 from io import open
 
+import bisect
 import struct
 import json
 import os
@@ -11,12 +12,24 @@ import library.python.codecs as lpc
 
 logger = logging.getLogger('compress')
 
+BLOCK_SIZE = 16 * 1024 * 1024
+INDEX_VERSION = 1
+INDEX_MAGIC = b'ucindex1'
+# offset of index json, index magic
+INDEX_TRAILER = struct.Struct('<Q8s')
+
+# ext -> codec, checked codecs only
+_codecs = {}
+
 
 def list_all_codecs():
     return sorted(frozenset(lpc.list_all_codecs()))
 
 
 def find_codec(ext):
+    if ext in _codecs:
+        return _codecs[ext]
+
     def ext_compress(x):
         return lpc.dumps(ext, x)
 
@@ -25,7 +38,9 @@ def find_codec(ext):
 
     ext_decompress(ext_compress(b''))
 
-    return {'c': ext_compress, 'd': ext_decompress, 'n': ext}
+    codec = _codecs[ext] = {'c': ext_compress, 'd': ext_decompress, 'n': ext}
+
+    return codec
 
 
 def codec_for(path):
@@ -38,7 +53,23 @@ def codec_for(path):
     raise Exception('unsupported file %s' % path)
 
 
-def compress(fr, to, codec=None, fopen=open, threads=1):
+def compress(fr, to, codec=None, fopen=open, threads=1, index=False):
+    """Index is written after the end of stream, so readers without index support skip it"""
+    with fopen(fr, 'rb') as f:
+        info = {}
+
+        if fr:
+            info['size'] = os.path.getsize(fr)
+
+        _compress(f, to, codec, info, fopen, threads, index)
+
+
+def compress_stream(stream, to, codec=None, fopen=open, threads=1, index=False):
+    """Compresses content of a binary file object, e.g. a pipe, header has no size then"""
+    _compress(stream, to, codec, {}, fopen, threads, index)
+
+
+def _compress(stream, to, codec, info, fopen, threads, index):
     if codec:
         codec = find_codec(codec)
     else:
@@ -47,39 +78,49 @@ def compress(fr, to, codec=None, fopen=open, threads=1):
     func = codec['c']
 
     def iter_blocks():
-        with fopen(fr, 'rb') as f:
-            while True:
-                chunk = f.read(16 * 1024 * 1024)
+        while True:
+            chunk = stream.read(BLOCK_SIZE)
 
-                if chunk:
-                    yield chunk
-                else:
-                    yield b''
+            if chunk:
+                yield chunk
+            else:
+                yield b''
 
-                    return
+                return
 
     def iter_results():
-        info = {
-            'codec': codec['n'],
-        }
+        yield 0, json.dumps(dict(info, codec=codec['n']), sort_keys=True) + '\n'
 
-        if fr:
-            info['size'] = os.path.getsize(fr)
-
-        yield json.dumps(info, sort_keys=True) + '\n'
+        for r in lpp.par_apply(iter_blocks(), lambda x: (len(x), func(x)), threads):
+            yield r
 
-        for c in lpp.par_apply(iter_blocks(), func, threads):
-            yield c
+    # [uncompressed offset, compressed offset] of data blocks
+    blocks = []
+    offset = 0
+    size = 0
 
     with fopen(to, 'wb') as f:
-        for c in iter_results():
+        for n, c in iter_results():
             logger.debug('complete %s', len(c))
+
+            if not isinstance(c, bytes):
+                c = c.encode('utf-8')
+
             f.write(struct.pack('<I', len(c)))
+            f.write(c)
 
-            try:
-                f.write(c)
-            except TypeError:
-                f.write(c.encode('utf-8'))
+            if n:
+                blocks.append([size, offset])
+                size += n
+
+            offset += 4 + len(c)
+
+        if index:
+            data = json.dumps({'version': INDEX_VERSION, 'size': size, 'blocks': blocks}).encode('utf-8')
+            # Zero length stops reading of the stream
+            f.write(struct.pack('<I', 0))
+            f.write(data)
+            f.write(INDEX_TRAILER.pack(offset + 4, INDEX_MAGIC))
 
 
 def decompress(fr, to, codec=None, fopen=open, threads=1):
@@ -145,3 +186,202 @@ def decompress(fr, to, codec=None, fopen=open, threads=1):
                 f.write(c)
             else:
                 break
+
+
+def read_index(f):
+    """Returns index of seekable file object f or None if the stream has no index"""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+
+    if end < INDEX_TRAILER.size:
+        return None
+
+    f.seek(end - INDEX_TRAILER.size)
+    offset, magic = INDEX_TRAILER.unpack(f.read(INDEX_TRAILER.size))
+
+    if magic != INDEX_MAGIC or offset > end - INDEX_TRAILER.size:
+        return None
+
+    f.seek(offset)
+    index = json.loads(f.read(end - INDEX_TRAILER.size - offset).decode('utf-8'))
+
+    if index.get('version') != INDEX_VERSION:
+        logger.debug('unsupported index version %s', index.get('version'))
+
+        return None
+
+    return index
+
+
+class BlockReader(object):
+    """
+    Random access to the uncompressed content of a stream, only blocks with requested data are decompressed.
+
+    Blocks are located by the trailing index if the stream has one,
+    otherwise by decompressing the stream up to the requested offset once.
+    """
+
+    def __init__(self, path, codec=None, fopen=open):
+        self._f = fopen(path, 'rb')
+
+        try:
+            self._init(path, codec)
+        except Exception:
+            self._f.close()
+
+            raise
+
+    def _init(self, path, codec):
+        # uncompressed and compressed offsets of located blocks
+        self._offsets = []
+        self._positions = []
+        # uncompressed end of located blocks, size is known when all blocks are located
+        self._end = 0
+        self._size = None
+        self._pos = 0
+        self._block = (None, b'')
+
+        hdr = {}
+        chunk = self._read_chunk(0)
+
+        if chunk is None:
+            raise Exception('empty stream')
+
+        try:
+            hdr = json.loads(chunk)
+            # compressed offset of the first block not located yet
+            self._scan = 4 + len(chunk)
+        except Exception as e:
+            logger.info('can not parse header, suspect old format: %s', e)
+            self._scan = 0
+
+        if 'codec' in hdr:
+            self._codec = find_codec(hdr['codec'])
+        elif codec:
+            self._codec = find_codec(codec)
+        else:
+            self._codec = codec_for(path)
+
+        index = read_index(self._f)
+
+        if index is not None:
+            self._offsets = [b[0] for b in index['blocks']]
+            self._positions = [b[1] for b in index['blocks']]
+            self._end = self._size = index['size']
+
+    def _read_chunk(self, pos):
+        self._f.seek(pos)
+        ll = self._f.read(4)
+
+        if len(ll) < 4:
+            return None
+
+        ll = struct.unpack('<I', ll)[0]
+
+        if not ll:
+            return None
+
+        if ll > 100000000:
+            raise Exception('broken stream')
+
+        return self._f.read(ll)
+
+    def _scan_block(self):
+        chunk = self._read_chunk(self._scan)
+        data = self._codec['d'](chunk) if chunk is not None else b''
+
+        if not data:
+            self._size = self._end
+
+            return
+
+        self._block = (len(self._offsets), data)
+        self._offsets.append(self._end)
+        self._positions.append(self._scan)
+        self._end += len(data)
+        self._scan += 4 + len(chunk)
+
+    def _locate(self, offset):
+        while offset >= self._end and self._size is None:
+            self._scan_block()
+
+        if offset >= self._end:
+            return None
+
+        return bisect.bisect_right(self._offsets, offset) - 1
+
+    def _get_block(self, n):
+        if self._block[0] != n:
+            self._block = (n, self._codec['d'](self._read_chunk(self._positions[n])))
+
+        return self._block[1]
+
+    @property
+    def size(self):
+        while self._size is None:
+            self._scan_block()
+
+        return self._size
+
+    def read_range(self, offset, size):
+        chunks = []
+
+        while size > 0:
+            n = self._locate(offset)
+
+            if n is None:
+                break
+
+            data = self._get_block(n)
+            start = offset - self._offsets[n]
+            chunk = data[start : start + size]
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+
+        return b''.join(chunks)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.size - self._pos, 0)
+
+        data = self.read_range(self._pos, size)
+        self._pos += len(data)
+
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+
+        if offset < 0:
+            raise ValueError('negative seek position %s' % offset)
+
+        self._pos = offset
+
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+
+def read_range(path, offset, size, codec=None, fopen=open):
+    with BlockReader(path, codec=codec, fopen=fopen) as r:
+        return r.read_range(offset, size)
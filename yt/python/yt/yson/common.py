@@ -28,7 +28,8 @@ class StreamWrap(object):
         if n == 0:
             return self.stream.read(0)
 
-        assert n == 1
+        if n != 1:
+            return self._read_chunk(n)
 
         if self.state == 0:
             if self.pos == len(self.header):
@@ -57,6 +58,36 @@ class StreamWrap(object):
         if self.state == 3:
             return b""
 
+    def read1(self, n):
+        """Reads at most one chunk of the wrapped stream, see io.BufferedIOBase.read1."""
+        return self._read_chunk(n, getattr(self.stream, "read1", None) or self.stream.read)
+
+    def _read_chunk(self, n, read=None):
+        result = b""
+        if self.state == 0:
+            result = self.header[self.pos:self.pos + n]
+            self.pos += len(result)
+            if self.pos == len(self.header):
+                self.state += 1
+            if len(result) == n:
+                return result
+
+        if self.state == 1:
+            data = (read or self.stream.read)(n - len(result))
+            if data:
+                return result + data
+            self.state += 1
+            self.pos = 0
+
+        if self.state == 2:
+            footer = self.footer[self.pos:self.pos + n - len(result)]
+            self.pos += len(footer)
+            if self.pos == len(self.footer):
+                self.state += 1
+            result += footer
+
+        return result
+
 
 _ENCODING_SENTINEL = object()
 
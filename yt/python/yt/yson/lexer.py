@@ -27,11 +27,12 @@ from .common import (
 
 try:
     from yt.packages.six.moves import xrange
-    from yt.packages.six import int2byte, iterbytes
+    from yt.packages.six import int2byte, indexbytes
 except ImportError:
     from six.moves import xrange
-    from six import int2byte, iterbytes
+    from six import int2byte, indexbytes
 
+import re
 import struct
 
 _SEEMS_INT64 = int2byte(0)
@@ -42,21 +43,58 @@ PERCENT_LITERALS = [b"true", b"false", b"nan", b"inf", b"-inf", b"+inf"]
 PERCENT_LITERAL_LENGTH = dict((s[0:1], len(s)) for s in PERCENT_LITERALS)
 assert len(PERCENT_LITERALS) == len(PERCENT_LITERAL_LENGTH)
 
+_START_STATES = {
+    b"#": TOKEN_HASH,
+    b"(": TOKEN_LEFT_PARENTHESIS,
+    b")": TOKEN_RIGHT_PARENTHESIS,
+    b",": TOKEN_COMMA,
+    b":": TOKEN_COLON,
+    b";": TOKEN_SEMICOLON,
+    b"<": TOKEN_LEFT_ANGLE,
+    b"=": TOKEN_EQUALS,
+    b">": TOKEN_RIGHT_ANGLE,
+    b"[": TOKEN_LEFT_BRACKET,
+    b"]": TOKEN_RIGHT_BRACKET,
+    b"{": TOKEN_LEFT_BRACE,
+    b"}": TOKEN_RIGHT_BRACE,
+}
+
+_DOUBLE = struct.Struct("<d")
+_MAX_VARINT_LENGTH = 10
+
+# Byte classes of the buffered lexer, they match the same bytes as the checks of YsonLexer.
+_WHITESPACES = re.compile(br"\s*")
+_UNQUOTED_STRING = re.compile(br"[A-Za-z0-9_%.\-]*")
+_NUMERIC = re.compile(br"[0-9+\-.eEu]*")
+_NUMERIC_TYPE_CHAR = re.compile(br"[eE.u]")
+_QUOTED_STRING_BODY = re.compile(br'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# Whitespaces followed by punctuation, quoted string, unquoted string, numeric literal or binary literal marker
+_TOKEN = re.compile(
+    br'\s*(?:([;=\[\]{}<>():,])|"([^"\\]*(?:\\.[^"\\]*)*)"|([A-Za-z_][A-Za-z0-9_%.\-]*)|([+\-0-9][0-9+\-.eEu]*)'
+    br'|([\x01-\x06]))',
+    re.DOTALL)
+
 
 def _get_numeric_type(string):
-    for code in iterbytes(string):
-        ch = int2byte(code)
-        if ch == b"E" or ch == b"e" or ch == b".":
-            return _SEEMS_DOUBLE
-        elif ch == b"u":
-            return _SEEMS_UINT64
-    return _SEEMS_INT64
+    match = _NUMERIC_TYPE_CHAR.search(string)
+    if match is None:
+        return _SEEMS_INT64
+    if match.group() == b"u":
+        return _SEEMS_UINT64
+    return _SEEMS_DOUBLE
 
 
 def _zig_zag_decode(value):
     return (value >> 1) ^ -(value & 1)
 
 
+def _check_binary_length(length, lexer):
+    if length < 0:
+        raise_yson_error(
+            "Negative binary string literal length {0} in Yson".format(length),
+            lexer.get_position_info())
+
+
 class YsonLexer(object):
     def __init__(self, stream, encoding=None, output_buffer=None):
         assert (encoding is _ENCODING_SENTINEL) != (output_buffer is None), \
@@ -71,22 +109,7 @@ class YsonLexer(object):
         self._output_buffer = output_buffer
 
     def _get_start_state(self, ch):
-        tokens = {
-            b"#": TOKEN_HASH,
-            b"(": TOKEN_LEFT_PARENTHESIS,
-            b")": TOKEN_RIGHT_PARENTHESIS,
-            b",": TOKEN_COMMA,
-            b":": TOKEN_COLON,
-            b";": TOKEN_SEMICOLON,
-            b"<": TOKEN_LEFT_ANGLE,
-            b"=": TOKEN_EQUALS,
-            b">": TOKEN_RIGHT_ANGLE,
-            b"[": TOKEN_LEFT_BRACKET,
-            b"]": TOKEN_RIGHT_BRACKET,
-            b"{": TOKEN_LEFT_BRACE,
-            b"}": TOKEN_RIGHT_BRACE,
-        }
-        return tokens.get(ch)
+        return _START_STATES.get(ch)
 
     def get_next_token(self):
         self._skip_whitespaces()
@@ -165,6 +188,7 @@ class YsonLexer(object):
         return self._lookahead
 
     def _read_binary_chars(self, char_count):
+        _check_binary_length(char_count, self)
         if self._output_buffer is not None:
             string = self._stream.read(char_count)
             self._position += len(string)
@@ -350,12 +374,14 @@ class YsonLexer(object):
 
     def _parse_binary_double(self):
         self._expect_char(DOUBLE_MARKER)
-        bytes_ = self._read_binary_chars(struct.calcsize(b"<d"))
+        bytes_ = self._read_binary_chars(_DOUBLE.size)
         if self._output_buffer is None:
-            return struct.unpack(b"<d", bytes_)[0]
+            return _DOUBLE.unpack(bytes_)[0]
 
     def _parse_numeric(self):
-        string = self._read_numeric()
+        return self._parse_numeric_string(self._read_numeric())
+
+    def _parse_numeric_string(self, string):
         numeric_type = _get_numeric_type(string)
         if numeric_type == _SEEMS_INT64:
             try:
@@ -390,3 +416,242 @@ class YsonLexer(object):
                     "Failed to parse Double literal {0} in Yson".format(string),
                     self.get_position_info())
         return result, token_type
+
+
+class BufferedYsonLexer(YsonLexer):
+    """Lexer reading the stream by large chunks.
+
+    Literals are scanned in the buffer with precompiled byte class patterns instead of byte by byte reads.
+    The stream is read ahead of the current token, so the lexer is only suitable when the stream is parsed to its end.
+    Streams with read1 (buffered files, pipes and sockets) are read by it, so a chunk is not awaited
+    longer than the data already sent.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, stream, encoding=None, output_buffer=None):
+        super(BufferedYsonLexer, self).__init__(stream, encoding=encoding, output_buffer=output_buffer)
+        self._buffer = b""
+        self._pos = 0
+        self._eof = False
+        self._read_some = getattr(stream, "read1", None) or stream.read
+
+    def _fill(self, size):
+        """Makes at least `size` bytes available in the buffer unless the stream ends, returns the available size."""
+        available = len(self._buffer) - self._pos
+        while available < size and not self._eof:
+            chunk = self._read_some(max(self.CHUNK_SIZE, size - available))
+            if not chunk:
+                self._eof = True
+                break
+            self._buffer = self._buffer[self._pos:] + chunk
+            self._pos = 0
+            available = len(self._buffer)
+        return available
+
+    def _match(self, pattern):
+        """Matches `pattern` at the current position, the match is extended over chunk boundaries."""
+        while True:
+            match = pattern.match(self._buffer, self._pos)
+            if match.end() < len(self._buffer) or self._eof:
+                return match
+            # Grow geometrically to keep long literals linear
+            self._fill(2 * (len(self._buffer) - self._pos) + 1)
+
+    def _advance(self, end, binary_input=False):
+        start = self._pos
+        buffer = self._buffer
+        self._offset += end - start
+        newline = -1 if binary_input else buffer.rfind(b"\n", start, end)
+        if newline == -1:
+            self._position += end - start
+        else:
+            self._line_index += buffer.count(b"\n", start, end)
+            self._position = end - newline
+        if self._output_buffer is not None:
+            self._output_buffer += buffer[start:end]
+        self._pos = end
+        return buffer[start:end]
+
+    def get_next_token(self):
+        # Fast path: tokens lying entirely in the buffer are recognized by a single match
+        match = _TOKEN.match(self._buffer, self._pos)
+        if match is None or (match.end() == len(self._buffer) and not self._eof):
+            return super(BufferedYsonLexer, self).get_next_token()
+
+        kind = match.lastindex
+        string = match.group(kind)
+        self._advance(match.end())
+        if kind == 5:
+            return self._get_binary_token(string)
+        if kind == 1:
+            return YsonToken(value=self._maybe_value(string), type=_START_STATES[string])
+        if kind == 4:
+            value, token_type = self._parse_numeric_string(string)
+            return YsonToken(value=self._maybe_value(value), type=token_type)
+        if self._output_buffer is not None:
+            return YsonToken(value=None, type=TOKEN_STRING)
+        if kind == 2 and b"\\" in string:
+            string = self._unescape(string)
+        return YsonToken(value=self._decode_string(string), type=TOKEN_STRING)
+
+    def _get_binary_token(self, marker):
+        # Marker is already consumed
+        if marker == STRING_MARKER:
+            length = _zig_zag_decode(self._read_varint())
+            string = self._read_binary_chars(length)
+            if self._output_buffer is not None:
+                return YsonToken(value=None, type=TOKEN_STRING)
+            return YsonToken(value=self._decode_string(string), type=TOKEN_STRING)
+        if marker == INT64_MARKER:
+            value = _zig_zag_decode(self._read_varint())
+            return YsonToken(value=self._maybe_value(value), type=TOKEN_INT64)
+        if marker == UINT64_MARKER:
+            value = yson_types.YsonUint64(self._read_varint())
+            return YsonToken(value=self._maybe_value(value), type=TOKEN_UINT64)
+        if marker == DOUBLE_MARKER:
+            value = _DOUBLE.unpack(self._read_binary_chars(_DOUBLE.size))[0]
+            return YsonToken(value=self._maybe_value(value), type=TOKEN_DOUBLE)
+        return YsonToken(value=self._maybe_value(marker == TRUE_MARKER), type=TOKEN_BOOLEAN)
+
+    def _advance_to_end(self, binary_input=False):
+        # Reading past the end is counted as one more char, as YsonLexer does
+        self._advance(len(self._buffer), binary_input)
+        self._offset += 1
+        self._position += 1
+
+    def _peek_char(self):
+        if self._pos >= len(self._buffer) and not self._fill(1):
+            return b""
+        return self._buffer[self._pos:self._pos + 1]
+
+    def _read_char(self, binary_input=False):
+        if not self._peek_char():
+            self._advance_to_end()
+            return b""
+        return self._advance(self._pos + 1, binary_input)
+
+    def _read_binary_chars(self, char_count):
+        _check_binary_length(char_count, self)
+        available = self._fill(char_count)
+        if available < char_count:
+            self._advance_to_end(True)
+            raise_yson_error(
+                "Premature end-of-stream while reading byte {0} out of {1}".format(available + 1, char_count),
+                self.get_position_info())
+        return self._advance(self._pos + char_count, True)
+
+    def _skip_whitespaces(self):
+        self._advance(self._match(_WHITESPACES).end())
+
+    def _read_varint(self):
+        self._fill(_MAX_VARINT_LENGTH)
+        buffer = self._buffer
+        pos = self._pos
+        end = min(len(buffer), pos + _MAX_VARINT_LENGTH)
+        result = 0
+        shift = 0
+        while pos < end:
+            byte = indexbytes(buffer, pos)
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        else:
+            if pos - self._pos == _MAX_VARINT_LENGTH:
+                self._advance(pos, True)
+                raise_yson_error(
+                    "Varinteger is too large for Int64 in Yson",
+                    self.get_position_info())
+            self._advance_to_end()
+            raise_yson_error(
+                "Premature end-of-stream while reading varinteger in Yson",
+                self.get_position_info())
+        self._advance(pos, True)
+        if result > 2 ** 64 - 1:
+            raise_yson_error(
+                "Varinteger is too large for Int64 in Yson",
+                self.get_position_info())
+        return yson_types._YsonIntegerBase(result)
+
+    def _read_quoted_string(self):
+        self._expect_char(b'"')
+        while True:
+            end = _QUOTED_STRING_BODY.match(self._buffer, self._pos).end()
+            # Body stops either at the closing quote or at the escape character at the end of the buffer
+            if self._buffer[end:end + 1] == b'"':
+                break
+            if self._eof:
+                self._advance_to_end()
+                raise_yson_error(
+                    "Premature end-of-stream while reading string literal in Yson",
+                    self.get_position_info())
+            self._fill(2 * (len(self._buffer) - self._pos) + 1)
+        string = self._advance(end)
+        self._read_char()
+        if self._output_buffer is None:
+            return self._decode_string(self._unescape(string))
+
+    def _read_unquoted_string(self):
+        string = self._advance(self._match(_UNQUOTED_STRING).end())
+        if self._output_buffer is None:
+            return self._decode_string(string)
+
+    def _read_numeric(self):
+        string = self._advance(self._match(_NUMERIC).end())
+        if not string:
+            raise_yson_error(
+                "Premature end-of-stream while parsing numeric literal in Yson",
+                self.get_position_info())
+        return string
+
+
+if __name__ == "__main__":
+    import io
+    import os
+    import sys
+    import threading
+    import time
+
+    from .parser import load_list_fragment
+    from .writer import dumps
+
+    size = (int(sys.argv[1]) if len(sys.argv) > 1 else 300) * 1024 * 1024
+
+    rows = [
+        {"key": "key{0}".format(i), "value": "value with spaces {0}".format(i) * 3, "index": i, "weight": i / 7.0,
+         "tags": ["a", "b", i % 2 == 0]}
+        for i in range(1000)
+    ]
+
+    def make_data(yson_format):
+        block = b"".join(dumps(row, yson_format=yson_format) + b";" for row in rows)
+        return block * (size // len(block) + 1)
+
+    def from_pipe(data):
+        read_fd, write_fd = os.pipe()
+
+        def write():
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(data)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        return os.fdopen(read_fd, "rb"), writer
+
+    for yson_format in "text", "binary":
+        data = make_data(yson_format)
+        for source in "memory", "pipe":
+            if source == "pipe":
+                stream, writer = from_pipe(data)
+            else:
+                stream, writer = io.BytesIO(data), None
+            start = time.time()
+            count = sum(1 for _ in load_list_fragment(stream))
+            elapsed = time.time() - start
+            if writer is not None:
+                writer.join()
+            stream.close()
+            print("{0} from {1}: {2} rows, {3:.1f} MiB in {4:.2f}s, {5:.1f} MiB/s".format(
+                yson_format, source, count, len(data) / 1048576.0, elapsed, len(data) / 1048576.0 / elapsed))
@@ -36,7 +36,7 @@ class YsonParser(object):
         # unicode strings.
         if _is_text_reader(stream) and PY3:
             raise TypeError("Only binary streams are supported by YSON parser")
-        self._tokenizer = YsonTokenizer(stream, encoding)
+        self._tokenizer = YsonTokenizer(stream, encoding, buffered=True)
         self._always_create_attributes = always_create_attributes
         self._encoding = encoding
 
@@ -157,13 +157,23 @@ class YsonParser(object):
         self._tokenizer.get_current_token().expect_type(TOKEN_END_OF_STREAM)
         return result
 
+    def parse_list_fragment(self):
+        self._tokenizer.parse_next()
+        while self._tokenizer.get_current_type() != TOKEN_END_OF_STREAM:
+            yield self._parse_any()
+            self._tokenizer.parse_next()
+            if self._tokenizer.get_current_type() == TOKEN_END_OF_STREAM:
+                break
+            self._tokenizer.get_current_token().expect_type(TOKEN_SEMICOLON)
+            self._tokenizer.parse_next()
+
 
 class RawYsonParser(object):
     def __init__(self, stream):
         if _is_text_reader(stream) and PY3:
             raise TypeError("Only binary streams are supported by YSON parser")
         self._buffer = bytearray()
-        self._tokenizer = YsonTokenizer(stream, output_buffer=self._buffer)
+        self._tokenizer = YsonTokenizer(stream, output_buffer=self._buffer, buffered=True)
 
     def _parse_mapping(self, end_token):
         while True:
@@ -242,6 +252,17 @@ class RawYsonParser(object):
             self._tokenizer.parse_next()
 
 
+def _get_encoding(encoding):
+    if not PY3 and encoding is not _ENCODING_SENTINEL and encoding is not None:
+        raise YsonError("Encoding parameter is not supported for Python 2")
+
+    if encoding is _ENCODING_SENTINEL:
+        if PY3:
+            return "utf-8"
+        return None
+    return encoding
+
+
 def load(stream, yson_type=None, always_create_attributes=True, raw=None,
          encoding=_ENCODING_SENTINEL, lazy=False):
     """Deserializes object from YSON formatted stream `stream`.
@@ -256,14 +277,7 @@ def load(stream, yson_type=None, always_create_attributes=True, raw=None,
             raise YsonError("Raw mode is only supported for list fragments")
         return RawYsonParser(stream).parse()
 
-    if not PY3 and encoding is not _ENCODING_SENTINEL and encoding is not None:
-        raise YsonError("Encoding parameter is not supported for Python 2")
-
-    if encoding is _ENCODING_SENTINEL:
-        if PY3:
-            encoding = "utf-8"
-        else:
-            encoding = None
+    encoding = _get_encoding(encoding)
 
     if yson_type == "list_fragment":
         stream = StreamWrap(stream, b"[", b"]")
@@ -285,3 +299,13 @@ def loads(string, yson_type=None, always_create_attributes=True, raw=None,
     return load(BytesIO(string), yson_type=yson_type,
                 always_create_attributes=always_create_attributes,
                 raw=raw, encoding=encoding, lazy=lazy)
+
+
+def load_list_fragment(stream, always_create_attributes=True, encoding=_ENCODING_SENTINEL):
+    """Deserializes items of YSON list fragment from stream `stream` one by one.
+
+    Unlike :func:`load <.load>` with yson_type="list_fragment" returns generator, so items are parsed lazily
+    and the whole fragment is never kept in memory.
+    """
+    parser = YsonParser(stream, _get_encoding(encoding), always_create_attributes)
+    return parser.parse_list_fragment()
@@ -1,12 +1,13 @@
 from .yson_token import YsonToken, TOKEN_START_OF_STREAM
-from .lexer import YsonLexer
+from .lexer import YsonLexer, BufferedYsonLexer
 from .common import _ENCODING_SENTINEL
 
 
 class YsonTokenizer(object):
-    def __init__(self, input_str, encoding=_ENCODING_SENTINEL, output_buffer=None):
+    def __init__(self, input_str, encoding=_ENCODING_SENTINEL, output_buffer=None, buffered=False):
         self._token = YsonToken(type=TOKEN_START_OF_STREAM)
-        self._lexer = YsonLexer(input_str, encoding=encoding, output_buffer=output_buffer)
+        lexer_class = BufferedYsonLexer if buffered else YsonLexer
+        self._lexer = lexer_class(input_str, encoding=encoding, output_buffer=output_buffer)
 
     def parse_next(self):
         self._token = self._lexer.get_next_token()
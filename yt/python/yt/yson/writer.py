@@ -53,6 +53,7 @@ except ImportError:
                      iteritems, iterkeys, iterbytes, PY3)
 
 import math
+import re
 import struct
 # Python3 compatibility
 try:
@@ -60,7 +61,11 @@ try:
 except ImportError:
     from collections import Iterable, Mapping
 
-__all__ = ["dump", "dumps"]
+__all__ = ["dump", "dumps", "dump_rows"]
+
+# Bytes that _escape_byte does not keep as is
+_ESCAPED_BYTES = re.compile(b'[^\x20-\x7e]|["\\\\]')
+_DOUBLE = struct.Struct("<d")
 
 
 def _is_hex_digit(c):
@@ -93,8 +98,8 @@ def _escape_byte(c, nxt, r):
 
 
 def _escape_bytes(obj):
-    if len(obj) == 0:
-        return b""
+    if _ESCAPED_BYTES.search(obj) is None:
+        return bytes(obj)
 
     res = bytearray()
     iterator = iterbytes(obj)
@@ -126,6 +131,21 @@ def dump(object, stream, yson_format=None, yson_type=None, indent=None,
                        check_circular=check_circular))
 
 
+def dump_rows(rows, stream, yson_format=None, encoding="utf-8", sort_keys=False, check_circular=True):
+    """Serializes iterable `rows` as a YSON list fragment to `stream`.
+
+    Produces the same output as :func:`dump <.dump>` with yson_type="list_fragment",
+    but rows are written one by one through a reusable buffer and flat rows of plain scalars take a fast path.
+
+    :param str yson_format: format of YSON, one of ["binary", "text"].
+    """
+    if yson_format is None:
+        yson_format = "text"
+    if yson_format not in ("text", "binary"):
+        raise YsonError("{0} format is not supported by dump_rows".format(yson_format))
+    RowsDumper(stream, yson_format == "text", encoding, sort_keys, check_circular).dump(rows)
+
+
 class YsonContext(object):
     def __init__(self):
         self.path_parts = []
@@ -440,3 +460,112 @@ class FormatDetails(object):
             return ((key, mapping[key]) for key in sorted(iterkeys(mapping)))
         else:
             return iteritems(mapping)
+
+
+class RowsDumper(object):
+    """Writes rows of a list fragment into a stream.
+
+    Keys are encoded once and cached, scalars of builtin types are dispatched by exact type.
+    Context is not tracked on the fast path: a row that fails is dumped again by Dumper to report the error.
+    """
+
+    BUFFER_SIZE = 1024 * 1024
+    KEY_CACHE_SIZE = 4096
+
+    def __init__(self, stream, is_text, encoding, sort_keys, check_circular):
+        self._stream = stream
+        self._is_text = is_text
+        self._encoding = encoding
+        self._sort_keys = sort_keys
+        self._dumper = Dumper(check_circular, encoding, None, "list_fragment", sort_keys,
+                              is_text=is_text, ignore_inner_attributes=False)
+        self._keys = {}
+        self._context = YsonContext()
+
+        self._scalars = {
+            type(None): lambda value: b"#",
+            float: self._dumper._dump_float,
+        }
+        for type_ in integer_types:
+            self._scalars[type_] = self._dump_integer
+        if is_text:
+            self._scalars[bool] = lambda value: b"%true" if value else b"%false"
+            self._scalars[binary_type] = lambda value: b"".join([b'"', _escape_bytes(value), b'"'])
+        else:
+            self._scalars[bool] = lambda value: TRUE_MARKER if value else FALSE_MARKER
+            self._scalars[binary_type] = lambda value: b"".join(
+                [STRING_MARKER, _dump_varint(_zig_zag_encode(len(value))), value])
+            self._scalars[float] = lambda value: DOUBLE_MARKER + _DOUBLE.pack(value)
+        if encoding is not None:
+            dump_bytes = self._scalars[binary_type]
+            self._scalars[text_type] = lambda value: dump_bytes(value.encode(encoding))
+
+    def _dump_integer(self, value):
+        if -2 ** 63 <= value < 2 ** 63:
+            if self._is_text:
+                return str(value).encode("ascii")
+            return INT64_MARKER + _dump_varint(_zig_zag_encode(value))
+        return self._dump_value(value)
+
+    def _dump_value(self, value):
+        self._dumper._level = 0
+        return self._dumper.dumps(value, self._context)
+
+    def _encode_key(self, key):
+        if type(key) not in (text_type, binary_type):
+            return None
+        if len(self._keys) >= self.KEY_CACHE_SIZE:
+            self._keys.clear()
+        encoded = self._keys[key] = self._dumper._dump_string(key, self._context) + b"="
+        return encoded
+
+    def _dump_row(self, row, buffer):
+        keys = self._keys
+        scalars = self._scalars
+        if self._sort_keys:
+            items = ((key, row[key]) for key in sorted(iterkeys(row)))
+        else:
+            items = iteritems(row)
+
+        buffer += b"{"
+        for key, value in items:
+            encoded_key = keys.get(key)
+            if encoded_key is None:
+                encoded_key = self._encode_key(key)
+                if encoded_key is None:
+                    return False
+            buffer += encoded_key
+            dump = scalars.get(type(value))
+            buffer += dump(value) if dump is not None else self._dump_value(value)
+            buffer += b";"
+        buffer += b"}"
+        return True
+
+    def _dump_row_with_context(self, row, index):
+        if self._dumper._seen_objects:
+            # Left by the failed fast path
+            self._dumper._seen_objects.clear()
+        self._context = YsonContext()
+        self._context.row_index = index
+        self._dumper._level = -1
+        return self._dumper.dumps(row, self._context)
+
+    def dump(self, rows):
+        buffer = bytearray()
+        for index, row in enumerate(rows):
+            start = len(buffer)
+            done = False
+            if type(row) is dict or (isinstance(row, Mapping) and not self._dumper._has_attributes(row)):
+                try:
+                    done = self._dump_row(row, buffer)
+                except YsonError:
+                    pass
+            if not done:
+                del buffer[start:]
+                buffer += self._dump_row_with_context(row, index)
+            buffer += b";\n"
+            if len(buffer) >= self.BUFFER_SIZE:
+                self._stream.write(bytes(buffer))
+                del buffer[:]
+        if buffer:
+            self._stream.write(bytes(buffer))